@@ -0,0 +1,227 @@
+"""
+Benchmarks of the crawler stages on a corpus, e.g. one written by synthetic_corpus.py. Every stage runs in a fresh
+process so that its peak RSS is its own, and the results are written as JSON so that runs of different versions can be
+compared.
+
+Stages:
+    get_file_name: Corpus.get_file_name of every url of the corpus
+    fetch_url: Corpus.fetch_url of every url of the corpus
+    fetch_many: Corpus.fetch_many of every url of the corpus, in batches of FETCH_BATCH_SIZE
+    extract_next_links: Crawler.extract_next_links of every page, fetched beforehand
+    is_valid: Crawler.is_valid of every outlink of every page
+    frontier: Frontier.add_url then get_next_url of every url
+    crawl: a full crawl from the seed url, including writing the analysis
+
+Usage: python benchmark.py CORPUS_DIR [--stages STAGE ...] [--limit N] [--output FILE] [--compare FILE]
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from cbor_record import decode
+from corpus import Corpus
+from crawler import Crawler
+from frontier import Frontier
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("get_file_name", "fetch_url", "fetch_many", "extract_next_links", "is_valid", "frontier", "crawl")
+
+FETCH_BATCH_SIZE = 256
+
+
+def corpus_urls(corpus, limit=None):
+    """
+    Returns the urls of the pages of a corpus, read from their records
+    """
+    urls = []
+    for file_name, _ in corpus.index.items():
+        if limit is not None and len(urls) >= limit:
+            break
+        with open(os.path.join(corpus.corpus_base_dir, file_name), "rb") as record_file:
+            data = record_file.read()
+        record, _ = decode(data)
+        url = record.get(b"url", {}).get(b"value")
+        if url is not None:
+            urls.append(url.decode("utf-8"))
+    return urls
+
+
+def fetch_pages(corpus, urls):
+    """
+    Fetches the pages of urls to be kept in memory. Their bodies are copied out of the corpus files, as every memory
+    map of a file keeps a file descriptor open
+    """
+    pages = []
+    for url in urls:
+        url_data = corpus.fetch_url(url)
+        if url_data["content"] is not None:
+            url_data["content"] = bytes(url_data["content"])
+        pages.append(url_data)
+    return pages
+
+
+def _bench_get_file_name(corpus, urls):
+    start = time.perf_counter()
+    for url in urls:
+        corpus.get_file_name(url)
+    return len(urls), len(urls), time.perf_counter() - start
+
+
+def _bench_fetch_url(corpus, urls):
+    start = time.perf_counter()
+    for url in urls:
+        url_data = corpus.fetch_url(url)
+        if url_data["content"] is not None:
+            bytes(url_data["content"][:1])
+    return len(urls), len(urls), time.perf_counter() - start
+
+
+def _bench_fetch_many(corpus, urls):
+    start = time.perf_counter()
+    for batch_start in range(0, len(urls), FETCH_BATCH_SIZE):
+        for url_data in corpus.fetch_many(urls[batch_start:batch_start + FETCH_BATCH_SIZE]):
+            if url_data["content"] is not None:
+                bytes(url_data["content"][:1])
+    return len(urls), len(urls), time.perf_counter() - start
+
+
+def _bench_extract_next_links(corpus, urls):
+    crawler = Crawler(Frontier(), corpus)
+    pages = fetch_pages(corpus, urls)
+    start = time.perf_counter()
+    for url_data in pages:
+        crawler.extract_next_links(url_data)
+    return len(pages), len(pages), time.perf_counter() - start
+
+
+def _bench_is_valid(corpus, urls):
+    crawler = Crawler(Frontier(), corpus)
+    outlinks = [(url_data, crawler.extract(url_data).links) for url_data in fetch_pages(corpus, urls)
+                if url_data["content"] is not None]
+    count = 0
+    start = time.perf_counter()
+    for url_data, links in outlinks:
+        for link in links:
+            crawler.is_valid(link, url_data)
+        count += len(links)
+    return len(outlinks), count, time.perf_counter() - start
+
+
+def _bench_frontier(corpus, urls):
+    frontier = Frontier()
+    start = time.perf_counter()
+    for url in urls:
+        frontier.add_url(url)
+    while frontier.has_next_url():
+        frontier.get_next_url()
+    return len(urls), 2 * len(urls), time.perf_counter() - start
+
+
+def _bench_crawl(corpus, urls):
+    frontier = Frontier()
+    frontier.load_frontier()
+    crawler = Crawler(frontier, corpus)
+    start = time.perf_counter()
+    crawler.start_crawling()
+    return frontier.fetched, frontier.fetched, time.perf_counter() - start
+
+
+def run_stage(stage, corpus_dir, limit=None):
+    """
+    Runs one stage in the current process, in a temporary working directory. Returns its measurements
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    corpus = Corpus(corpus_dir)
+    urls = corpus_urls(corpus, limit)
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, "w") as devnull:
+        os.chdir(work_dir)
+        # The crawler still prints its progress
+        with contextlib.redirect_stdout(devnull):
+            pages, items, seconds = globals()["_bench_" + stage](corpus, urls)
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "pages": pages,
+        "items": items,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds if seconds else None,
+        "us_per_item": seconds / items * 1e6 if items else None,
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(corpus_dir, stages=STAGES, limit=None):
+    """
+    Runs the stages, each in a new process. Returns the results as a JSON serializable dictionary
+    """
+    corpus_dir = os.path.abspath(corpus_dir)
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus_dir,
+        "limit": limit,
+        "stages": {},
+    }
+    for stage in stages:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            results["stages"][stage] = executor.submit(run_stage, stage, corpus_dir, limit).result()
+        measurements = results["stages"][stage]
+        logger.info("%-20s %8.1f pages/s %10.2f us/item %8.1f MB peak RSS", stage,
+                    measurements["pages_per_second"] or 0, measurements["us_per_item"] or 0,
+                    measurements["peak_rss_bytes"] / (1 << 20))
+    return results
+
+
+def compare(results, baseline):
+    """
+    Logs the change of µs/item and peak RSS of every stage relative to a baseline run
+    """
+    for stage, measurements in results["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None or not before["us_per_item"] or not measurements["us_per_item"]:
+            continue
+        logger.info("%-20s us/item %+6.1f%%  peak RSS %+6.1f%%  (baseline %s)", stage,
+                    100 * (measurements["us_per_item"] / before["us_per_item"] - 1),
+                    100 * (measurements["peak_rss_bytes"] / before["peak_rss_bytes"] - 1), baseline.get("revision"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Benchmarks the crawler stages on a corpus")
+    parser.add_argument("corpus_dir", help="directory containing the corpus files")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="stages to run")
+    parser.add_argument("--limit", type=int, default=None, help="maximum number of urls per stage")
+    parser.add_argument("--output", default=None, help="JSON file for the results. Printed if not given")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.corpus_dir, args.stages, args.limit)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
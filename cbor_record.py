@@ -0,0 +1,315 @@
+"""
+Lazy reader for the CBOR records stored in the corpus. Each corpus file is a CBOR map from field name to a map holding
+the field value under b'value'. Instead of decoding the whole record, read_record walks the top level map, decodes only
+the fields the crawler uses and skips over everything else. The page body is returned as a memoryview into the mapped
+file, so it is never copied. encode_record writes records in the same layout, e.g. for synthetic corpora.
+"""
+import mmap
+import os
+import struct
+
+from metrics import METRICS
+
+# Top level fields decoded by read_record, everything else is skipped
+RAW_CONTENT = b"raw_content"
+HTTP_CODE = b"http_code"
+FINAL_URL = b"final_url"
+IS_REDIRECTED = b"is_redirected"
+HTTP_HEADERS = b"http_headers"
+VALUE = b"value"
+HEADER_FIELDS = frozenset([HTTP_CODE, FINAL_URL, IS_REDIRECTED, HTTP_HEADERS])
+
+BREAK = 0xff
+UINT16 = struct.Struct(">H")
+UINT32 = struct.Struct(">I")
+UINT64 = struct.Struct(">Q")
+FLOAT16 = struct.Struct(">e")
+FLOAT32 = struct.Struct(">f")
+FLOAT64 = struct.Struct(">d")
+
+
+class CborError(ValueError):
+    pass
+
+
+def _read_head(buf, pos):
+    """
+    Reads the initial byte and argument of a data item. Returns (major type, additional info, argument, position)
+    """
+    try:
+        initial = buf[pos]
+    except IndexError:
+        raise CborError("unexpected end of record at %s" % pos)
+    major = initial >> 5
+    info = initial & 0x1f
+    pos += 1
+    if info < 24:
+        return major, info, info, pos
+    try:
+        if info == 24:
+            return major, info, buf[pos], pos + 1
+        if info == 25:
+            return major, info, UINT16.unpack_from(buf, pos)[0], pos + 2
+        if info == 26:
+            return major, info, UINT32.unpack_from(buf, pos)[0], pos + 4
+        if info == 27:
+            return major, info, UINT64.unpack_from(buf, pos)[0], pos + 8
+    except (IndexError, struct.error):
+        raise CborError("unexpected end of record at %s" % pos)
+    if info == 31:
+        return major, info, None, pos
+    raise CborError("invalid additional info %s at %s" % (info, pos - 1))
+
+
+def _string_end(buf, pos, length):
+    """
+    Returns the position after a definite length string of length bytes starting at pos, which must be within buf
+    """
+    end = pos + length
+    if end > len(buf):
+        raise CborError("unexpected end of record in a string at %s" % pos)
+    return end
+
+
+def _skip(buf, pos):
+    """
+    Returns the position right after the data item starting at pos, without decoding it
+    """
+    major, info, arg, pos = _read_head(buf, pos)
+    if major in (0, 1):
+        return pos
+    if major in (2, 3):
+        if arg is None:
+            while buf[pos] != BREAK:
+                pos = _skip(buf, pos)
+            return pos + 1
+        return _string_end(buf, pos, arg)
+    if major in (4, 5):
+        items = 1 if major == 4 else 2
+        if arg is None:
+            while buf[pos] != BREAK:
+                pos = _skip(buf, pos)
+            return pos + 1
+        for _ in range(arg * items):
+            pos = _skip(buf, pos)
+        return pos
+    if major == 6:
+        return _skip(buf, pos)
+    return pos
+
+
+def decode(buf, pos=0, zero_copy=False):
+    """
+    Decodes the data item starting at pos. Returns (value, position after the item). With zero_copy, definite length
+    byte strings are returned as memoryviews into buf instead of bytes
+    """
+    major, info, arg, pos = _read_head(buf, pos)
+    if major == 0:
+        return arg, pos
+    if major == 1:
+        return -1 - arg, pos
+    if major in (2, 3):
+        if arg is None:
+            chunks = []
+            while buf[pos] != BREAK:
+                chunk, pos = decode(buf, pos)
+                chunks.append(chunk)
+            value = (b"" if major == 2 else "").join(chunks)
+            return value, pos + 1
+        end = _string_end(buf, pos, arg)
+        if major == 3:
+            return bytes(buf[pos:end]).decode("utf-8"), end
+        if zero_copy:
+            return memoryview(buf)[pos:end], end
+        return bytes(buf[pos:end]), end
+    if major == 4:
+        values = []
+        if arg is None:
+            while buf[pos] != BREAK:
+                value, pos = decode(buf, pos, zero_copy)
+                values.append(value)
+            return values, pos + 1
+        for _ in range(arg):
+            value, pos = decode(buf, pos, zero_copy)
+            values.append(value)
+        return values, pos
+    if major == 5:
+        values = {}
+        while (buf[pos] != BREAK) if arg is None else (len(values) < arg):
+            key, pos = decode(buf, pos)
+            values[key], pos = decode(buf, pos, zero_copy)
+        return values, (pos + 1 if arg is None else pos)
+    if major == 6:
+        return decode(buf, pos, zero_copy)
+    if info == 20:
+        return False, pos
+    if info == 21:
+        return True, pos
+    if info in (22, 23):
+        return None, pos
+    if info == 25:
+        return FLOAT16.unpack_from(buf, pos - 2)[0], pos
+    if info == 26:
+        return FLOAT32.unpack_from(buf, pos - 4)[0], pos
+    if info == 27:
+        return FLOAT64.unpack_from(buf, pos - 8)[0], pos
+    return arg, pos
+
+
+def encode(value):
+    """
+    Encodes bytes, str, int, bool, None, lists and dicts of them as CBOR
+    """
+    if value is None:
+        return b"\xf6"
+    if value is True:
+        return b"\xf5"
+    if value is False:
+        return b"\xf4"
+    if isinstance(value, int):
+        return _encode_head(0, value) if value >= 0 else _encode_head(1, -1 - value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        return _encode_head(2, len(value)) + value
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+        return _encode_head(3, len(value)) + value
+    if isinstance(value, (list, tuple)):
+        return _encode_head(4, len(value)) + b"".join(encode(item) for item in value)
+    if isinstance(value, dict):
+        return _encode_head(5, len(value)) + b"".join(encode(key) + encode(item) for key, item in value.items())
+    raise TypeError("can't encode %r as CBOR" % type(value))
+
+
+def _encode_head(major, arg):
+    if arg < 24:
+        return bytes([major << 5 | arg])
+    if arg < 0x100:
+        return bytes([major << 5 | 24, arg])
+    if arg < 0x10000:
+        return bytes([major << 5 | 25]) + UINT16.pack(arg)
+    if arg < 0x100000000:
+        return bytes([major << 5 | 26]) + UINT32.pack(arg)
+    return bytes([major << 5 | 27]) + UINT64.pack(arg)
+
+
+def encode_record(url, content, http_code=200, content_type="text/html", is_redirected=False, final_url=None):
+    """
+    Encodes a page as a corpus record, in the layout decode_record reads
+    """
+    headers = [{b"k": {VALUE: b"Server"}, b"v": {VALUE: b"Apache"}}]
+    if content_type is not None:
+        headers.append({b"k": {VALUE: b"Content-Type"}, b"v": {VALUE: content_type.encode("latin-1")}})
+    return encode({
+        b"url": {VALUE: url.encode("utf-8")},
+        HTTP_CODE: {VALUE: http_code},
+        RAW_CONTENT: {VALUE: content},
+        HTTP_HEADERS: {VALUE: headers},
+        IS_REDIRECTED: {VALUE: is_redirected},
+        FINAL_URL: {VALUE: final_url.encode("utf-8") if final_url is not None else None},
+    })
+
+
+def _get_content_type(headers):
+    for header in headers:
+        try:
+            if header[b'k'][VALUE] == b'Content-Type':
+                value = header[b'v'][VALUE]
+                return value.decode("latin-1") if isinstance(value, bytes) else str(value)
+        except (KeyError, TypeError):
+            continue
+    return None
+
+
+def decode_record(buf, include_content=True):
+    """
+    Decodes the fields of a corpus record used by the crawler from a buffer holding the record.
+
+    :param buf: a bytes-like object holding one CBOR record
+    :param include_content: if False the body is skipped without being touched (header-only mode)
+    :return: a dictionary with the keys raw_content (a memoryview, "" if the record has no body, None in header-only
+        mode), http_code, final_url, is_redirected and content_type
+    :raises CborError: if the record is truncated or malformed
+    """
+    try:
+        return _decode_record(buf, include_content)
+    except (IndexError, UnicodeDecodeError) as e:
+        # An indefinite length item running past the end of the buffer, or a text string that isn't utf-8
+        raise CborError("malformed corpus record: %s" % e)
+
+
+def _decode_record(buf, include_content):
+    record = {
+        "raw_content": "" if include_content else None,
+        "http_code": None,
+        "final_url": None,
+        "is_redirected": False,
+        "content_type": None,
+    }
+    major, info, arg, pos = _read_head(buf, 0)
+    if major != 5:
+        raise CborError("corpus record is not a map")
+
+    count = 0
+    while (buf[pos] != BREAK) if arg is None else (count < arg):
+        count += 1
+        key, pos = decode(buf, pos)
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+
+        if key == RAW_CONTENT and include_content:
+            field, pos = decode(buf, pos, zero_copy=True)
+        elif key in HEADER_FIELDS:
+            field, pos = decode(buf, pos)
+        else:
+            pos = _skip(buf, pos)
+            continue
+
+        if not isinstance(field, dict):
+            continue
+        if VALUE in field:
+            value = field[VALUE]
+        elif "value" in field:
+            value = field["value"]
+        else:
+            continue
+        if key == RAW_CONTENT:
+            record["raw_content"] = value
+        elif key == HTTP_CODE:
+            record["http_code"] = int(value)
+        elif key == FINAL_URL:
+            record["final_url"] = value
+        elif key == IS_REDIRECTED:
+            record["is_redirected"] = value
+        elif key == HTTP_HEADERS:
+            record["content_type"] = _get_content_type(value)
+    return record
+
+
+def read_record(file_name, include_content=True, populate=False):
+    """
+    Memory-maps a corpus file and decodes it with decode_record. The mapping stays alive as long as the returned body
+    memoryview is referenced and is released with it. The record also gets the (size, modification time) of the file
+    read as "file_stat"
+    :param populate: read the whole file in while mapping it, so that the body doesn't page fault later, e.g. when
+        reading ahead on another thread
+    """
+    start = METRICS.start()
+    with open(file_name, "rb") as f:
+        stat = os.fstat(f.fileno())
+        try:
+            if populate and include_content and hasattr(mmap, "MAP_POPULATE"):
+                mapped = mmap.mmap(f.fileno(), 0, flags=mmap.MAP_SHARED | mmap.MAP_POPULATE, prot=mmap.PROT_READ)
+            else:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            raise CborError("empty corpus record %s" % file_name)
+    start = METRICS.lap("read", start)
+    try:
+        record = decode_record(mapped, include_content)
+        record["file_stat"] = (stat.st_size, stat.st_mtime_ns)
+        return record
+    finally:
+        METRICS.stop("decode", start)
+        if not include_content:
+            mapped.close()
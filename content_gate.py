@@ -0,0 +1,137 @@
+"""
+Gating of fetched pages before they are parsed. ContentGate looks at the declared Content-Type and the leading bytes of
+a page and routes it to the html or the plain text handler of html_extractor.parse_page, or skips it, e.g. a PDF or an
+image that got past the extension rules of the url filter. UTF-16 pages are transcoded to UTF-8, which the handlers
+parse, and oversized pages are cut to a prefix before parsing.
+"""
+import re
+
+HANDLERS = ("html", "text", "skip")
+
+# Leading bytes of binary formats, checked in order
+SIGNATURES = (
+    (b"%PDF-", "pdf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"PK\x03\x04", "zip"),
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bzip2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"7z\xbc\xaf\x27\x1c", "7z"),
+    (b"Rar!\x1a\x07", "rar"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "ole"),
+    (b"%!PS", "postscript"),
+    (b"{\\rtf", "rtf"),
+    (b"RIFF", "riff"),
+    (b"ID3", "mp3"),
+    (b"OggS", "ogg"),
+    (b"\x00\x00\x01\x00", "ico"),
+    (b"\x7fELF", "executable"),
+    (b"MZ", "executable"),
+)
+
+# Declared types parsed as html: html and the xml types, whose links are in href attributes if anywhere
+MARKUP_TYPES = frozenset(["text/html", "application/xhtml+xml", "text/xml", "application/xml", "application/rss+xml",
+                          "application/atom+xml"])
+# Declared types parsed as plain text besides text/*
+TEXT_TYPES = frozenset(["application/json", "application/javascript", "application/x-javascript"])
+
+# The start of an html or xml document, after any whitespace
+MARKUP_PATTERN = re.compile(rb"\s*<(?:!doctype\s+html|html|head|body|title|meta|link|script|style|div|table|p|a|h[1-6]|"
+                            rb"br|!--|\?xml)[\s>/]", re.I)
+# Any tag, comment, declaration or processing instruction
+TAG_PATTERN = re.compile(rb"<[a-z!?/]", re.I)
+UTF8_BOM = b"\xef\xbb\xbf"
+UTF16_BOMS = (b"\xff\xfe", b"\xfe\xff")
+
+
+def declared_type(content_type):
+    """
+    Returns the lowercase media type of a Content-Type header value, without its parameters, or None
+    """
+    if not content_type:
+        return None
+    if isinstance(content_type, bytes):
+        content_type = content_type.decode("latin-1")
+    return content_type.split(";", 1)[0].strip().lower() or None
+
+
+def utf8_content(content):
+    """
+    Returns a page starting with a UTF-16 byte order mark transcoded to UTF-8, and any other page as is
+    """
+    if bytes(content[:2]) in UTF16_BOMS:
+        return bytes(content).decode("utf-16", errors="replace").encode("utf-8")
+    return content
+
+
+class ContentGate:
+    """
+    This class decides how a fetched page is parsed:
+
+        1. a page not declared as html, xml, text/* or json and starting with the signature of a binary format is
+           skipped. Short signatures such as "MZ" also start text pages
+        2. a page with a NUL byte in its first sniff_size bytes is skipped, unless it is in UTF-16
+        3. a page declared as html or xml is parsed as html, one declared as text/* or json as plain text
+        4. a page declared as anything else, e.g. image/* or application/octet-stream, is skipped unless it starts with
+           html markup
+        5. a page without a declared type is parsed as html if there is a tag in its first sniff_size bytes, otherwise
+           as plain text
+
+    Only the first max_parse_size bytes of a page are parsed, cut back to the end of the last tag (html) or word (text)
+    in them.
+
+    Attributes:
+        max_parse_size: the maximum number of bytes parsed per page, None for no limit
+        sniff_size: the number of leading bytes looked at
+    """
+
+    DEFAULT_MAX_PARSE_SIZE = 2 << 20
+
+    def __init__(self, max_parse_size=DEFAULT_MAX_PARSE_SIZE, sniff_size=1024):
+        self.max_parse_size = max_parse_size
+        self.sniff_size = sniff_size
+
+    def route(self, content, content_type):
+        """
+        Returns (handler, skip reason): the handler of HANDLERS the page is parsed with, and why it is skipped, or None
+        """
+        head = bytes(utf8_content(content[:self.sniff_size]))
+        if head.startswith(UTF8_BOM):
+            head = head[len(UTF8_BOM):]
+        media_type = declared_type(content_type)
+        textual = media_type is not None and (media_type in MARKUP_TYPES or media_type.startswith("text/") or
+                                              media_type in TEXT_TYPES)
+        if not textual:
+            for signature, name in SIGNATURES:
+                if head.startswith(signature):
+                    return "skip", name
+        if b"\x00" in head:
+            return "skip", "binary"
+
+        if media_type in MARKUP_TYPES:
+            return "html", None
+        if textual:
+            return "text", None
+        if media_type is not None:
+            return ("html", None) if MARKUP_PATTERN.match(head) else ("skip", media_type)
+        return ("html", None) if TAG_PATTERN.search(head) else ("text", None)
+
+    def check(self, content, content_type):
+        """
+        Gates a page. Returns (handler, gate, content): the handler the page is parsed with; None, or the ("skipped",
+        reason) or ("truncated", handler) of a page skipped or cut; and the content to be parsed
+        """
+        content = utf8_content(content)
+        handler, reason = self.route(content, content_type)
+        if handler == "skip":
+            return handler, ("skipped", reason), content
+        if self.max_parse_size is None or len(content) <= self.max_parse_size:
+            return handler, None, content
+        prefix = bytes(content[:self.max_parse_size])
+        end = prefix.rfind(b">") + 1 if handler == "html" else max(prefix.rfind(b" "), prefix.rfind(b"\n"))
+        if end > 0:
+            prefix = prefix[:end]
+        return handler, ("truncated", handler), prefix
@@ -1,46 +1,125 @@
 import hashlib
+import itertools
+import logging
 import os
-from urllib.parse import urlparse
-from urllib.request import urlopen
-from cbor import cbor
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+from cbor_record import read_record
+from corpus_index import CorpusIndex
+from fetcher import Fetcher, not_found
+from metrics import METRICS
+from url_canonicalizer import corpus_key
 
-class Corpus:
+logger = logging.getLogger(__name__)
+
+
+def url_digest(url):
+    """
+    Given a url, returns the name of the corpus file the url is stored under
     """
-    This class is responsible for handling corpus related functionalities like mapping a url to its local file name
+    url = corpus_key(url)
+
+    try:
+        hashed_link = hashlib.sha224(url).hexdigest()
+    except (UnicodeEncodeError, TypeError):
+        try:
+            hashed_link = hashlib.sha224(url.encode("utf-8")).hexdigest()
+        except UnicodeEncodeError:
+            hashed_link = str(hash(url))
+    return hashed_link
+
+
+class Corpus(Fetcher):
+    """
+    This class is responsible for handling corpus related functionalities like mapping a url to its local file name.
+    The files in the corpus are indexed once at startup (see CorpusIndex) so lookups never hit the file system.
+    fetch_many reads batches of files on a pool of read_ahead threads, in their order on disk
+
+    Attributes:
+        index_file: the file the index is persisted in across runs, or None
+        read_ahead: the number of files fetch_many reads at once
     """
 
-    def __init__(self, corpus_base_dir):
+    DEFAULT_READ_AHEAD = 16
+
+    def __init__(self, corpus_base_dir, index_file=None, read_ahead=DEFAULT_READ_AHEAD):
         self.corpus_base_dir = os.path.join(corpus_base_dir, "")
+        self.index_file = index_file
+        self.index = CorpusIndex.open(self.corpus_base_dir, index_file)
+        self.read_ahead = read_ahead
+        self._read_pool = None
+        self._read_pool_lock = threading.Lock()
+        # Names of the files read that differ from their index entry, i.e. were rewritten in place since it was built
+        self._changed_files = set()
+
+    def get_digest(self, url):
+        """
+        Given a url, returns the name of the corpus file the url would be stored under
+        """
+        return url_digest(url)
+
+    def get_file_info(self, url):
+        """
+        Given a url, returns a (file address, size) tuple for its local file in the corpus, or None if it doesn't exist
+        """
+        start = METRICS.start()
+        hashed_link = self.get_digest(url)
+        size = self.index.get_size(hashed_link)
+        METRICS.stop("lookup", start)
+        if size is None:
+            return None
+        return os.path.join(self.corpus_base_dir, hashed_link), size
 
     def get_file_name(self, url):
         """
         Given a url, this method looks up for a local file in the corpus and, if existed, returns the file address. Otherwise
         returns None
         """
+        file_info = self.get_file_info(url)
+        return file_info[0] if file_info is not None else None
 
-        pd = urlparse(url)
-        if pd.path:
-            path = pd.path[:-1] if pd.path[-1] == "/" else pd.path
-        else:
-            path = ""
-        url = pd.netloc + path + (("?" + pd.query) if pd.query else "")
+    def get_file_version(self, url):
+        """
+        Given a url, returns a (digest, size, modification time) tuple identifying the current version of its local file,
+        or None if it doesn't exist. The version is the one recorded by the index, so no file is looked at. A file
+        rewritten in place since the index was built still has its indexed version here; fetch_url returns the version
+        of the file it read as url_data["file_version"], which the crawler checks cached extractions against
+        """
+        hashed_link = self.get_digest(url)
+        entry = self.index.lookup(hashed_link)
+        if entry is None:
+            return None
+        return hashed_link, entry.size, entry.mtime_ns
 
-        try:
-            print(pd)
-            hashed_link = hashlib.sha224(url).hexdigest()
-        except (UnicodeEncodeError, TypeError):
-            try:
-                hashed_link = hashlib.sha224(url.encode("utf-8")).hexdigest()
-            except UnicodeEncodeError:
-                hashed_link = str(hash(url))
-        print(hashed_link)
-        print(self.corpus_base_dir)
-        if os.path.exists(os.path.join(self.corpus_base_dir, hashed_link)):
-            return os.path.join(self.corpus_base_dir, hashed_link)
-        return None
+    def spill_index(self, index_file):
+        """
+        Persists a scanned index to index_file and memory-maps it instead, see CorpusIndex.save, e.g. to free memory.
+        Returns True if the index was moved
+        """
+        if self.index.entries is None:
+            return False
+        self.index.save(index_file)
+        self.index = CorpusIndex.load(index_file)
+        return True
+
+    def read_record(self, file_name, include_content=True, populate=False):
+        """
+        Reads the record stored at the given file address (as returned by get_file_name). See cbor_record.decode_record
+        for the returned fields
+        :param populate: read the whole record in now instead of when the body is accessed
+        """
+        return read_record(file_name, include_content, populate)
+
+    def read_order(self, file_name):
+        """
+        Returns the key fetch_many sorts file addresses by to read them in their order on disk: the inode number, which
+        file systems like ext4 allocate roughly along the disk. It is recorded by the index, so no file is looked at
+        """
+        entry = self.index.lookup(os.path.basename(file_name))
+        return entry.inode if entry is not None else 0
 
-    def fetch_url(self, url):
+    def fetch_url(self, url, include_content=True):
         """
         This method, using the given url, should find the corresponding file in the corpus and return a dictionary representing
         the repsonse to the given url. The dictionary contains the following keys:
@@ -52,71 +131,102 @@ class Corpus:
         http_code: the response http status code. 404 if the url does not exist in the corpus
         is_redirected: a boolean indicating if redirection has happened to get the final response
         final_url: the final url after all of the redirections. None if there was no redirection.
+        redirects: the chain of urls requested, starting with url. The corpus doesn't record the intermediate
+        redirections, so this is only the url itself
+        file_version: the version of the file read, see get_file_version
+
+        The record is read lazily (see cbor_record): content is a memoryview into the memory-mapped corpus file, and with
+        include_content=False the body isn't read at all and content is None, which is enough for status and
+        redirection checks.
 
         :param url: the url to be fetched
+        :param include_content: whether to read the body of the page
         :return: a dictionary containing the http response for the given url
         """
 
-        file_name = self.get_file_name(url) # https://poop.com --> https://loltyler1.com/discount/alpha
-        if file_name is None:
-            url_data = {
-                "url": url,
-                "content": None,
-                "http_code": 404,
-                "headers": None,
-                "size": 0,
-                "content_type": None,
-                "is_redirected": False,
-                "final_url": None
-            }
-        else:
-            data_dict = cbor.load(open(file_name, "rb"))
-
-            def get_content_type(data):
-                if b'http_headers' not in data: return None
-
-                hlist = data_dict[b"http_headers"][b'value']
-                for header in hlist:
-                    if header[b'k'][b'value'] == b'Content-Type':
-                        return str(header[b'v'][b'value'])
-                return None
-##################################################################################
-            
-
-            redirected_urls = [url]
-            # current_url = url
-
-            # while True and current_url != data_dict[b'final_url'][b'value']:
-            #     try:
-            #         response = urlopen(current_url)
-            #         if response.getcode() // 100 == 3:
-            #             current_url = response.getheader('Location')
-            #             redirected_urls.append(current_url)
-            #         else:
-            #             break
-            #     #except HTTPError as e:
-            #     #    #handle HTTP errors, if any
-            #     #    break
-            #     except:
-            #         break
-            # if current_url != url:
-            #     redirected_urls.append(current_url)
-            '''
-            start url = "url"
-            #list of redirects = "redirected_urls"
-            #final url = "current_url" when finishes
-            '''
-
-
-            url_data = {
-                "url": url,
-                "content": data_dict[b'raw_content'][b'value'] if b'raw_content' in data_dict and b'value' in data_dict[b'raw_content'] else "",
-                "http_code": int(data_dict[b"http_code"][b'value']),
-                "content_type": get_content_type(data_dict),
-                "size": os.stat(file_name).st_size,
-                "is_redirected": data_dict[b'is_redirected'][b'value'] if b'is_redirected' in data_dict and b'value' in data_dict[b'is_redirected'] else False,
-                "final_url": data_dict[b'final_url'][b'value'] if b'final_url' in data_dict and b'value' in data_dict[b'final_url'] else None,
-                "redirects": redirected_urls #Added
-            }
+        file_info = self.get_file_info(url) # https://poop.com --> https://loltyler1.com/discount/alpha
+        if file_info is None:
+            return not_found(url)
+        return self._read_url(url, file_info, include_content)
 
+    def fetch_many(self, urls, headers_only=()):
+        """
+        Fetches a batch of urls at once and yields their url_data dictionaries, see fetch_url, in the order they
+        complete. The files of the batch are looked up first, sorted by read_order and then read on the read-ahead
+        thread pool, with up to read_ahead reads in flight. Urls that aren't in the corpus are yielded first.
+        The bodies are read in completely by the pool threads, so that processing them doesn't wait for the disk
+        :param urls: the urls to be fetched
+        :param headers_only: the urls whose body isn't needed, see fetch_url include_content
+        """
+        reads = []
+        for url in urls:
+            file_info = self.get_file_info(url)
+            if file_info is None:
+                yield not_found(url)
+            else:
+                reads.append((self.read_order(file_info[0]), url, file_info))
+        reads.sort(key=lambda read: read[0])
+
+        pool = self._get_read_pool()
+        reads = iter(reads)
+        pending = set()
+        try:
+            while True:
+                for _, url, file_info in itertools.islice(reads, self.read_ahead - len(pending)):
+                    pending.add(pool.submit(self._read_url, url, file_info, url not in headers_only, True))
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # The consumer stopped early or a read failed
+            for future in pending:
+                future.cancel()
+
+    def _get_read_pool(self):
+        with self._read_pool_lock:
+            if self._read_pool is None:
+                self._read_pool = ThreadPoolExecutor(self.read_ahead, thread_name_prefix="corpus-read")
+            return self._read_pool
+
+    def _read_url(self, url, file_info, include_content, populate=False):
+        file_name, file_size = file_info
+        record = self.read_record(file_name, include_content, populate)
+        url_data = {
+            "url": url,
+            "content": record["raw_content"],
+            "http_code": int(record["http_code"]),
+            "content_type": record["content_type"],
+            "size": file_size,
+            "is_redirected": record["is_redirected"],
+            "final_url": record["final_url"],
+            "redirects": [url]
+        }
+        if "file_stat" in record:
+            # Of the file read, which may have been rewritten since the index was built
+            hashed_link = os.path.basename(file_name)
+            entry = self.index.lookup(hashed_link)
+            if entry is not None and (entry.size, entry.mtime_ns) != record["file_stat"]:
+                self._changed_files.add(hashed_link)
+            url_data["size"] = record["file_stat"][0]
+            url_data["file_version"] = (hashed_link,) + record["file_stat"]
         return url_data
+
+    def close(self):
+        """
+        Stops the read-ahead threads. If files were rewritten in place since the persisted index was built, which its
+        check at startup doesn't catch, removes the index file so that the next run scans the corpus again
+        """
+        with self._read_pool_lock:
+            if self._read_pool is not None:
+                self._read_pool.shutdown(cancel_futures=True)
+                self._read_pool = None
+        if self._changed_files and self.index_file is not None:
+            logger.info("%s corpus files changed since the corpus index was built, removing %s",
+                        len(self._changed_files), self.index_file)
+            try:
+                os.remove(self.index_file)
+            except FileNotFoundError:
+                pass
+            self._changed_files.clear()
@@ -0,0 +1,200 @@
+import logging
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# What the index records about a corpus file. The inode number orders reads, see Corpus.read_order, and the
+# modification time identifies the version of the file, see Corpus.get_file_version
+FileEntry = namedtuple("FileEntry", ["size", "inode", "mtime_ns"])
+
+
+class CorpusIndex:
+    """
+    This class is an in-memory index of the files in the corpus directory. It is built once at startup, either by
+    scanning the corpus directory or by loading a persisted index file, so that existence checks and file sizes can be
+    answered without touching the file system.
+
+    The persisted index is a header followed by fixed size records sorted by digest. Each record holds the raw 28 byte
+    SHA-224 digest of a corpus file and its FileEntry. The file is memory-mapped and searched with a binary search, so
+    loading it is O(1) regardless of the corpus size. The header also holds the modification time of the corpus
+    directory when it was scanned, and open scans the directory again when it changed. Checking it is a single stat
+    call, which catches files added, removed or renamed, unless within the timestamp resolution of the file system, but
+    not a file rewritten in place: Corpus notices those when it reads them, and discards the index file so that the
+    next run scans the directory again.
+
+    Attributes:
+        entries: a dictionary of file name -> FileEntry when the index was built by scanning. None when the index is
+        backed by a persisted file
+        source: the state of the corpus directory the index was built from, see corpus_state
+    """
+
+    MAGIC = b"CIDX"
+    VERSION = 5
+    # Magic, version, number of records, then the source of the index
+    HEADER = struct.Struct("<4sIQq")
+    RECORD = struct.Struct("<28sQQQ")
+    DIGEST_SIZE = 28
+    # Approximate memory taken by one entry of a scanned index: the file name, the FileEntry and the dictionary slot
+    ENTRY_COST = 290
+
+    def __init__(self, entries=None, mapped=None, count=0, source=()):
+        self.entries = entries
+        self.source = source
+        self._mapped = mapped
+        self._count = count
+
+    @staticmethod
+    def corpus_state(corpus_dir):
+        """
+        Returns the state of a corpus directory recorded in the index header: a (modification time,) tuple, which
+        adding, removing or renaming a file changes
+        """
+        return (os.stat(corpus_dir).st_mtime_ns,)
+
+    @classmethod
+    def scan(cls, corpus_dir):
+        """
+        Builds the index by listing the corpus directory once. The inode numbers come with the listing and the sizes and
+        modification times with one stat call per file, which DirEntry caches
+        """
+        # Before listing, so that a file added meanwhile makes the index out of date
+        source = cls.corpus_state(corpus_dir)
+        entries = {}
+        with os.scandir(corpus_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries[entry.name] = FileEntry(stat.st_size, entry.inode(), stat.st_mtime_ns)
+        logger.info("Indexed %s corpus files in %s", len(entries), corpus_dir)
+        return cls(entries=entries, source=source)
+
+    @classmethod
+    def load(cls, index_file):
+        """
+        Memory-maps a persisted index file created by save
+        """
+        with open(index_file, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, *source = cls.HEADER.unpack_from(mapped, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            mapped.close()
+            raise ValueError("%s is not a corpus index file (version %s)" % (index_file, cls.VERSION))
+        logger.info("Loaded corpus index %s with %s entries", index_file, count)
+        return cls(mapped=mapped, count=count, source=tuple(source))
+
+    @classmethod
+    def open(cls, corpus_dir, index_file=None):
+        """
+        Loads the index from index_file if it exists and corpus_dir didn't change since, otherwise scans corpus_dir and,
+        if index_file is given, persists the result there for the next run
+        """
+        if index_file is not None and os.path.isfile(index_file):
+            try:
+                index = cls.load(index_file)
+            except (ValueError, struct.error) as e:
+                logger.warning("Ignoring unreadable corpus index %s: %s", index_file, e)
+            else:
+                if index.source == cls.corpus_state(corpus_dir):
+                    return index
+                logger.info("Corpus index %s is out of date, %s changed since", index_file, corpus_dir)
+                index._mapped.close()
+        index = cls.scan(corpus_dir)
+        if index_file is not None:
+            index.save(index_file)
+        return index
+
+    def save(self, index_file):
+        """
+        Writes the index as a sorted digest file. Only file names that are hex SHA-224 digests are persisted
+        """
+        records = []
+        skipped = 0
+        for name, value in self.items():
+            try:
+                digest = bytes.fromhex(name)
+            except ValueError:
+                digest = b""
+            if len(digest) != self.DIGEST_SIZE:
+                skipped += 1
+                continue
+            records.append((digest, value))
+        records.sort()
+        if skipped:
+            logger.warning("%s corpus files are not named by a SHA-224 digest and were left out of %s", skipped,
+                           index_file)
+
+        tmp_file = index_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(records), *self.source))
+            for digest, value in records:
+                f.write(self._pack(digest, value))
+        os.replace(tmp_file, index_file)
+
+    def _pack(self, digest, value):
+        return self.RECORD.pack(digest, *value)
+
+    def _value(self, record):
+        return FileEntry(*record[1:])
+
+    def items(self):
+        """
+        Yields (file name, value) pairs for every file in the index
+        """
+        if self.entries is not None:
+            yield from self.entries.items()
+            return
+        for i in range(self._count):
+            record = self.RECORD.unpack_from(self._mapped, self.HEADER.size + i * self.RECORD.size)
+            yield record[0].hex(), self._value(record)
+
+    def lookup(self, file_name):
+        """
+        Returns the value recorded for the given corpus file, or None if it is not in the corpus
+        """
+        if self.entries is not None:
+            return self.entries.get(file_name)
+
+        try:
+            digest = bytes.fromhex(file_name)
+        except ValueError:
+            return None
+        if len(digest) != self.DIGEST_SIZE:
+            return None
+
+        record_size = self.RECORD.size
+        base = self.HEADER.size
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = base + mid * record_size
+            key = self._mapped[offset:offset + self.DIGEST_SIZE]
+            if key < digest:
+                lo = mid + 1
+            elif key > digest:
+                hi = mid
+            else:
+                return self._value(self.RECORD.unpack_from(self._mapped, offset))
+        return None
+
+    def get_size(self, file_name):
+        """
+        Returns the size of the given corpus file, or None if it is not in the corpus
+        """
+        entry = self.lookup(file_name)
+        return entry.size if entry is not None else None
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes taken by a scanned index, counting ENTRY_COST bytes per file. A persisted
+        index is memory-mapped and takes none
+        """
+        return self.ENTRY_COST * len(self.entries) if self.entries is not None else 0
+
+    def __contains__(self, file_name):
+        return self.lookup(file_name) is not None
+
+    def __len__(self):
+        return len(self.entries) if self.entries is not None else self._count
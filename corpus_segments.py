@@ -0,0 +1,213 @@
+"""
+Packed corpus format. Instead of millions of small files, the records are appended to a few large segment files and a
+sorted index maps each record digest to (segment, offset, length). pack_corpus converts a corpus directory into this
+format and SegmentedCorpus reads from it with the same interface as Corpus.
+
+Usage: python corpus_segments.py CORPUS_DIR SEGMENTS_DIR [--order URL_FILE] [--segment-size MB]
+"""
+import argparse
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+
+from cbor_record import decode_record
+from corpus import Corpus
+from corpus_index import CorpusIndex
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SegmentLocation = namedtuple("SegmentLocation", ["segment", "offset", "length"])
+
+
+class SegmentIndex(CorpusIndex):
+    """
+    A CorpusIndex whose records hold the location of each corpus record inside the segment files instead of a file
+    size
+    """
+
+    MAGIC = b"CSEG"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIQ")
+    RECORD = struct.Struct("<28sIQQ")
+
+    def _value(self, record):
+        return SegmentLocation(*record[1:])
+
+    def get_size(self, file_name):
+        location = self.lookup(file_name)
+        return location.length if location is not None else None
+
+
+class SegmentWriter:
+    """
+    This class appends corpus records to segment files. A new segment is started once the current one reaches
+    segment_size. Opening an existing segment directory continues appending after its last record, and records whose
+    digest is already in the index are skipped
+
+    Attributes:
+        segments_dir: the directory holding the segment files and the index
+        segment_size: the size in bytes after which a new segment file is started
+        entries: a dictionary of digest -> SegmentLocation for every record written so far
+    """
+
+    INDEX_FILE_NAME = "index.bin"
+    SEGMENT_FILE_NAME = "segment-%05d.dat"
+    DEFAULT_SEGMENT_SIZE = 1 << 30
+
+    def __init__(self, segments_dir, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.segments_dir = segments_dir
+        self.segment_size = segment_size
+        os.makedirs(segments_dir, exist_ok=True)
+
+        index_file = os.path.join(segments_dir, self.INDEX_FILE_NAME)
+        self.entries = dict(SegmentIndex.load(index_file).items()) if os.path.isfile(index_file) else {}
+        self.segment = max((location.segment for location in self.entries.values()), default=0)
+        self._file = open(self.segment_file(self.segment), "ab")
+
+    def segment_file(self, segment):
+        return os.path.join(self.segments_dir, self.SEGMENT_FILE_NAME % segment)
+
+    def add(self, digest, data):
+        """
+        Appends one record. Returns False if a record with the same digest was already written
+        """
+        if digest in self.entries:
+            return False
+        if self._file.tell() > 0 and self._file.tell() + len(data) > self.segment_size:
+            self._file.close()
+            self.segment += 1
+            self._file = open(self.segment_file(self.segment), "ab")
+        self.entries[digest] = SegmentLocation(self.segment, self._file.tell(), len(data))
+        self._file.write(data)
+        return True
+
+    def close(self):
+        """
+        Flushes the current segment and writes the index
+        """
+        self._file.close()
+        SegmentIndex(entries=self.entries).save(os.path.join(self.segments_dir, self.INDEX_FILE_NAME))
+
+
+def pack_corpus(corpus_dir, segments_dir, segment_size=SegmentWriter.DEFAULT_SEGMENT_SIZE, order=None):
+    """
+    Packs the files of a corpus directory into segment files.
+
+    :param corpus_dir: the corpus directory to convert
+    :param segments_dir: the output directory, which may already hold segments to append to
+    :param segment_size: the maximum size in bytes of a segment file
+    :param order: optional iterable of urls, e.g. the fetch order of a previous crawl. Their records are written first
+        and in this order so that a crawl reads the segments mostly sequentially. The remaining files follow in
+        directory order
+    :return: the number of records written
+    """
+    corpus = Corpus(corpus_dir)
+    writer = SegmentWriter(segments_dir, segment_size)
+
+    def file_names():
+        if order is not None:
+            for url in order:
+                file_name = corpus.get_digest(url)
+                if file_name in corpus.index:
+                    yield file_name
+        for file_name, _ in corpus.index.items():
+            yield file_name
+
+    written = 0
+    try:
+        for file_name in file_names():
+            if file_name in writer.entries:
+                continue
+            with open(os.path.join(corpus.corpus_base_dir, file_name), "rb") as f:
+                if writer.add(file_name, f.read()):
+                    written += 1
+    finally:
+        writer.close()
+    logger.info("Packed %s records into %s segments in %s", written, writer.segment + 1, segments_dir)
+    return written
+
+
+class SegmentedCorpus(Corpus):
+    """
+    This class is a Corpus backed by packed segment files. Lookups go through the SegmentIndex and records are decoded
+    straight out of the memory-mapped segments. The file address returned by get_file_name is the SegmentLocation of
+    the record, and fetch_many reads the records of a batch in (segment, offset) order
+    """
+
+    def __init__(self, segments_dir, read_ahead=Corpus.DEFAULT_READ_AHEAD):
+        self.corpus_base_dir = os.path.join(segments_dir, "")
+        self.index = SegmentIndex.load(os.path.join(segments_dir, SegmentWriter.INDEX_FILE_NAME))
+        self.segments = {}
+        self._segments_lock = threading.Lock()
+        self.index_file = None
+        self.read_ahead = read_ahead
+        self._read_pool = None
+        self._read_pool_lock = threading.Lock()
+        self._changed_files = set()
+
+    def get_file_info(self, url):
+        location = self.index.lookup(self.get_digest(url))
+        if location is None:
+            return None
+        return location, location.length
+
+    def get_file_version(self, url):
+        # Segments are append-only, so a record only changes when the corpus is packed again
+        hashed_link = self.get_digest(url)
+        location = self.index.lookup(hashed_link)
+        if location is None:
+            return None
+        segment_file = os.path.join(self.corpus_base_dir, SegmentWriter.SEGMENT_FILE_NAME % location.segment)
+        return hashed_link, location.length, os.stat(segment_file).st_mtime_ns
+
+    def _segment(self, segment):
+        mapped = self.segments.get(segment)
+        if mapped is None:
+            with self._segments_lock:
+                mapped = self.segments.get(segment)
+                if mapped is None:
+                    file_name = os.path.join(self.corpus_base_dir, SegmentWriter.SEGMENT_FILE_NAME % segment)
+                    with open(file_name, "rb") as f:
+                        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self.segments[segment] = mapped
+        return mapped
+
+    def read_order(self, location):
+        return location
+
+    def read_record(self, location, include_content=True, populate=False):
+        start = METRICS.start()
+        mapped = self._segment(location.segment)
+        if populate and include_content and hasattr(mmap, "MADV_WILLNEED"):
+            # Starts reading the pages of the record in, madvise needs a page aligned start
+            page_offset = location.offset - location.offset % mmap.PAGESIZE
+            mapped.madvise(mmap.MADV_WILLNEED, page_offset, location.offset + location.length - page_offset)
+        start = METRICS.lap("read", start)
+        try:
+            return decode_record(memoryview(mapped)[location.offset:location.offset + location.length], include_content)
+        finally:
+            METRICS.stop("decode", start)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Packs a corpus directory into segment files")
+    parser.add_argument("corpus_dir", help="directory containing the corpus files")
+    parser.add_argument("segments_dir", help="output directory for the segments and their index")
+    parser.add_argument("--order", default=None,
+                        help="file with one url per line. Their records are packed first, in this order")
+    parser.add_argument("--segment-size", type=int, default=SegmentWriter.DEFAULT_SEGMENT_SIZE >> 20,
+                        help="maximum segment size in MB")
+    args = parser.parse_args()
+
+    if args.order is not None:
+        with open(args.order, encoding="utf-8") as order_file:
+            pack_corpus(args.corpus_dir, args.segments_dir, args.segment_size << 20,
+                        (line.strip() for line in order_file if line.strip()))
+    else:
+        pack_corpus(args.corpus_dir, args.segments_dir, args.segment_size << 20)
@@ -0,0 +1,83 @@
+"""
+A stand-in web server that serves the pages of a corpus over HTTP, for running the HTTP fetcher without network access.
+It acts as a proxy: requests name the full url (GET http://www.ics.uci.edu/ HTTP/1.1), and the page is looked up in the
+corpus. Pages recorded as redirected are served as a redirect to their final url when that url is in the corpus too.
+
+Usage: python corpus_server.py CORPUS_DIR [--segments] [--port PORT]
+Then crawl with: python main.py --fetcher http --http-proxy localhost:PORT
+"""
+import argparse
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from corpus import Corpus
+from corpus_segments import SegmentedCorpus
+
+logger = logging.getLogger(__name__)
+
+
+class CorpusRequestHandler(BaseHTTPRequestHandler):
+    """
+    This class answers GET requests with the corpus records of the requested urls. Connections are kept alive
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith(("http://", "https://")):
+            url = self.path
+        else:
+            url = "http://%s%s" % (self.headers.get("Host", ""), self.path)
+        corpus = self.server.corpus
+        url_data = corpus.fetch_url(url)
+
+        final_url = url_data["final_url"]
+        if isinstance(final_url, bytes):
+            final_url = final_url.decode("utf-8", errors="replace")
+        if url_data["is_redirected"] and final_url and final_url != url and corpus.get_file_name(final_url):
+            self.send_response(302)
+            self.send_header("Location", final_url)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        content = bytes(url_data["content"]) if url_data["content"] is not None else b""
+        self.send_response(url_data["http_code"])
+        if url_data["content_type"]:
+            self.send_header("Content-Type", url_data["content_type"])
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+def serve(corpus, host="localhost", port=8080):
+    """
+    Returns a server for the corpus listening on (host, port). Call serve_forever on it to start serving
+    """
+    server = ThreadingHTTPServer((host, port), CorpusRequestHandler)
+    server.daemon_threads = True
+    server.corpus = corpus
+    return server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serves a corpus over HTTP")
+    parser.add_argument("corpus_dir", help="directory containing the corpus files")
+    parser.add_argument("--segments", action="store_true",
+                        help="corpus_dir holds a packed corpus created by corpus_segments.py")
+    parser.add_argument("--host", default="localhost", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    args = parser.parse_args()
+
+    corpus = SegmentedCorpus(args.corpus_dir) if args.segments else Corpus(args.corpus_dir)
+    server = serve(corpus, args.host, args.port)
+    logger.info("Serving %s on %s:%s", args.corpus_dir, args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,92 +1,484 @@
 import logging
+import os
 import re
 from urllib.parse import urlparse, urljoin, parse_qs
-from urllib.error import HTTPError, URLError
-import heapq
-from urllib.request import urlopen
-import re
 from collections import defaultdict
-from bs4 import BeautifulSoup
 from itertools import islice
-from http.client import InvalidURL
+
+from content_gate import ContentGate
+from extraction_cache import Extraction
+from fingerprint import FingerprintSet
+from frontier_storage import URL_COST
+from html_extractor import parse_page
+from link_graph import LinkGraph
+from memory_governor import approximate_usage
+from metrics import METRICS
+from near_duplicates import NearDuplicateIndex, simhash
+from traps import TrapDetector
+from url_canonicalizer import UrlCanonicalizer
+from url_filter import UrlFilter
+from word_stats import WordStats, count_words
 
 
 logger = logging.getLogger(__name__)
 
+
+class CrawlerState:
+    """
+    This class saves the state of a crawler in the frontier snapshots, see Frontier.attach: its analytics and the
+    structures deciding which urls are valid. Pickling it pickles the current values of the crawler attributes in
+    FIELDS and the sizes of the discovered urls file and the spill files. The pages crawled after a snapshot are logged
+    with Frontier.log_record and replayed by the restored crawler, see Crawler.replay_page.
+
+    Attributes:
+        crawler: the crawler whose state is saved. None for a restored state not yet applied to a crawler
+        values: the restored values of the crawler attributes and the file sizes
+    """
+
+    FIELDS = ("discovered", "trap_detector", "query_params", "identified_traps", "page_with_most_outlinks",
+              "word_stats", "most_words_page", "subdomain_frequency", "final_url", "redirections",
+              "noncanonical_urls", "canonical_duplicates", "gated_pages", "spilled_traps", "corpus_spellings",
+              "remote_outlinks")
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.values = None
+
+    def __getstate__(self):
+        self.crawler.discovered_file.flush()
+        values = {name: getattr(self.crawler, name) for name in self.FIELDS}
+        values["discovered_size"] = self.crawler.discovered_file.tell()
+        values["spilled_sizes"] = {file_name: os.path.getsize(file_name)
+                                   for file_name in self.crawler.SPILL_FILE_NAMES if os.path.isfile(file_name)}
+        return values
+
+    def __setstate__(self, values):
+        self.crawler = None
+        self.values = values
+
+
 class Crawler:
     """
     This class is responsible for scraping urls from the next available link in frontier and adding the scraped links to
     the frontier. We also modified the crawler to include analytics for the actions it takes while crawling.
     """
 
-    def __init__(self, frontier, corpus):
+    # Every url added to the discovered set is also appended to this file, as the set only keeps fingerprints
+    DISCOVERED_FILE_NAME = "discovered_urls.txt"
+
+    # The identified traps and the redirections moved out of memory by spill_analytics, one tab separated
+    # "url reason" or "url redirect redirect ..." line each
+    SPILLED_TRAPS_FILE_NAME = "spilled_traps.txt"
+    SPILLED_REDIRECTIONS_FILE_NAME = "spilled_redirections.txt"
+    SPILL_FILE_NAMES = (SPILLED_TRAPS_FILE_NAME, SPILLED_REDIRECTIONS_FILE_NAME)
+
+    # Urls rejected by these url filter rules are recorded as traps, with the given reason
+    TRAP_RULES = {"length": "long_url"}
+
+    # Urls of the pages representing near-duplicate clusters, next to the frontier state the index is saved with
+    NEAR_DUPLICATE_URLS_FILE_NAME = "near_duplicate_urls.txt"
+
+    # Urls of the nodes of the link graph, next to the frontier state the graph is saved with
+    LINK_GRAPH_URLS_FILE_NAME = "link_graph_urls.txt"
+
+    # Number of pages listed in the PageRank analysis
+    TOP_RANKED_PAGES = 20
+
+    # Version of what extract returns, part of the extraction cache variant so that older entries are dropped
+    EXTRACTION_VERSION = 4
+
+    def __init__(self, frontier, corpus, parser="stream", seen_bloom_fpr=None, max_words=1 << 16,
+                 near_duplicates=None, extraction_cache=None, canonicalizer=None, link_graph=False, content_gate=None):
         self.frontier = frontier
 
         self.corpus = corpus
 
-        self.discovered = set()
-        self.url_dictionary = dict()
+        # Page parser, "stream" (single pass, no DOM) or "soup" (the original BeautifulSoup extraction)
+        self.parser = parser
+        # Decides which pages are parsed as html, parsed as text or skipped, and how much of them, see ContentGate
+        self.content_gate = content_gate if content_gate is not None else ContentGate()
+        # (action, reason) -> number of pages skipped or truncated by the content gate
+        self.gated_pages = defaultdict(int)
+        # Extractions of pages parsed in previous runs, see ExtractionCache. None disables caching
+        self.extraction_cache = extraction_cache
+
+        self.discovered = FingerprintSet(bloom_fpr=seen_bloom_fpr)
+
+        # Links are validated, deduped and fetched in their canonical form, see UrlCanonicalizer. Spellings of links
+        # that differ from their canonical form are kept to count the duplicate fetches canonicalization prevents
+        self.canonicalizer = canonicalizer if canonicalizer is not None else UrlCanonicalizer()
+        self.noncanonical_urls = FingerprintSet(bloom_fpr=seen_bloom_fpr)
+        self.canonical_duplicates = 0
+        # The corpus is keyed by the spelling of the urls it was crawled with. Canonical url -> the spelling it was
+        # discovered in, for the queued urls the corpus only has under that spelling, see in_corpus
+        self.corpus_spellings = dict()
+
+        self.trap_detector = TrapDetector()
 
         self.query_params = dict()
 
-        self.identified_traps = set()
+        # url -> reason
+        self.identified_traps = dict()
+        # The urls of the traps in the spilled traps file, once analytics were spilled, see spill_analytics
+        self.spilled_traps = None
 
         self.page_with_most_outlinks = {"url": None, "count": 0}
+        # url -> [valid outlinks, frontiers yet to report theirs] of the pages whose links were partly validated by
+        # other frontiers, see add_remote_outlinks
+        self.remote_outlinks = dict()
         
         
         self.stop_words = {
             "a", "able", "about", "above", "abst", "accordance", "according", "accordingly", "across", "act", "actually", "added", "adj", "affected", "affecting", "affects", "after", "afterwards", "again", "against", "ah", "all", "almost", "alone", "along", "already", "also", "although", "always", "am", "among", "amongst", "an", "and", "announce", "another", "any", "anybody", "anyhow", "anymore", "anyone", "anything", "anyway", "anyways", "anywhere", "apparently", "approximately", "are", "aren", "arent", "arise", "around", "as", "aside", "ask", "asking", "at", "auth", "available", "away", "awfully", "b", "back", "be", "became", "because", "become", "becomes", "becoming", "been", "before", "beforehand", "begin", "beginning", "beginnings", "begins", "behind", "being", "believe", "below", "beside", "besides", "between", "beyond", "biol", "both", "brief", "briefly", "but", "by", "c", "ca", "came", "can", "cannot", "can't", "cause", "causes", "certain", "certainly", "co", "com", "come", "comes", "contain", "containing", "contains", "could", "couldnt", "d", "date", "did", "didn't", "different", "do", "does", "doesn't", "doing", "done", "don't", "down", "downwards", "due", "during", "e", "each", "ed", "edu", "effect", "eg", "eight", "eighty", "either", "else", "elsewhere", "end", "ending", "enough", "especially", "et", "et-al", "etc", "even", "ever", "every", "everybody", "everyone", "everything", "everywhere", "ex", "except", "f", "far", "few", "ff", "fifth", "first", "five", "fix", "followed", "following", "follows", "for", "former", "formerly", "forth", "found", "four", "from", "further", "furthermore", "g", "gave", "get", "gets", "getting", "give", "given", "gives", "giving", "go", "goes", "gone", "got", "gotten", "h", "had", "happens", "hardly", "has", "hasn't", "have", "haven't", "having", "he", "hed", "hence", "her", "here", "hereafter", "hereby", "herein", "heres", "hereupon", "hers", "herself", "hes", "hi", "hid", "him", "himself", "his", "hither", "home", "how", "howbeit", "however", "hundred", "i", "id", "ie", "if", "i'll", "im", "immediate", "immediately", "importance", "important", "in", "inc", "indeed", "index", "information", "instead", "into", "invention", "inward", "is", "isn't", "it", "itd", "it'll", "its", "itself", "i've", "j", "just", "k", "keep keeps", "kept", "kg", "km", "know", "known", "knows", "l", "largely", "last", "lately", "later", "latter", "latterly", "least", "less", "lest", "let", "lets", "like", "liked", "likely", "line", "little", "'ll", "look", "looking", "looks", "ltd", "m", "made", "mainly", "make", "makes", "many", "may", "maybe", "me", "mean", "means", "meantime", "meanwhile", "merely", "mg", "might", "million", "miss", "ml", "more", "moreover", "most", "mostly", "mr", "mrs", "much", "mug", "must", "my", "myself", "n", "na", "name", "namely", "nay", "nd", "near", "nearly", "necessarily", "necessary", "need", "needs", "neither", "never", "nevertheless", "new", "next", "nine", "ninety", "no", "nobody", "non", "none", "nonetheless", "noone", "nor", "normally", "nos", "not", "noted", "nothing", "now", "nowhere", "o", "obtain", "obtained", "obviously", "of", "off", "often", "oh", "ok", "okay", "old", "omitted", "on", "once", "one", "ones", "only", "onto", "or", "ord", "other", "others", "otherwise", "ought", "our", "ours", "ourselves", "out", "outside", "over", "overall", "owing", "own", "p", "page", "pages", "part", "particular", "particularly", "past", "per", "perhaps", "placed", "please", "plus", "poorly", "possible", "possibly", "potentially", "pp", "predominantly", "present", "previously", "primarily", "probably", "promptly", "proud", "provides", "put", "q", "que", "quickly", "quite", "qv", "r", "ran", "rather", "rd", "re", "readily", "really", "recent", "recently", "ref", "refs", "regarding", "regardless", "regards", "related", "relatively", "research", "respectively", "resulted", "resulting", "results", "right", "run", "s", "said", "same", "saw", "say", "saying", "says", "sec", "section", "see", "seeing", "seem", "seemed", "seeming", "seems", "seen", "self", "selves", "sent", "seven", "several", "shall", "she", "shed", "she'll", "shes", "should", "shouldn't", "show", "showed", "shown", "showns", "shows", "significant", "significantly", "similar", "similarly", "since", "six", "slightly", "so", "some", "somebody", "somehow", "someone", "somethan", "something", "sometime", "sometimes", "somewhat", "somewhere", "soon", "sorry", "specifically", "specified", "specify", "specifying", "still", "stop", "strongly", "sub", "substantially", "successfully", "such", "sufficiently", "suggest", "sup", "sure t", "take", "taken", "taking", "tell", "tends", "th", "than", "thank", "thanks", "thanx", "that", "that'll", "thats", "that've", "the", "their", "theirs", "them", "themselves", "then", "thence", "there", "thereafter", "thereby", "thered", "therefore", "therein", "there'll", "thereof", "therere", "theres", "thereto", "thereupon", "there've", "these", "they", "theyd", "they'll", "theyre", "they've", "think", "this", "those", "thou", "though", "thoughh", "thousand", "throug", "through", "throughout", "thru", "thus", "til", "tip", "to", "together", "too", "took", "toward", "towards", "tried", "tries", "truly", "try", "trying", "ts", "twice", "two", "u", "un", "under", "unfortunately", "unless", "unlike", "unlikely", "until", "unto", "up", "upon", "ups", "us", "use", "used", "useful", "usefully", "usefulness", "uses", "using", "usually", "v", "value", "various", "'ve", "very", "via", "viz", "vol", "vols", "vs", "w", "want", "wants", "was", "wasnt", "way", "we", "wed", "welcome", "we'll", "went", "were", "werent", "we've", "what", "whatever", "what'll", "whats", "when", "whence", "whenever", "where", "whereafter", "whereas", "whereby", "wherein", "wheres", "whereupon", "wherever", "whether", "which", "while", "whim", "whither", "who", "whod", "whoever", "whole", "who'll", "whom", "whomever", "whos", "whose", "why", "widely", "willing", "wish", "with", "within", "without", "wont", "words", "world", "would", "wouldnt", "www", "x", "y", "yes", "yet", "you", "youd", "you'll", "your", "youre", "yours", "yourself", "yourselves", "you've", "z", "zero",
         }
 
-        self.word_frequencies = defaultdict(int)
+        # Approximate top words in bounded memory, see WordStats. max_words=None counts every word exactly
+        self.word_stats = WordStats(self.stop_words, max_words)
 
         self.most_words_page = ("", 0)
 
+        # Near-duplicate detection: None (off), "report" or "skip", which also skips the link extraction and the word
+        # counting of near-duplicate pages
+        self.skip_near_duplicates = near_duplicates == "skip"
+        self.near_duplicates = None
+        if near_duplicates is not None:
+            urls_file_name = os.path.join(frontier.FRONTIER_DIR_NAME, self.NEAR_DUPLICATE_URLS_FILE_NAME)
+            self.near_duplicates = frontier.attach("near_duplicates", lambda: NearDuplicateIndex(urls_file_name))
+
+        # The crawl graph and its PageRank, see LinkGraph. Always recorded with the pagerank order of the frontier,
+        # which is scored by it
+        self.link_graph = None
+        if link_graph or frontier is not None and frontier.order == "pagerank":
+            urls_file_name = os.path.join(frontier.FRONTIER_DIR_NAME, self.LINK_GRAPH_URLS_FILE_NAME)
+            self.link_graph = frontier.attach("link_graph", lambda: LinkGraph(urls_file_name))
+
         self.subdomain_frequency = defaultdict(int)
         
         self.final_url=set()
 
-        self.redirections = defaultdict(str)
-        #self.final_url = ""
-
-    def start_crawling(self):
+        # url -> chain of redirects followed to fetch it
+        self.redirections = dict()
+
+        # Functions called with the url_data of every processed page, e.g. CrawlProfiler.page_done
+        self.page_callbacks = []
+
+        # The state is restored as of the last frontier snapshot, then the pages crawled since are replayed
+        self.state = None
+        self._replaying = False
+        discovered_size = 0
+        spilled_sizes = {}
+        if frontier is not None:
+            self.state = frontier.attach("crawler", lambda: CrawlerState(self))
+            if self.state.crawler is None:
+                for name in CrawlerState.FIELDS:
+                    if name in self.state.values:
+                        setattr(self, name, self.state.values[name])
+                discovered_size = self.state.values["discovered_size"]
+                spilled_sizes = self.state.values.get("spilled_sizes", {})
+                self.state.crawler = self
+                self.state.values = None
+        if discovered_size:
+            # Urls written after the snapshot are written again by the replay
+            os.truncate(self.DISCOVERED_FILE_NAME, discovered_size)
+        self.discovered_file = open(self.DISCOVERED_FILE_NAME, "a" if discovered_size else "w", encoding="utf-8",
+                                    errors="surrogatepass")
+        for file_name in self.SPILL_FILE_NAMES:
+            # Lines spilled after the snapshot are still in the restored analytics
+            if spilled_sizes.get(file_name):
+                os.truncate(file_name, spilled_sizes[file_name])
+            elif os.path.isfile(file_name):
+                os.remove(file_name)
+
+        # Stateless rules of the url filter run around the crawler's own duplicate and trap checks
+        self.url_filter = UrlFilter()
+        self.url_filter.add_rule("duplicate", self._check_duplicate, before="query")
+        self.url_filter.add_rule("trap", self.trap_detector.check, before="host")
+
+        if frontier is not None:
+            records = frontier.replayed_records("crawler")
+            for record in records:
+                self.replay_page(record)
+            if records:
+                logger.info("Replayed %s pages crawled since the last frontier snapshot", len(records))
+            # Pages taken from the frontier but not logged before a restart are crawled again
+            frontier.track_in_flight()
+            if frontier.order == "pagerank":
+                frontier.prioritize(self.link_graph.score)
+
+    def start_crawling(self, batch_size=None):
         """
         This method starts the crawling process which is scraping urls from the next available link in frontier and adding
         the scraped links to the frontier
+        :param batch_size: fetch up to this many urls at once, see crawl_batch. None fetches one url at a time
         """
 
-        #Tracks num of max outlinks and name of link w/ max outlinks for Analytics #1 & #2
-        max_outlinks = 0
-        max_link = ""
-        
         while self.frontier.has_next_url():
-            url = self.frontier.get_next_url()
-            logger.info("Fetching URL %s ... Fetched: %s, Queue size: %s", url, self.frontier.fetched, len(self.frontier))
-            url_data = self.corpus.fetch_url(url)
-            outlinks = 0
-            link = url_data["url"]
-            hostname = urlparse(link).hostname
-
-            for next_link in self.extract_next_links(url_data):
-                if self.is_valid(next_link, url_data):
-                    self.subdomain_frequency[hostname] += 1 # Analytics #1
-                    # print("Subdomain:", hostname, "Frequency:", self.subdomain_frequency[hostname])
-                    outlinks += 1
-                    if self.corpus.get_file_name(next_link) is not None:
-                        self.frontier.add_url(next_link)
-                    if outlinks > max_outlinks:
-                        max_outlinks = outlinks
-                        max_link = link
-
-            #Adds to class attributes for analytics #2
-            self.page_with_most_outlinks["url"] = max_link
-            self.page_with_most_outlinks["count"] = max_outlinks
+            if batch_size:
+                self.crawl_batch(batch_size)
+            else:
+                self.crawl_next_url()
+
         #output analysis
         self.output_analysis()
-        print(self.url_dictionary)
 
+    def crawl_next_url(self):
+        """
+        Takes the next url from the frontier, fetches it and processes its links
+        """
+        url = self.frontier.get_next_url()
+        logger.info("Fetching URL %s ... Fetched: %s, Queue size: %s", url, self.frontier.fetched, len(self.frontier))
+        url_data, extraction = self.fetch_page(url)
+        self.process_page(url_data, self.extract_next_links(url_data, extraction=extraction))
+
+    def corpus_url(self, url):
+        """
+        Returns the spelling of a queued url the corpus has its page under
+        """
+        return self.corpus_spellings.get(url, url)
+
+    def in_corpus(self, url, spelling):
+        """
+        Returns True if the corpus has the page of a canonical url, under the url itself or under the spelling it was
+        discovered in, which is then remembered for fetching the page
+        """
+        if self.corpus.get_file_name(url) is not None:
+            return True
+        if spelling != url and self.corpus.get_file_name(spelling) is not None:
+            self.corpus_spellings[url] = spelling
+            return True
+        return False
+
+    def crawl_batch(self, batch_size):
+        """
+        Takes up to batch_size urls from the frontier and fetches them at once with Fetcher.fetch_many. The pages are
+        fetched in any order but processed in the order they were taken, each as soon as it and the pages before it
+        are fetched, so with the FIFO frontier the crawl is the same as with crawl_next_url. Returns the number of pages
+        """
+        urls = []
+        while len(urls) < batch_size and self.frontier.has_next_url():
+            url = self.frontier.get_next_url()
+            logger.info("Fetching URL %s ... Fetched: %s, Queue size: %s", url, self.frontier.fetched,
+                        len(self.frontier))
+            urls.append(url)
+        cached = {url: self.cached_extraction(url) for url in urls}
+        # Fetched by the spelling in the corpus
+        spellings = {self.corpus_url(url): url for url in urls}
+        headers_only = {self.corpus_url(url) for url, (_, extraction) in cached.items() if extraction is not None}
+
+        fetched = {}
+        processed = 0
+        for url_data in self.corpus.fetch_many(list(spellings), headers_only):
+            fetched[spellings[url_data["url"]]] = url_data
+            while processed < len(urls) and urls[processed] in fetched:
+                url = urls[processed]
+                processed += 1
+                url_data, extraction = self.fetched_page(url, fetched.pop(url), cached[url])
+                self.process_page(url_data, self.extract_next_links(url_data, extraction=extraction))
+        return len(urls)
+
+    def cached_extraction(self, url):
+        """
+        Looks up a url in the extraction cache. Returns the (version, extraction) of its corpus file: the version is None
+        if caching is off or the url isn't in the corpus, and extraction is None unless the cache has a valid entry
+        """
+        if self.extraction_cache is None:
+            return None, None
+        version = self.corpus.get_file_version(self.corpus_url(url))
+        if version is None:
+            return None, None
+        extraction = self.extraction_cache.get(version)
+        if extraction is not None and self.near_duplicates is not None and extraction.simhash is None and \
+                (extraction.gate is None or extraction.gate[0] != "skipped"):
+            # Cached without a near-duplicate signature, which needs the content
+            extraction = None
+        return version, extraction
+
+    def fetch_page(self, url, cached=None):
+        """
+        Fetches a page. Returns (url_data, extraction): if the extraction cache has a valid entry for the page only its
+        header is read and extraction is the cached Extraction, otherwise extraction is None
+        :param cached: the result of cached_extraction for the url, if it was looked up already
+        """
+        cached = cached if cached is not None else self.cached_extraction(url)
+        return self.fetched_page(url, self.corpus.fetch_url(self.corpus_url(url), include_content=cached[1] is None),
+                                 cached)
+
+    def fetched_page(self, url, url_data, cached):
+        """
+        Adds what the extraction cache lookup of a fetched page found to its url_data, under the url it was taken from
+        the frontier as. Returns (url_data, extraction), see fetch_page
+        :param cached: the result of cached_extraction for the url
+        """
+        version, extraction = cached
+        read_version = url_data.get("file_version")
+        if version is not None and read_version is not None and read_version != version:
+            # The file was rewritten since the corpus index was built, e.g. with a persisted index
+            if extraction is not None:
+                self.extraction_cache.stale_hit()
+                extraction = None
+                url_data = self.corpus.fetch_url(self.corpus_url(url))
+                read_version = url_data.get("file_version", read_version)
+            version = read_version
+        # The page may have been fetched by another spelling, see in_corpus
+        url_data["url"] = url
+        url_data["file_version"] = version
+        if extraction is not None and (extraction.simhash is not None or extraction.gate is not None and
+                                       extraction.gate[0] == "skipped"):
+            url_data["simhash"] = extraction.simhash
+        return url_data, extraction
+
+    def process_page(self, url_data, next_links):
+        """
+        Validates the links extracted from a fetched page, adds the valid ones that exist in the corpus to the frontier
+        and updates the outlink analytics. Pages have to be processed in the order they were taken from the frontier
+        """
+        link = url_data["url"]
+        self.corpus_spellings.pop(link, None)
+        hostname = urlparse(link).hostname
+        if len(url_data.get("redirects", ())) > 1:
+            self.redirections[link] = url_data["redirects"]
+        METRICS.count("pages")
+        METRICS.count("links", len(next_links))
+
+        start = METRICS.start()
+        # The links owned by other frontiers, e.g. of other shards, are validated there, see add_remote_links
+        next_links, remote_frontiers = self.frontier.split_links(link, next_links, send=not self._replaying)
+        linked = [] if self.link_graph is not None else None
+        valid_links, spellings = self.validate_links(next_links, url_data, linked)
+        METRICS.stop("validate", start)
+        if self.link_graph is not None:
+            # Before the links are added to the frontier, so that they are scored with their new in-links
+            self.link_graph.add_page(link, linked)
+            if self.link_graph.update_ranks() and not self._replaying:
+                self.frontier.rescore()
+        outlinks = self.add_links(hostname, valid_links, spellings)
+        if remote_frontiers and not self._replaying:
+            # Counted once the other frontiers report how many of their links are valid
+            self.remote_outlinks[link] = [outlinks, remote_frontiers]
+        elif not remote_frontiers:
+            self.count_outlinks(link, outlinks)
+
+        if self._replaying:
+            return
+        self.frontier.log_record("crawler", self.page_record(url_data), done_url=link)
+        for callback in self.page_callbacks:
+            callback(url_data)
+
+    def validate_links(self, links, url_data=None, linked=None):
+        """
+        Returns the valid canonical urls among the outlinks of a page, in order, and canonical url -> the first spelling
+        of it on the page
+        :param linked: see valid_links
+        """
+        canonical_links = self.canonical_links(links)
+        spellings = dict()
+        for url, spelling in zip(canonical_links, links):
+            spellings.setdefault(url, spelling)
+        return self.valid_links(canonical_links, url_data, linked), spellings
+
+    def add_links(self, hostname, valid_links, spellings):
+        """
+        Counts the valid outlinks of a page of hostname and adds the ones that exist in the corpus to the frontier.
+        Returns their number
+        """
+        for next_link in valid_links:
+            self.subdomain_frequency[hostname] += 1 # Analytics #1
+            # print("Subdomain:", hostname, "Frequency:", self.subdomain_frequency[hostname])
+            # The frontier replays its own log, the spellings of the queued urls are looked up again. Without a corpus,
+            # e.g. for the analysis only, no page is crawled
+            if self.corpus is not None and self.in_corpus(next_link, spellings[next_link]) and not self._replaying:
+                start = METRICS.start()
+                self.frontier.add_url(next_link)
+                METRICS.stop("enqueue", start)
+        return len(valid_links)
+
+    def count_outlinks(self, url, outlinks):
+        """
+        Tracks num of max outlinks and name of link w/ max outlinks for Analytics #2
+        """
+        if outlinks > self.page_with_most_outlinks["count"]:
+            self.page_with_most_outlinks["url"] = url
+            self.page_with_most_outlinks["count"] = outlinks
+
+    def add_remote_links(self, source, links):
+        """
+        Validates and adds the outlinks of a page crawled by another frontier that this one owns, see
+        Frontier.split_links, and counts them for the host of the page. Returns the number of valid ones, to be reported
+        back to the crawler of the page
+        """
+        valid_links, spellings = self.validate_links(links)
+        return self.add_links(urlparse(source).hostname, valid_links, spellings)
 
-    def extract_next_links(self, url_data): # http://www.ics.uci.edu/
+    def add_remote_outlinks(self, source, outlinks):
+        """
+        Adds the number of valid outlinks of a page reported by one of the frontiers its links were sent to, see
+        add_remote_links. The page is counted for Analytics #2 once all of them have reported
+        """
+        counts = self.remote_outlinks.get(source)
+        if counts is None:
+            # Sent before the crawler was restored from a snapshot taken before the page was crawled
+            return
+        counts[0] += outlinks
+        counts[1] -= 1
+        if counts[1] == 0:
+            del self.remote_outlinks[source]
+            self.count_outlinks(source, counts[0])
+
+    def canonical_links(self, links):
+        """
+        Returns the canonical forms of the links of a page, in order. Counts the duplicate fetches this prevents: links in
+        a spelling not seen before whose canonical url was already discovered
+        """
+        canonicalize = self.canonicalizer.canonicalize
+        canonical_links = [canonicalize(link) for link in links]
+        page_urls = set()
+        for link, url in zip(links, canonical_links):
+            if url != link and self.noncanonical_urls.add(link) and (url in page_urls or url in self.discovered):
+                self.canonical_duplicates += 1
+                METRICS.count("canonical_duplicates")
+            page_urls.add(url)
+        return canonical_links
+
+    def page_record(self, url_data):
+        """
+        Returns what replay_page needs to process a page again: the url, status and redirections of the page. A page
+        with a file version, e.g. one in the corpus, is read and extracted again by replay_page, from the extraction
+        cache if it has the page. For other pages, e.g. fetched over http, the record also holds their near-duplicate
+        signature and their extraction, if they were extracted
+        """
+        page = {key: url_data[key] for key in ("url", "http_code", "final_url") if key in url_data}
+        if len(url_data.get("redirects", ())) > 1:
+            page["redirects"] = url_data["redirects"]
+        if url_data["content"] is None and url_data.get("extraction") is None:
+            return page, None
+        if self.corpus is not None and self.corpus.get_file_version(self.corpus_url(url_data["url"])) is not None:
+            page["read_again"] = True
+            return page, None
+        if "simhash" in url_data:
+            page["simhash"] = url_data["simhash"]
+        # Stands for the content, which isn't parsed again
+        page["content"] = b""
+        return page, url_data.get("extraction")
+
+    def replay_page(self, record):
+        """
+        Processes a page logged by page_record again, without adding its links to the frontier, to bring the crawler
+        state back to where it was when the page was crawled
+        """
+        url_data, extraction = record
+        self._replaying = True
+        try:
+            # Without a corpus, e.g. for the analysis only, the page is processed without its extraction
+            if url_data.pop("read_again", False) and self.corpus is not None:
+                page = url_data
+                url_data, extraction = self.fetch_page(page["url"])
+                url_data.update(page)
+            url_data.setdefault("content", None)
+            self.process_page(url_data, self.extract_next_links(url_data, extraction=extraction))
+        finally:
+            self._replaying = False
+
+    def extract_next_links(self, url_data, page_content=None, extraction=None): # http://www.ics.uci.edu/
         """
         The url_data coming from the fetch_url method will be given as a parameter to this method. url_data contains the
         fetched url, the url content in binary format, and the size of the content in bytes. This method should return a
@@ -95,278 +487,290 @@ class Crawler:
         that have already been fetched. The frontier takes care of that.
 
         Suggested library: lxml
+
+        page_content is the already parsed (links, words) of the page when parsing was done elsewhere, e.g. by a parse
+        worker of the crawl pipeline. extraction is the Extraction of the page found in the extraction cache, in which
+        case the page isn't parsed and its content isn't needed
         """
 
         outputLinks = []
-        # Checks if binary content exists and if the URL is accessible (not 404)
-        if url_data['content'] is not None and url_data['http_code'] != 404:
-            print("Final URL:", url_data['final_url'])
+        # Checks if binary content exists and if the URL is accessible (not 404). Only such pages are cached
+        if extraction is not None or (url_data['content'] is not None and url_data['http_code'] != 404):
+            logger.debug("Final URL: %s", url_data['final_url'])
             if(url_data['final_url'] is not None):
                 self.final_url.add(url_data['final_url'])
-            
-            parsed_soup = BeautifulSoup(url_data['content'], 'html.parser')
-            soup_content = parsed_soup.get_text()
-            words = soup_content.split()
-            
+
+            if extraction is None:
+                self.gate_page(url_data)
+
+            if self.is_near_duplicate(url_data) and self.skip_near_duplicates:
+                return []
+
+            if extraction is None:
+                extraction = self.extract(url_data, page_content)
+            url_data["extraction"] = extraction
+            if extraction.gate is not None:
+                self.gated_pages[extraction.gate] += 1
+                METRICS.count("pages_" + extraction.gate[0], reason=extraction.gate[1])
 
             '''
             4. What is the longest page in terms of number of words? (HTML markup doesn’t count as words)
             5. What are the 50 most common words in the entire set of pages? (Ignore English stop words)
             '''
-            self.set_most_words_page(url_data["url"], len(words))
-            for word in words:
-                if self.is_stop_word(word) is False and word.isalpha():
-                    self.word_frequencies[word] += 1
+            self.set_most_words_page(url_data["url"], extraction.word_count)
+            self.word_stats.add_counts(extraction.word_counts)
 
-            if parsed_soup is None: # if there is no html content
-                return []
             if url_data['url'] in self.final_url:
                 return [] #stop redirecting if reached the final url
-            pattern = r'href="([^"]*)"'
-            # Find all matches
 
-            urls = re.findall(pattern, str(parsed_soup))
-            for url in urls:
-                converted_url = self.convert_relative_to_absolute(url, url_data["url"])
-                outputLinks.append(converted_url)
+            outputLinks.extend(extraction.links)
 
         return outputLinks
+
+    def extract(self, url_data, page_content=None):
+        """
+        Parses a fetched page, unless page_content already holds its parsed (links, words), into an Extraction with the
+        links in their absolute form, and stores it in the extraction cache. The links are canonicalized later, so that
+        cached extractions don't depend on the canonicalizer configuration
+        """
+        if page_content is None:
+            start = METRICS.start()
+            page_content = parse_page(self.parser, url_data['content'], url_data.get("parse_as", "html"))
+            METRICS.stop("parse", start)
+        hrefs, words = page_content
+        links = [self.convert_relative_to_absolute(url, url_data["url"]) for url in hrefs]
+        extraction = Extraction(links, len(words), count_words(words, self.stop_words), url_data.get("simhash"),
+                                url_data.get("gate"))
+        if self.extraction_cache is not None and url_data.get("file_version") is not None:
+            self.extraction_cache.put(url_data["file_version"], extraction)
+        return extraction
  
         
 
+    def gate_page(self, url_data):
+        """
+        Runs the content gate on a fetched page, once: sets url_data["parse_as"] to the handler the page is parsed with
+        and url_data["gate"] to why it is skipped or truncated, if it is, and cuts url_data["content"] to the part to be
+        parsed. Skipped pages get no near-duplicate signature. Safe to call from the fetch threads of the crawl pipeline.
+        Returns the handler
+        """
+        if "parse_as" not in url_data:
+            handler, gate, content = self.content_gate.check(url_data["content"], url_data.get("content_type"))
+            url_data["parse_as"] = handler
+            url_data["gate"] = gate
+            url_data["content"] = content
+            if handler == "skip":
+                url_data["simhash"] = None
+        return url_data["parse_as"]
+
+    def is_near_duplicate(self, url_data):
+        """
+        Adds a fetched page to the near-duplicate index, if enabled. Returns True if the page is a near-duplicate of a
+        page crawled before. The SimHash signature is taken from url_data["simhash"] when it was computed ahead, e.g. by a
+        fetch worker of the crawl pipeline
+        """
+        if self.near_duplicates is None:
+            return False
+        if "simhash" not in url_data:
+            url_data["simhash"] = simhash(url_data["content"])
+        signature = url_data["simhash"]
+        if signature is None:
+            return False
+        original = self.near_duplicates.add(url_data["url"], signature)
+        if original is not None:
+            logger.debug("%s is a near-duplicate of page %s", url_data["url"], original)
+            METRICS.count("near_duplicates")
+            return True
+        return False
+
     def is_valid(self, url, url_data):
         """
         Function returns True or False based on whether the url has to be fetched or not. This is a great place to
         filter out crawler traps. Duplicated urls will be taken care of by frontier. You don't need to check for duplication
         in this method
-        """
-        parsed = urlparse(url)
-        #url_key = (parsed.scheme, parsed.netloc, parsed.path)
 
-        if parsed.scheme not in set(["http", "https"]):
-            print('parsed.scheme not in set(["http", "https"])')
+        The checks are the rules of self.url_filter, see UrlFilter. Besides the stateless rules it runs the duplicate
+        check (all urls discovered so far, including the ones that have left the frontier) and the trap detector, see
+        TrapDetector
+        """
+        rejection = self.url_filter.check(url)
+        if rejection is not None:
+            self.record_rejection(url, rejection)
             return False
 
-        #check for very long urls
-        if self.is_long_url(url):
-            print("long url")
-            self.identified_traps.add(url)
-            # print("Identified traps:", self.identified_traps)
-            return False
-        
+        return True
 
-        
-        #check for all duplicates, including ones that have exited frontier
-        #check if already in discovered SET
-        if self.is_duplicate(url, parsed):
-            # print("Already in discovered SET:", url)
-            #self.identified_traps.add(url)
-            return False
-        
+    def valid_links(self, urls, url_data, linked=None):
+        """
+        Batch version of is_valid: checks all of the outlinks of a page in one call and returns the valid ones, in order
+        :param linked: optional list the urls that are valid or only rejected as already discovered are appended to
+        """
+        valid = []
+        for url, rejection in zip(urls, self.url_filter.check_many(urls)):
+            if rejection is None:
+                valid.append(url)
+            else:
+                self.record_rejection(url, rejection)
+            if linked is not None and (rejection is None or rejection.rule == "duplicate"):
+                linked.append(url)
+        return valid
 
-        if self.has_invalid_param(url):
-            return False
-        if self.has_invalid_patterns(url):
+    def record_rejection(self, url, rejection):
+        """
+        Updates the trap and query parameter analytics for a url rejected by the url filter
+        """
+        logger.debug("Rejected %s by rule %s", url, rejection.rule)
+        METRICS.count("rejected", reason=rejection.rule)
+        if rejection.rule == "trap":
+            self.add_trap(url, rejection.detail)
+            METRICS.count("traps", reason=rejection.detail)
+        elif rejection.rule in self.TRAP_RULES:
+            self.add_trap(url, self.TRAP_RULES[rejection.rule])
+            METRICS.count("traps", reason=self.TRAP_RULES[rejection.rule])
+        elif rejection.rule == "query" and isinstance(rejection.detail, tuple):
+            key, value = rejection.detail
+            self.query_params[key] = value
+
+    def add_trap(self, url, reason):
+        # A url rejected before the duplicate check, e.g. by its length, can be rejected again after it was spilled
+        if self.spilled_traps is None or url not in self.spilled_traps:
+            self.identified_traps[url] = reason
+
+    def spill_analytics(self):
+        """
+        Appends the identified traps and the redirections to the spill files and drops them from memory, e.g. when the
+        memory governor finds the crawl short of memory. They are read back by all_traps and all_redirections. Returns
+        True if anything was spilled
+        """
+        if not self.identified_traps and not self.redirections:
             return False
-        
+        if self.spilled_traps is None:
+            self.spilled_traps = FingerprintSet()
+        # The files are only created once there is something in them
+        if self.identified_traps:
+            with open(self.SPILLED_TRAPS_FILE_NAME, "a", encoding="utf-8", errors="surrogatepass") as traps_file:
+                for url, reason in self.identified_traps.items():
+                    traps_file.write(f"{url}\t{reason}\n")
+                    self.spilled_traps.add(url)
+        if self.redirections:
+            with open(self.SPILLED_REDIRECTIONS_FILE_NAME, "a", encoding="utf-8", errors="surrogatepass") as \
+                    redirections_file:
+                for url, redirects in self.redirections.items():
+                    redirections_file.write("\t".join([url] + list(redirects)) + "\n")
+        logger.info("Spilled %s traps and %s redirections to disk", len(self.identified_traps), len(self.redirections))
+        self.identified_traps.clear()
+        self.redirections.clear()
+        return True
+
+    def _spilled_lines(self, file_name):
+        if not os.path.isfile(file_name):
+            return
+        with open(file_name, encoding="utf-8", errors="surrogatepass") as spill_file:
+            for line in spill_file:
+                yield line.rstrip("\n").split("\t")
+
+    def all_traps(self):
+        """
+        Yields (url, reason) of every identified trap, the spilled ones first
+        """
+        for url, reason in self._spilled_lines(self.SPILLED_TRAPS_FILE_NAME):
+            yield url, reason
+        yield from self.identified_traps.items()
 
-        #check for history traps
-        if self.is_history_trap(url, parsed):
-            print("history trap")
-            self.identified_traps.add(url)
-            # print("Identified traps:", self.identified_traps)
-            return False
-        
-        print("\nChecking if URL is valid:", url)
-        # check if URL is accessible
-        # try:
-        #     response = urlopen(url, timeout=10)
-        #     assert response.getcode() == 200
-        # except (AssertionError, ValueError, HTTPError, URLError, InvalidURL, ConnectionResetError) as e:
-        #     # print("code != 200")
-        #     #self.identified_traps.add(url)
-        #     return False
-        
-        
-        
-        
-        redirected_urls = [url]
-        current_url = url
-        '''
-        ADDING TO REDIRECTION PATHS DICTIONARY
-        # while True and current_url != url_data['final_url']:
-        #      try:
-        #          response = urlopen(current_url)
-        #          if response.getcode() // 100 == 3:
-        #              current_url = response.getheader('Location')
-        #              redirected_urls.append(current_url)
-        #          else:
-        #              break
-        #      except (AssertionError, ValueError, HTTPError, URLError, InvalidURL, ConnectionResetError) as e:
-        #          if current_url==url:
-        #              return False
-        #          break
-        #      except:
-        #          break
-            
-        # if current_url != url:
-        #     redirected_urls.append(current_url)
+    def all_redirections(self):
+        """
+        Yields (url, chain of redirects) of every redirected page, the spilled ones first
+        """
+        for url, *redirects in self._spilled_lines(self.SPILLED_REDIRECTIONS_FILE_NAME):
+            yield url, redirects
+        yield from self.redirections.items()
 
-        self.redirections[url] = redirected_urls
-        '''
-    
-        try:
-            
-            return ".ics.uci.edu" in parsed.hostname \
-                   and not re.match(".*\.(css|js|bmp|gif|jpe?g|ico" + "|png|tiff?|mid|mp2|mp3|mp4" \
-                                    + "|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf" \
-                                    + "|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|epub|dll|cnf|tgz|sha1" \
-                                    + "|thmx|mso|arff|rtf|jar|csv" \
-                                    + "|rm|smil|wmv|swf|wma|zip|rar|gz|pdf)$", parsed.path.lower())
-        except TypeError:
-            print("TypeError for ", parsed)
-            return False
-    
+    def register_memory(self, governor):
+        """
+        Registers the structures of the crawler with a MemoryGovernor, with the way each can give back memory
+        """
+        governor.register("discovered", self.discovered.memory_usage, "compact", lambda: self.discovered.compact())
+        governor.register("noncanonical_urls", self.noncanonical_urls.memory_usage, "compact",
+                          lambda: self.noncanonical_urls.compact())
+        governor.register("final_urls", lambda: approximate_usage(self.final_url))
+        governor.register("query_params", lambda: approximate_usage(self.query_params))
+        governor.register("traps_and_redirections", lambda: approximate_usage(self.identified_traps) +
+                          approximate_usage(self.redirections, 3 * URL_COST), "spill", self.spill_analytics)
+        governor.register("word_stats", lambda: self.word_stats.memory_usage(), "evict",
+                          lambda: self.word_stats.shrink())
+        governor.register("trap_detector", self.trap_detector.memory_usage, "evict", self.trap_detector.shrink)
+        if self.near_duplicates is not None:
+            governor.register("near_duplicates", self.near_duplicates.memory_usage)
+        if self.link_graph is not None:
+            governor.register("link_graph", self.link_graph.memory_usage)
+
+    def _check_duplicate(self, parsed):
+        return True if self.is_duplicate(parsed.url, parsed) else None
 
     def convert_relative_to_absolute(self, relative_url, base_url):
-        ''' If the URL is relative, convert it to absolute URL '''
-        # print(base_url, relative_url)
-        if relative_url[0:2] == "//":
-            if base_url[0:5] == "https":
-                return urljoin("https:", relative_url)
-            else:
-                return urljoin("http:", relative_url)
-        elif relative_url[0:1] == "/":
-            return urljoin(base_url, relative_url[1:])
-        elif relative_url[0:2] == "./":
-            return urljoin(base_url, relative_url[2:])
-        elif relative_url[0:2] == "..":
-            base_url_segments = base_url.split('/')
-            base_url_segments[0] = base_url_segments[0] + "/" # add back a slash for later joining
-            base_url_segments = [segment for segment in base_url_segments if segment != ""] # remove empty strings
-            num_up_dir = relative_url.count('../') # count number of directories to go up by
-            for i in range(num_up_dir):
-                base_url_segments.pop()
-            relative_url = relative_url.replace('../', '')
-            absolute_path = '/'.join(base_url_segments) + '/' + relative_url
-            print("CREATED ABSOLUTE PATH @:", absolute_path)
-            return absolute_path
-        else:
+        ''' If the URL is relative, convert it to absolute URL. Dot segments are resolved by the canonicalization '''
+        try:
+            return urljoin(base_url, relative_url.strip())
+        except ValueError:
             return relative_url
 
-    def is_long_url(self, url):
-        return len(url) > 300
-    
     def is_duplicate(self, url, parsed):
-        if url in self.discovered:
+        if not self.discovered.add(url):
             return True
         else:
-            self.discovered.add(url)
+            self.discovered_file.write(url + '\n')
             #self.discovered_url_keys[(parsed.scheme, parsed.netloc, parsed.path)] = parse_qs(parsed.query) #parsed.query
             return False
     
-    def has_invalid_param(self, url):
-        #path_segments = url.split('/')
-        parsed = urlparse(url)
-        query_params = parse_qs(parsed.query)
-        
-        if query_params:
-            for key, value in query_params.items():
-                if len(value) > 1: # multiple occurences for the same query param
-                    self.query_params[key] = value
-                    return True
-                
-                if len(value[0]) > 20: # long query param value char count
-                    self.query_params[key] = value
-                    return True
-                
-            if len(query_params) > 20: # has a very large number of parameters
-                    return True
-        return False
-
-    def has_invalid_patterns(self, url):
-        path_segments = url.split('/')
-        #parsed = urlparse(url)
-        #query_params = parse_qs(parsed.query)
-                    
-        # 1: check if there are repeating sub-directories in general
-        for i in range(len(path_segments)):
-            if path_segments[i] != "" and path_segments.count(path_segments[i]) > 1:
-                print("Repeating sub-directories:", path_segments[i])
-                return True
-        
-        # 2. Check for incrementing/decrementing numerical patterns for the parameters
-        if re.search(r'/\d+/\d+/', url):
-            return True
-
-        # 3. Check a timestamp or session id pattern
-        if re.search(r'\d{4}-\d{2}-\d{2}|\d{4}/\d{2}/\d{2}|\d{2}/\d{2}/\d{4}|\d{4}/d{2}|\d{3}/\d{8}|[A-Za-z0-9]{32}', url): # https://poop.com/2020-12-31
-            return True
-        
-        #4 check historically visited URLs, see if only change is the last path segment numerically
-        # history_check = url.split('/')
-        # last_path_segment = history_check.pop()
-        # if last_path_segment == "":
-        #     last_path_segment = history_check.pop()
-        # if not last_path_segment.isdigit():
-        #     return False
-        # else:
-        #     print(history_check)
-        #     historical_paths = "/".join(history_check)
-        #     print("Check to see if matching discovered paths:", historical_paths)
-        #     if historical_paths in self.discovered:
-        #         print("Found a historical trap")
-        #         return True
-        
-        return False #if no invalid patterns are found
-    def is_history_trap(self, url):
-        '''ADDED CODE'''
-        # NEW WAY OF HISTORY DETECTION: 
-        parsed = urlparse(url)
-        query_params = parse_qs(parsed.query)
-        url_key = (parsed.scheme, parsed.netloc, parsed.path)
-        
-        if url_key not in self.url_dictionary:
-            self.url_dictionary[url_key] = (set(), 0)
-        else:
-            # * In this block, the (parsed.scheme, parsed.netloc, parsed.path) have ALREADY been discovered before.
-                        
-            # Check if the same query exists in the dictionary with appended values
-            if len(self.url_dictionary[url_key]) > 0 and self.url_dictionary[url_key][0].issubset(set(query_params.items())):
-                self.url_dictionary[url_key][1] += 1
-
-                if self.url_dictionary[url_key][1] >= 3:
-                    return True  # History trap detected
-            
-        '''ADDED CODE'''
-        # Else, Update the dictionary with the current query parameters for future comparisons
-        self.url_dictionary[url_key] = (set(query_params.items()), self.url_dictionary[url_key][1]) # tuple data structure containing counter and set of query params
-                
-        
-        # https://amazon.com/search?query=shoes&sort=price --> https://amazon.com/search?query=shoes&sort=price&filter=brand --> https://amazon.com/search?query=shoes&filter=brand&color=re
-
-        return False  # No history trap
-            # https://amazon.com/search?query=shoes&sort=price --> https://amazon.com/search?query=shoes&sort=price&filter=brand --> https://amazon.com/search?query=shoes&sort=price&filter=brand&color=red
-            # Number of elements in the set increases, with A being a subset of B, and B being a subset of C
-
-            # Diff query parameters are associated with a count + set of query parameters
-
-            #tuple of how many times it's been rediscovered where we compare the old set to the new set and the old is a subset of the new. If this happens more than X times, SUS, history trap?
-        
-    def is_stop_word(self, word):
-        return word in self.stop_words
-    
     def get_most_common_words(self):
-        if len(self.word_frequencies) < 50:
-            return heapq.nlargest(len(self.word_frequencies), self.word_frequencies, key=self.word_frequencies.get)
-        else:
-            return heapq.nlargest(50, self.word_frequencies, key=self.word_frequencies.get)
+        return [word for word, count, error in self.word_stats.most_common(50)]
     
     def set_most_words_page(self, url, length):
         if length > self.most_words_page[1]:
             self.most_words_page = (url, length)
             
     
+    def get_analytics(self):
+        """
+        Returns the analytics gathered so far as a picklable dictionary, e.g. to be merged into the analytics of another
+        crawler with merge_analytics
+        """
+        self.discovered_file.flush()
+        with open(self.DISCOVERED_FILE_NAME, encoding="utf-8", errors="surrogatepass") as discovered_file:
+            discovered = [url.rstrip("\n") for url in discovered_file]
+        return {
+            "subdomain_frequency": dict(self.subdomain_frequency),
+            "page_with_most_outlinks": dict(self.page_with_most_outlinks),
+            "most_words_page": self.most_words_page,
+            "word_stats": self.word_stats,
+            "identified_traps": dict(self.all_traps()),
+            "query_params": self.query_params,
+            "redirections": dict(self.all_redirections()),
+            "canonical_duplicates": self.canonical_duplicates,
+            "gated_pages": dict(self.gated_pages),
+            "discovered": discovered,
+        }
+
+    def merge_analytics(self, analytics):
+        """
+        Adds the analytics of another crawler, as returned by its get_analytics, to the analytics of this one
+        """
+        for hostname, count in analytics["subdomain_frequency"].items():
+            self.subdomain_frequency[hostname] += count
+        if analytics["page_with_most_outlinks"]["count"] > self.page_with_most_outlinks["count"]:
+            self.page_with_most_outlinks = dict(analytics["page_with_most_outlinks"])
+        self.set_most_words_page(*analytics["most_words_page"])
+        self.word_stats.merge(analytics["word_stats"])
+        for url, reason in analytics["identified_traps"].items():
+            self.add_trap(url, reason)
+        self.query_params.update(analytics["query_params"])
+        self.redirections.update(analytics["redirections"])
+        self.canonical_duplicates += analytics["canonical_duplicates"]
+        for gate, count in analytics["gated_pages"].items():
+            self.gated_pages[gate] += count
+        for url in analytics["discovered"]:
+            self.is_duplicate(url, None)
+
     def output_analysis(self):
         with open('analysis.txt','w', encoding='utf-8') as file:
             file.write('Subdomains and URLs counted:\n')
@@ -380,11 +784,18 @@ class Crawler:
 
             #Analysis 3
             file.write("Downloaded URLs: \n")
-            for url in self.discovered:
-                file.write(url + '\n')
+            self.discovered_file.flush()
+            with open(self.DISCOVERED_FILE_NAME, encoding="utf-8", errors="surrogatepass") as discovered_file:
+                for url in discovered_file:
+                    file.write(url)
             file.write("Traps: \n")
-            for trap in self.identified_traps:
-                file.write(trap + '\n')
+            trap_reasons = defaultdict(int)
+            for trap, reason in self.all_traps():
+                file.write(f"{trap} {reason}\n")
+                trap_reasons[reason] += 1
+            file.write("Traps by reason: \n")
+            for reason, count in trap_reasons.items():
+                file.write(f"{reason} {count}\n")
             
             #Analysis 4
             file.write("Longest page with words: \n")
@@ -395,20 +806,50 @@ class Crawler:
             common_words = self.get_most_common_words()  # Assuming this function returns a list of words
             for word in common_words:
                 file.write(word + '\n')
-
-            # file.write("Redirections: \n")
-            # for key, value in self.redirections.items():
-            #     for each_url in value:
-            #         file.write(each_url + " -> ")
+            if self.word_stats.error_bound:
+                file.write(f"(word counts are approximate: each may be overestimated by up to "
+                           f"{self.word_stats.error_bound}, out of {self.word_stats.total} words counted)\n")
 
             file.write("\n")
-            #file.write(value)
+
+            if self.redirections or os.path.isfile(self.SPILLED_REDIRECTIONS_FILE_NAME):
+                file.write("Redirections: \n")
+                for url, redirects in self.all_redirections():
+                    file.write(" -> ".join(redirects) + "\n")
+
+            if self.near_duplicates is not None:
+                file.write(f"Near-duplicate clusters: {self.near_duplicates.duplicates} near-duplicate pages in "
+                           f"{len(self.near_duplicates.examples)} clusters\n")
+                for url, size, examples in self.near_duplicates.clusters():
+                    file.write(f"{url} {size}\n")
+                    for example in examples:
+                        file.write(f"    {example}\n")
+
+            if self.gated_pages:
+                file.write("Pages skipped or truncated before parsing: \n")
+                for (action, reason), count in sorted(self.gated_pages.items()):
+                    file.write(f"{action} {reason} {count}\n")
+
+            if self.frontier is not None and self.frontier.order == "host":
+                file.write("Host queues (queued, fetched, dropped urls): \n")
+                for host, (queued, fetched, dropped) in sorted(self.frontier.host_queue_stats().items()):
+                    file.write(f"{host} {queued} {fetched} {dropped}\n")
+
+            if self.link_graph is not None:
+                self.link_graph.update_ranks(force=True)
+                file.write(f"Link graph: {len(self.link_graph)} urls, {self.link_graph.edges} links, "
+                           f"{self.link_graph.memory_usage() / max(1, self.link_graph.edges):.1f} bytes per link\n")
+                file.write(f"Top {self.TOP_RANKED_PAGES} pages by PageRank: \n")
+                for url, rank in self.link_graph.top_pages(self.TOP_RANKED_PAGES):
+                    file.write(f"{url} {rank:.6f}\n")
 
             #Analysis 6: Query Params
 
             file.write("Query Params: \n")
             for key, value in self.query_params.items():
                 file.write(f"{key}: {value}\n")
+
+            file.write(f"Duplicate fetches prevented by url canonicalization: {self.canonical_duplicates}\n")
             
             
             
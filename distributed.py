@@ -0,0 +1,355 @@
+"""
+Host-sharded distributed crawl. The url space is partitioned across shards by a hash of the hostname, and every shard
+is crawled by its own worker process with its own frontier, seen url set and crawler analytics. Outlinks owned by
+another shard are sent to its worker in batches, as found on their page: the owner validates them against its seen url
+set and traps and reports back how many were valid, so that the analytics are those of a single crawl. A coordinator
+starts the crawl, detects when all workers have run out of work with no batch in flight, and merges the analytics of
+the workers into a single analysis.txt.
+
+Workers and the coordinator talk over TCP ("host:port") or Unix socket (a path) connections. main.py --shards N runs
+the coordinator and N local workers; workers on other machines join with:
+
+Usage: python distributed.py COORDINATOR_ADDRESS [--authkey KEY] [--listen-host HOST]
+"""
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from multiprocessing.connection import Client, Listener
+from urllib.parse import urlparse
+
+from frontier import Frontier
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUTHKEY = b"crawler"
+
+
+def parse_address(address):
+    """
+    Returns the multiprocessing.connection address for "host:port" or a Unix socket path
+    """
+    if isinstance(address, tuple) or os.sep in address or ":" not in address:
+        return address
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def shard_of(url, shards):
+    """
+    Returns the shard owning a url: all of the urls of a host belong to the same shard, whatever their spelling
+    """
+    try:
+        hostname = (urlparse(url).hostname or "").rstrip(".")
+    except ValueError:
+        hostname = ""
+    digest = hashlib.blake2b(hostname.encode("utf-8", errors="surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shards
+
+
+class ShardedFrontier(Frontier):
+    """
+    This class is the frontier of one shard. The outlinks of a page that belong to another shard are collected in
+    per-shard outboxes, to be sent to their owners by the worker, see split_links. So are urls added that belong to
+    another shard, e.g. the seed.
+
+    The messages in the outboxes are ("url", url) to add a url, ("links", page url, outlinks) to validate and add the
+    outlinks of a page and ("outlinks", page url, count) to report how many of them were valid. They are not part of
+    the frontier state, so a distributed crawl can't be resumed once a worker died with messages in its outboxes.
+
+    Attributes:
+        shard: the shard of this frontier
+        shards: the number of shards
+        outboxes: the messages to be sent to each shard
+    """
+
+    def __init__(self, shard, shards, **kwargs):
+        self.shard = shard
+        self.shards = shards
+        self.outboxes = [[] for _ in range(shards)]
+        super().__init__(**kwargs)
+
+    def add_url(self, url):
+        owner = shard_of(url, self.shards)
+        if owner == self.shard:
+            super().add_url(url)
+        else:
+            self.outboxes[owner].append(("url", url))
+
+    def add_local_url(self, url):
+        super().add_url(url)
+
+    def split_links(self, source, links, send=True):
+        shard_links = defaultdict(list)
+        for link in links:
+            shard_links[shard_of(link, self.shards)].append(link)
+        local_links = shard_links.pop(self.shard, [])
+        if send:
+            for owner, owned_links in shard_links.items():
+                self.outboxes[owner].append(("links", source, owned_links))
+        return local_links, len(shard_links)
+
+
+class ShardWorker:
+    """
+    This class crawls one shard. It registers with the coordinator, which assigns the shard and sends the addresses of
+    the other workers and the crawl options (the command line arguments of main.py). It then crawls its frontier,
+    receiving batches of messages from the other workers on its listener, see ShardedFrontier, until the coordinator
+    stops it, and finally sends its analytics to the coordinator.
+
+    Attributes:
+        batch_size: the number of messages after which an outbox is sent
+        flush_interval: the number of pages after which all outboxes are sent
+        sent: the number of batches sent to other workers
+        received: the number of batches received from other workers and applied
+        idle: whether the frontier, the received batches and the outboxes are all empty
+    """
+
+    def __init__(self, coordinator_address, authkey=DEFAULT_AUTHKEY, listen_host="localhost", batch_size=256,
+                 flush_interval=64):
+        self.coordinator_address = parse_address(coordinator_address)
+        self.authkey = authkey
+        self.listen_host = listen_host
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sent = 0
+        self.received = 0
+        self.idle = False
+        self.inbox = queue.Queue()
+        self.peers = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self):
+        # Imported here as main imports this module
+        from main import create_corpus, create_crawler, enable_metrics, frontier_options
+
+        if isinstance(self.coordinator_address, tuple):
+            listener = Listener((self.listen_host, 0), authkey=self.authkey)
+        else:
+            listener = Listener(family="AF_UNIX", authkey=self.authkey)
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+
+        coordinator = Client(self.coordinator_address, authkey=self.authkey)
+        coordinator.send(("register", listener.address))
+        _, shard, addresses, options = coordinator.recv()
+        self.addresses = addresses
+
+        work_dir = options.shard_dir % shard
+        os.makedirs(work_dir, exist_ok=True)
+        os.chdir(work_dir)
+        frontier = ShardedFrontier(shard, len(addresses), **frontier_options(options))
+        frontier.load_frontier()
+        corpus = create_corpus(options)
+        crawler = create_crawler(options, frontier, corpus)
+        enable_metrics(options, frontier)
+        logger.info("Worker of shard %s of %s started in %s", shard, len(addresses), os.getcwd())
+
+        threading.Thread(target=self._control, args=(coordinator,), daemon=True).start()
+        try:
+            self._crawl(crawler, frontier)
+            coordinator.send(("analytics", crawler.get_analytics()))
+        finally:
+            METRICS.close()
+            frontier.save_frontier()
+            if crawler.extraction_cache is not None:
+                crawler.extraction_cache.close()
+            corpus.close()
+            for connection in self.peers.values():
+                connection.close()
+            listener.close()
+            coordinator.close()
+
+    def _crawl(self, crawler, frontier):
+        pages = 0
+        while not self._stop.is_set():
+            self._receive(crawler, frontier, block=False)
+            if frontier.has_next_url():
+                crawler.crawl_next_url()
+                pages += 1
+                self._send(frontier, force=pages % self.flush_interval == 0)
+                continue
+
+            self._send(frontier, force=True)
+            with self._lock:
+                self.idle = self.inbox.empty() and not frontier.has_next_url()
+            self._receive(crawler, frontier, block=True)
+
+    def _receive(self, crawler, frontier, block):
+        try:
+            batch = self.inbox.get(timeout=0.1) if block else self.inbox.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            with self._lock:
+                self.idle = False
+                for message in batch:
+                    self._apply(message, crawler, frontier)
+                self.received += 1
+            try:
+                batch = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+
+    def _apply(self, message, crawler, frontier):
+        kind = message[0]
+        if kind == "url":
+            frontier.add_local_url(message[1])
+        elif kind == "links":
+            _, source, links = message
+            # Reported back with the next batch to the shard of the page
+            outlinks = crawler.add_remote_links(source, links)
+            frontier.outboxes[shard_of(source, frontier.shards)].append(("outlinks", source, outlinks))
+        else:
+            crawler.add_remote_outlinks(*message[1:])
+
+    def _send(self, frontier, force):
+        for shard, outbox in enumerate(frontier.outboxes):
+            if outbox and (force or len(outbox) >= self.batch_size):
+                connection = self.peers.get(shard)
+                if connection is None:
+                    connection = self.peers[shard] = Client(self.addresses[shard], authkey=self.authkey)
+                connection.send(outbox)
+                frontier.outboxes[shard] = []
+                with self._lock:
+                    self.sent += 1
+
+    def _accept(self, listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._read_batches, args=(connection,), daemon=True).start()
+
+    def _read_batches(self, connection):
+        while True:
+            try:
+                self.inbox.put(connection.recv())
+            except (EOFError, OSError):
+                return
+
+    def _control(self, coordinator):
+        while True:
+            try:
+                message = coordinator.recv()
+            except (EOFError, OSError):
+                self._stop.set()
+                return
+            if message == "status":
+                with self._lock:
+                    coordinator.send(("status", self.idle, self.sent, self.received))
+            elif message == "stop":
+                self._stop.set()
+                return
+
+
+class CrawlCoordinator:
+    """
+    This class coordinates the workers of a distributed crawl. Termination is detected by double counting: the workers
+    are polled for whether they are idle and how many batches they have sent and received, and the crawl is over once
+    two consecutive polls find all of them idle with the same, equal totals of sent and received batches, so that no
+    batch can be in flight.
+
+    Attributes:
+        shards: the number of workers
+        address: the address the coordinator listens on
+        options: the crawl options sent to the workers
+        poll_interval: the number of seconds between polls
+    """
+
+    def __init__(self, shards, options, address=("localhost", 0), authkey=DEFAULT_AUTHKEY, poll_interval=0.5):
+        self.shards = shards
+        self.options = options
+        self.authkey = authkey
+        self.poll_interval = poll_interval
+        self.listener = Listener(parse_address(address), authkey=authkey)
+        self.address = self.listener.address
+
+    def run(self, crawler):
+        """
+        Runs the crawl until global termination, then merges the analytics of the workers into crawler and writes the
+        analysis
+        """
+        workers = []
+        addresses = []
+        while len(workers) < self.shards:
+            connection = self.listener.accept()
+            _, address = connection.recv()
+            workers.append(connection)
+            addresses.append(address)
+            logger.info("Worker %s of %s registered from %s", len(workers), self.shards, address)
+        for shard, connection in enumerate(workers):
+            connection.send(("start", shard, addresses, self.options))
+
+        start = time.perf_counter()
+        previous = None
+        while True:
+            time.sleep(self.poll_interval)
+            statuses = []
+            for connection in workers:
+                connection.send("status")
+                statuses.append(connection.recv()[1:])
+            idle = all(status[0] for status in statuses)
+            sent = sum(status[1] for status in statuses)
+            received = sum(status[2] for status in statuses)
+            if idle and sent == received and previous == (sent, received):
+                break
+            previous = (sent, received) if idle and sent == received else None
+        logger.info("All %s workers are done after %.1fs, %s batches exchanged", self.shards,
+                    time.perf_counter() - start, sent)
+
+        for connection in workers:
+            connection.send("stop")
+        for connection in workers:
+            _, analytics = connection.recv()
+            crawler.merge_analytics(analytics)
+            connection.close()
+        self.listener.close()
+        crawler.output_analysis()
+
+
+def run_distributed(args):
+    """
+    Runs the coordinator of a distributed crawl of args.shards shards and args.local_workers of its workers (all of
+    them by default) as local processes. The other workers have to be started with distributed.py
+    """
+    from crawler import Crawler
+
+    if args.corpus_dir is not None:
+        args.corpus_dir = os.path.abspath(args.corpus_dir)
+    local_workers = args.shards if args.local_workers is None else args.local_workers
+    coordinator = CrawlCoordinator(args.shards, args, args.coordinator_address, args.authkey.encode())
+    logger.info("Coordinator of %s shards listening on %s", args.shards, coordinator.address)
+
+    processes = [multiprocessing.Process(target=run_worker, args=(coordinator.address, args.authkey.encode()))
+                 for _ in range(local_workers)]
+    for process in processes:
+        process.start()
+    # The analytics of the workers are merged into a crawler of its own
+    crawler = Crawler(None, None, args.parser, args.seen_bloom_fpr, None if args.exact_word_counts else args.max_words)
+    coordinator.run(crawler)
+    for process in processes:
+        process.join()
+
+
+def run_worker(coordinator_address, authkey=DEFAULT_AUTHKEY, listen_host="localhost"):
+    logging.basicConfig(format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.INFO)
+    ShardWorker(coordinator_address, authkey, listen_host).run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a worker of a distributed crawl")
+    parser.add_argument("coordinator_address", help="host:port or Unix socket path of the coordinator")
+    parser.add_argument("--authkey", default=DEFAULT_AUTHKEY.decode(), help="shared secret of the crawl")
+    parser.add_argument("--listen-host", default="localhost",
+                        help="address other workers reach this worker on, when using TCP")
+    args = parser.parse_args()
+    run_worker(args.coordinator_address, args.authkey.encode(), args.listen_host)
@@ -0,0 +1,184 @@
+"""
+On-disk cache of what the crawler extracts from each page, so a re-crawl of an unchanged corpus doesn't parse the pages
+again. Entries are keyed by the digest of the corpus file and are only valid for the size and modification time the file
+had when the entry was written (see Corpus.get_file_version).
+"""
+import logging
+import sqlite3
+import struct
+import zlib
+from array import array
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# links: the absolute outlinks of the page, before validation
+# word_count: the number of words of the page
+# word_counts: word -> count of the words that count for the most common words analysis, in order of first occurrence
+# simhash: the near-duplicate signature of the page, or None if it wasn't computed
+# gate: None, or the (action, reason) of a page skipped or truncated before parsing, see content_gate
+Extraction = namedtuple("Extraction", ["links", "word_count", "word_counts", "simhash", "gate"])
+
+
+class ExtractionCache:
+    """
+    This class stores Extractions in an SQLite table, each encoded as a compact binary record: a fixed header, the
+    lengths of the links and the counts of the words as arrays of unsigned 32 bit integers, then the links and the words
+    themselves, all compressed with zlib.
+
+    The total size of the records is kept under max_bytes by evicting the least recently used entries. Entries written
+    with a different variant (e.g. another page parser) are dropped when the cache is opened.
+
+    Attributes:
+        path: the SQLite database file
+        max_bytes: the maximum total size of the encoded records
+        variant: the configuration the extractions depend on
+        size: the current total size of the encoded records
+        hits: the number of lookups answered from the cache
+        misses: the number of lookups that found no valid entry
+        stale: the number of misses due to an entry written for another version of the corpus file
+        evictions: the number of entries evicted to stay under max_bytes
+    """
+
+    # word count, number of links, number of words, whether there is a simhash, simhash, length of the gate
+    RECORD_HEADER = struct.Struct("<IIIBQH")
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, path, max_bytes=1 << 30, variant=""):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.variant = variant
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self._uncommitted = 0
+
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entries (digest BLOB PRIMARY KEY, size INTEGER, "
+                                 "mtime INTEGER, used INTEGER, data BLOB)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'variant'").fetchone()
+        if row is None or row[0] != variant:
+            if row is not None:
+                logger.info("Extraction cache %s was written for %r, clearing it", path, row[0])
+            self._connection.execute("DELETE FROM entries")
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('variant', ?)", (variant,))
+        self._connection.commit()
+        self.size, self._clock = self._connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(data)), 0), COALESCE(MAX(used), 0) FROM entries").fetchone()
+
+    @staticmethod
+    def _key(digest):
+        try:
+            return bytes.fromhex(digest)
+        except ValueError:
+            return digest.encode("utf-8")
+
+    @classmethod
+    def encode(cls, extraction):
+        links = [link.encode("utf-8", errors="surrogatepass") for link in extraction.links]
+        words = list(extraction.word_counts)
+        simhash = extraction.simhash
+        gate = " ".join(extraction.gate).encode("utf-8") if extraction.gate is not None else b""
+        parts = [
+            cls.RECORD_HEADER.pack(extraction.word_count, len(links), len(words), simhash is not None, simhash or 0,
+                                   len(gate)),
+            array("I", map(len, links)).tobytes(),
+            array("I", extraction.word_counts.values()).tobytes(),
+            gate,
+            b"".join(links),
+            "\n".join(words).encode("utf-8", errors="surrogatepass"),
+        ]
+        return zlib.compress(b"".join(parts), 1)
+
+    @classmethod
+    def decode(cls, data):
+        data = zlib.decompress(data)
+        word_count, link_count, word_total, has_simhash, simhash, gate_length = cls.RECORD_HEADER.unpack_from(data)
+        pos = cls.RECORD_HEADER.size
+        link_lengths = array("I", data[pos:pos + 4 * link_count])
+        pos += 4 * link_count
+        counts = array("I", data[pos:pos + 4 * word_total])
+        pos += 4 * word_total
+        gate = tuple(data[pos:pos + gate_length].decode("utf-8").split(" ", 1)) if gate_length else None
+        pos += gate_length
+        links = []
+        for length in link_lengths:
+            links.append(data[pos:pos + length].decode("utf-8", errors="surrogatepass"))
+            pos += length
+        words = data[pos:].decode("utf-8", errors="surrogatepass").split("\n") if word_total else []
+        return Extraction(links, word_count, dict(zip(words, counts)), simhash if has_simhash else None, gate)
+
+    def get(self, version):
+        """
+        Returns the cached Extraction of a corpus file, or None if there is no entry for this version of the file
+        :param version: the (digest, size, modification time) of the file, see Corpus.get_file_version
+        """
+        digest, size, mtime = version
+        key = self._key(digest)
+        row = self._connection.execute("SELECT size, mtime, data FROM entries WHERE digest = ?", (key,)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            self.misses += 1
+            if row is not None:
+                self.stale += 1
+            return None
+        self.hits += 1
+        self._clock += 1
+        self._connection.execute("UPDATE entries SET used = ? WHERE digest = ?", (self._clock, key))
+        self._operation()
+        return self.decode(row[2])
+
+    def stale_hit(self):
+        """
+        Counts the last hit as a stale miss, once the file read turned out to be another version than the one looked up
+        """
+        self.hits -= 1
+        self.misses += 1
+        self.stale += 1
+
+    def put(self, version, extraction):
+        """
+        Stores the Extraction of a corpus file, replacing any entry for another version of it
+        """
+        digest, size, mtime = version
+        key = self._key(digest)
+        data = self.encode(extraction)
+        row = self._connection.execute("SELECT LENGTH(data) FROM entries WHERE digest = ?", (key,)).fetchone()
+        if row is not None:
+            self.size -= row[0]
+        self._clock += 1
+        self._connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                                 (key, size, mtime, self._clock, data))
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self._evict()
+        self._operation()
+
+    def _evict(self):
+        # Evict down to 90% of the budget so that evictions happen in batches
+        target = self.max_bytes * 9 // 10
+        evicted = []
+        for key, length in self._connection.execute("SELECT digest, LENGTH(data) FROM entries ORDER BY used"):
+            if self.size <= target:
+                break
+            evicted.append((key,))
+            self.size -= length
+        self._connection.executemany("DELETE FROM entries WHERE digest = ?", evicted)
+        self.evictions += len(evicted)
+
+    def _operation(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self._connection.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        """
+        Commits the pending changes and logs the hit and miss counts
+        """
+        self._connection.commit()
+        self._connection.close()
+        logger.info("Extraction cache: %s hits, %s misses (%s stale), %s evictions, %.1f MB", self.hits, self.misses,
+                    self.stale, self.evictions, self.size / (1 << 20))
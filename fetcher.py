@@ -0,0 +1,66 @@
+"""
+The interface between the crawler and where pages come from. Corpus fetches pages from the local corpus and HttpFetcher
+(see http_fetcher) from the web; both return the same url_data dictionaries.
+"""
+
+
+def not_found(url):
+    """
+    Returns the url_data of a url that could not be fetched
+    """
+    return {
+        "url": url,
+        "content": None,
+        "http_code": 404,
+        "headers": None,
+        "size": 0,
+        "content_type": None,
+        "is_redirected": False,
+        "final_url": None,
+        "redirects": [url],
+    }
+
+
+class Fetcher:
+    """
+    This class is the interface of page fetchers. fetch_url must be safe to call from several threads at once, e.g. the
+    fetch threads of the crawl pipeline
+    """
+
+    def fetch_url(self, url, include_content=True):
+        """
+        Fetches a url and returns a dictionary representing the response, see Corpus.fetch_url for its keys
+        :param url: the url to be fetched
+        :param include_content: whether the body of the page is needed
+        """
+        raise NotImplementedError
+
+    def fetch_many(self, urls, headers_only=()):
+        """
+        Fetches a batch of urls and yields their url_data dictionaries as they complete, which need not be the order of
+        urls. This implementation fetches them one at a time, in order
+        :param urls: the urls to be fetched
+        :param headers_only: the urls whose body isn't needed, see fetch_url include_content
+        """
+        for url in urls:
+            yield self.fetch_url(url, url not in headers_only)
+
+    def get_file_name(self, url):
+        """
+        Returns a name for the stored page of a url, or None if the url can't be fetched. The crawler only adds urls
+        with a file name to the frontier
+        """
+        raise NotImplementedError
+
+    def get_file_version(self, url):
+        """
+        Returns a value that changes whenever the page of a url changes, or None if that isn't known. Used as the key of
+        the extraction cache
+        """
+        return None
+
+    def close(self):
+        """
+        Releases the resources of the fetcher
+        """
+        pass
@@ -0,0 +1,165 @@
+import hashlib
+import math
+from array import array
+
+
+def url_fingerprint(url):
+    """
+    Returns a 64 bit fingerprint of a url. With 64 bits, the chance of two of a billion urls colliding is about 3%
+    """
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8", errors="surrogatepass"), digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    """
+    This class is a Bloom filter over 64 bit fingerprints. It answers "definitely not seen" or "probably seen" with the
+    given false positive rate as long as it holds no more than expected_items fingerprints
+
+    Attributes:
+        bits: the number of bits of the filter
+        hashes: the number of bit positions set per fingerprint
+    """
+
+    def __init__(self, expected_items, false_positive_rate):
+        self.bits = max(64, int(-expected_items * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / expected_items * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, fingerprint):
+        # Double hashing: the two halves of the fingerprint generate all of the bit positions
+        h1 = fingerprint & 0xffffffff
+        h2 = (fingerprint >> 32) | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def add_fingerprint(self, fingerprint):
+        array_ = self.array
+        for position in self._positions(fingerprint):
+            array_[position >> 3] |= 1 << (position & 7)
+
+    def contains_fingerprint(self, fingerprint):
+        array_ = self.array
+        for position in self._positions(fingerprint):
+            if not array_[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def clear(self):
+        self.array = bytearray(len(self.array))
+
+
+class FingerprintSet:
+    """
+    This class is a set of urls that stores only their 64 bit fingerprints in an open addressing hash table backed by
+    an array of unsigned 64 bit integers, which takes 8 bytes per slot (11-21 bytes per url, depending on how full the
+    table is) instead of the hundreds of bytes a url takes in a set of strings. The urls themselves can't be listed.
+
+    An optional Bloom filter in front of the table answers most lookups of unseen urls without probing the table.
+
+    Attributes:
+        table: the slots of the hash table. 0 marks an empty slot
+        length: the number of fingerprints in the table
+        bloom: the Bloom filter front end, or None
+    """
+
+    MAX_LOAD = 0.75
+
+    def __init__(self, capacity=1 << 10, bloom_fpr=None, expected_items=1 << 20):
+        size = 1 << max(3, math.ceil(math.log2(capacity / self.MAX_LOAD)))
+        self.table = array("Q", bytes(8 * size))
+        self.mask = size - 1
+        self.length = 0
+        self.bloom = BloomFilter(expected_items, bloom_fpr) if bloom_fpr else None
+
+    def _slot(self, fingerprint):
+        """
+        Returns the slot holding the fingerprint, or the empty slot where it would be inserted
+        """
+        table = self.table
+        mask = self.mask
+        slot = fingerprint & mask
+        while True:
+            value = table[slot]
+            if value == fingerprint or value == 0:
+                return slot
+            slot = (slot + 1) & mask
+
+    @staticmethod
+    def _normalize(fingerprint):
+        # 0 marks empty slots
+        return fingerprint or 1
+
+    def contains_fingerprint(self, fingerprint):
+        fingerprint = self._normalize(fingerprint)
+        if self.bloom is not None and not self.bloom.contains_fingerprint(fingerprint):
+            return False
+        return self.table[self._slot(fingerprint)] != 0
+
+    def add_fingerprint(self, fingerprint):
+        """
+        Adds a fingerprint. Returns True if it wasn't in the set yet
+        """
+        fingerprint = self._normalize(fingerprint)
+        slot = self._slot(fingerprint)
+        if self.table[slot] != 0:
+            return False
+        self.table[slot] = fingerprint
+        self.length += 1
+        if self.bloom is not None:
+            self.bloom.add_fingerprint(fingerprint)
+        if self.length > self.MAX_LOAD * len(self.table):
+            self._grow()
+        return True
+
+    def _grow(self):
+        self._rehash(2 * len(self.table))
+
+    def _rehash(self, size):
+        old_table = self.table
+        self.table = array("Q", bytes(8 * size))
+        self.mask = size - 1
+        for fingerprint in old_table:
+            if fingerprint:
+                self.table[self._slot(fingerprint)] = fingerprint
+
+    def compact(self):
+        """
+        Drops the Bloom filter, after which lookups of unseen urls probe the table, and shrinks the table to the
+        smallest size holding the fingerprints, e.g. to free memory. Returns True if either took any memory
+        """
+        size = 1 << max(3, math.ceil(math.log2(max(1, self.length) / self.MAX_LOAD)))
+        compacted = self.bloom is not None or size < len(self.table)
+        self.bloom = None
+        if size < len(self.table):
+            self._rehash(size)
+        return compacted
+
+    def add(self, url):
+        """
+        Adds a url. Returns True if it wasn't in the set yet
+        """
+        return self.add_fingerprint(url_fingerprint(url))
+
+    def clear(self):
+        self.table = array("Q", bytes(8 * len(self.table)))
+        self.length = 0
+        if self.bloom is not None:
+            self.bloom.clear()
+
+    def fingerprints(self):
+        """
+        Yields the fingerprints in the set, in no particular order
+        """
+        return (fingerprint for fingerprint in self.table if fingerprint)
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes taken by the table and the Bloom filter
+        """
+        return self.table.itemsize * len(self.table) + (len(self.bloom.array) if self.bloom is not None else 0)
+
+    def __contains__(self, url):
+        return self.contains_fingerprint(url_fingerprint(url))
+
+    def __len__(self):
+        return self.length
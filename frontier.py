@@ -1,8 +1,13 @@
 import logging
 import os
+import struct
+import time
 from collections import deque
 import pickle
 
+from fingerprint import FingerprintSet
+from frontier_storage import URL_COST, DiskUrlSet, HostQueue, ScoredUrlQueue, SpillQueue
+
 logger = logging.getLogger(__name__)
 
 class Frontier:
@@ -11,23 +16,248 @@ class Frontier:
     check if the frontier has any more urls. Additionally, it has methods to save the current state of the frontier and
     load existing state
 
+    The state is persisted as a snapshot plus a write-ahead log. After load_frontier every add and pop is appended to
+    the log of the current snapshot generation, and the log is flushed each time a url is taken from the frontier, so
+    a killed crawl loses at most the operations of the page being processed. save_frontier compacts the log into a new
+    snapshot; it runs every checkpoint_interval logged operations and at exit. Attached structures (see attach) are
+    saved in the snapshots too, and log_record logs their changes, e.g. the analytics of each crawled page, in the same
+    log, so that they are restored at the same point as the frontier. With track_in_flight, urls taken from the
+    frontier whose processing wasn't logged as done before the crawl was killed are put back in the queue on restart.
+
+    With a memory_budget, the queue and the set of seen urls are kept mostly on disk (see frontier_storage): only the
+    head of the queue and a tail buffer stay in memory and the seen set is a disk-backed fingerprint table. spill moves
+    them to disk that way during a crawl, e.g. when the memory governor finds the crawl short of memory, and a spilled
+    queue stays on disk after a restart.
+
+    The order urls are taken in is one of ORDERS:
+        fifo: the order they were added, a breadth-first crawl
+        pagerank: the highest scored url first, with the scores set by prioritize, e.g. the PageRank of the urls in the
+            crawl graph (see LinkGraph), so that the most valuable pages are reached early. The queue is kept in memory.
+            A restarted crawl scores its queue with the restored scores, so its order can differ from the one the
+            crawl would have taken without the restart
+        host: the urls of each host in the order they were added, with the hosts served in turns and optional per host
+            caps, see HostQueue. The queue is kept in memory. Urls put back after a restart go to the head of the queue
+            of their host, so the order can differ from the one the crawl would have taken without the restart
+
     Attributes:
         urls_queue: A queue of urls to be download by crawlers
-        urls_set: A set of urls to avoid duplicated urls
+        urls_set: A set of urls to avoid duplicated urls. It keeps 64 bit fingerprints only (see FingerprintSet)
         fetched: the number of fetched urls so far
+        generation: the generation of the last snapshot. The log of that generation holds the operations done since
+        that snapshot
+        checkpoint_interval: the number of logged operations after which the log is compacted into a snapshot
+        memory_budget: the approximate number of bytes the queue and the seen set may use in memory. None keeps
+        everything in memory
+        attachments: name -> structure saved in the snapshots along with the frontier, see attach
+        in_flight: the urls taken from the frontier and not done yet, in order, if tracked. See track_in_flight
+        order: the order urls are taken in, one of ORDERS
+        host_options: the keyword arguments of the HostQueue of the host order
     """
 
+    ORDERS = ("fifo", "pagerank", "host")
+
     # File names to be used when loading and saving the frontier state
     FRONTIER_DIR_NAME = "frontier_state"
+    SNAPSHOT_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "snapshot.pkl")
+    LOG_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "frontier.%s.log")
+    QUEUE_DIR_NAME = os.path.join(".", FRONTIER_DIR_NAME, "queue")
+    SEEN_SET_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "seen.sqlite3")
+
+    # Files written by older versions, which pickled the whole state at exit. Still loaded if there is no snapshot
     URL_QUEUE_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "url_queue.pkl")
     URL_SET_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "url_set.pkl")
     FETCHED_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "fetched.pkl")
 
+    # Log records: operation code, payload length, payload. The payload of ADD, POP and REQUEUE is the utf-8 encoded
+    # url, the one of RECORD the pickled (attachment name, record, done url)
+    LOG_RECORD_HEADER = struct.Struct("<cI")
+    ADD = b"A"
+    POP = b"P"
+    RECORD = b"R"
+    REQUEUE = b"Q"
 
-    def __init__(self):
-        self.urls_queue = deque()
-        self.urls_set = set()
+    def __init__(self, checkpoint_interval=500000, memory_budget=None, seen_bloom_fpr=None, order="fifo",
+                 host_weights=None, host_max_queued=None, host_max_fetched=None):
+        self.memory_budget = memory_budget
+        self.order = order
+        self.host_options = {"weights": host_weights, "max_queued": host_max_queued, "max_fetched": host_max_fetched}
+        if memory_budget is None:
+            self.urls_set = FingerprintSet(bloom_fpr=seen_bloom_fpr)
+        else:
+            if not os.path.exists(self.FRONTIER_DIR_NAME):
+                os.makedirs(self.FRONTIER_DIR_NAME)
+            self.urls_set = DiskUrlSet(self.SEEN_SET_FILE_NAME, memory_budget // 4)
+        self.urls_queue = self._create_queue()
         self.fetched = 0
+        self.generation = 0
+        self.checkpoint_interval = checkpoint_interval
+        self._log = None
+        self._logged_operations = 0
+        self.attachments = dict()
+        self._restored_attachments = dict()
+        self._replayed_records = dict()
+        self.in_flight = None
+        self._unfinished = []
+
+    def _create_queue(self):
+        if self.order == "pagerank":
+            return ScoredUrlQueue()
+        if self.order == "host":
+            return HostQueue(**self.host_options)
+        if self.memory_budget is None:
+            return deque()
+        return SpillQueue(self.QUEUE_DIR_NAME, self.memory_budget * 3 // 4)
+
+    def _restore_queue(self, urls_queue):
+        """
+        Returns a restored queue, with its urls moved to a queue of the current order if it was saved with another one
+        """
+        queue = self._create_queue()
+        if type(urls_queue) is type(queue) or self.order == "fifo" and isinstance(urls_queue, SpillQueue):
+            if self.order == "host":
+                # The caps and weights of this run apply
+                urls_queue.weights, urls_queue.max_queued, urls_queue.max_fetched = \
+                    queue.weights, queue.max_queued, queue.max_fetched
+            return urls_queue
+        while len(urls_queue):
+            queue.append(urls_queue.popleft())
+        logger.info("Moved %s queued urls to a queue in %s order", len(queue), self.order)
+        return queue
+
+    def spill(self, memory_budget):
+        """
+        Moves the seen set, and the queue in the fifo order, to disk as with a memory_budget, if they are in memory.
+        Returns True if anything was moved
+        """
+        spilled = False
+        if isinstance(self.urls_set, FingerprintSet):
+            os.makedirs(self.FRONTIER_DIR_NAME, exist_ok=True)
+            urls_set = DiskUrlSet(self.SEEN_SET_FILE_NAME, memory_budget // 4)
+            # Left over from an older crawl, as the seen set is in memory
+            urls_set.clear()
+            urls_set.add_fingerprints(self.urls_set.fingerprints())
+            self.urls_set = urls_set
+            spilled = True
+        if self.order == "fifo" and isinstance(self.urls_queue, deque):
+            urls_queue = SpillQueue(self.QUEUE_DIR_NAME, memory_budget * 3 // 4)
+            while self.urls_queue:
+                urls_queue.append(self.urls_queue.popleft())
+            self.urls_queue = urls_queue
+            spilled = True
+        if spilled:
+            self.memory_budget = memory_budget
+            logger.info("Moved the frontier to disk: %s seen urls, %s queued urls", len(self.urls_set),
+                        len(self.urls_queue))
+        return spilled
+
+    def spilled_usage(self, memory_budget):
+        """
+        Returns the approximate number of bytes memory_usage would return after spill(memory_budget), which is more
+        than now if the seen set is smaller than the page cache it would get
+        """
+        usage = self.memory_usage()
+        if isinstance(self.urls_set, FingerprintSet):
+            usage += memory_budget // 4 - self.urls_set.memory_usage()
+        if self.order == "fifo" and isinstance(self.urls_queue, deque):
+            queue_usage = URL_COST * len(self.urls_queue)
+            usage -= queue_usage - min(queue_usage, memory_budget * 3 // 4)
+        return usage
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes the queue and the seen set take in memory
+        """
+        if isinstance(self.urls_queue, SpillQueue):
+            queue_usage = self.urls_queue.memory_usage()
+        else:
+            queue_usage = URL_COST * len(self.urls_queue)
+        # The seen set of older versions is a set of urls
+        if hasattr(self.urls_set, "memory_usage"):
+            return queue_usage + self.urls_set.memory_usage()
+        return queue_usage + URL_COST * len(self.urls_set)
+
+    def prioritize(self, score):
+        """
+        Sets the function giving the score of a url in the pagerank order and scores the queued urls with it
+        """
+        self.urls_queue.score = score
+        self.urls_queue.rescore()
+
+    def rescore(self):
+        """
+        Scores the queued urls again in the pagerank order, e.g. after the scores were recomputed
+        """
+        if self.order == "pagerank":
+            self.urls_queue.rescore()
+
+    def host_queue_depths(self):
+        """
+        Returns host -> number of queued urls in the host order, an empty dictionary in the other orders. Safe to call
+        from another thread, e.g. for the metrics
+        """
+        return self.urls_queue.depths() if self.order == "host" else {}
+
+    def host_queue_stats(self):
+        """
+        Returns host -> (queued, fetched, dropped by the caps) numbers of urls of every host seen in the host order, an
+        empty dictionary in the other orders
+        """
+        if self.order != "host":
+            return {}
+        depths = self.urls_queue.depths()
+        hosts = set(depths) | set(self.urls_queue.fetched) | set(self.urls_queue.dropped)
+        return {host: (depths.get(host, 0), self.urls_queue.fetched.get(host, 0), self.urls_queue.dropped.get(host, 0))
+                for host in hosts}
+
+    def attach(self, name, create):
+        """
+        Saves a structure, e.g. crawler state, in every snapshot of the frontier and returns it. The structure is the one
+        of the same name in the loaded snapshot, if there is one, otherwise create() makes a new one. Attached
+        structures are restored as of the last snapshot, their later changes only through log_record
+        """
+        if name in self._restored_attachments:
+            structure = self._restored_attachments.pop(name)
+        else:
+            structure = create()
+        self.attachments[name] = structure
+        return structure
+
+    def log_record(self, name, record, done_url=None):
+        """
+        Logs a change of the structure attached as name, to be returned by replayed_records after a restart if the log
+        is loaded before the next snapshot. The log is flushed, so that the change is logged along with the frontier
+        operations that came with it
+        :param done_url: the url taken from the frontier whose processing ends with this change, see track_in_flight
+        """
+        if self.in_flight is not None and done_url is not None:
+            self.in_flight.pop(done_url, None)
+        if self._log is not None:
+            self._log_write(self.RECORD, pickle.dumps((name, record, done_url), protocol=pickle.HIGHEST_PROTOCOL))
+            self._log.flush()
+
+    def track_in_flight(self):
+        """
+        Starts tracking the urls taken from the frontier until their processing is logged as done by log_record. The
+        urls of the loaded state that were taken but not done are put back at the head of the queue first, so that they
+        are processed again
+        """
+        if self.in_flight is not None:
+            return
+        self.in_flight = dict()
+        for url in reversed(self._unfinished):
+            self.urls_queue.appendleft(url)
+            self.fetched -= 1
+            self._log_operation(self.REQUEUE, url)
+        if self._unfinished:
+            logger.info("Put back %s urls taken but not done before the restart", len(self._unfinished))
+        self._unfinished = []
+
+    def replayed_records(self, name):
+        """
+        Returns the records logged for the structure attached as name since the loaded snapshot, in order. The
+        structure returned by attach is as of that snapshot, so they have to be applied to it again
+        """
+        return self._replayed_records.pop(name, [])
 
     def add_url(self, url):
         """
@@ -37,6 +267,16 @@ class Frontier:
         if not self.is_duplicate(url):
             self.urls_queue.append(url)
             self.urls_set.add(url)
+            self._log_operation(self.ADD, url)
+
+    def split_links(self, source, links, send=True):
+        """
+        Returns the outlinks of a page that the crawler validates and adds itself, and the number of other frontiers
+        the others are sent to, to be validated there. Frontiers not sharing the url space with others keep them all
+        :param source: the url of the page
+        :param send: False if the page is replayed, so that its links were sent already
+        """
+        return links, 0
 
     def is_duplicate(self, url):
         return url in self.urls_set
@@ -47,7 +287,15 @@ class Frontier:
         """
         if self.has_next_url():
             self.fetched += 1
-            return self.urls_queue.popleft()
+            url = self.urls_queue.popleft()
+            if self.in_flight is not None:
+                self.in_flight[url] = None
+            if self._log is not None:
+                self._log_operation(self.POP, url)
+                self._log.flush()
+                if self._logged_operations >= self.checkpoint_interval:
+                    self.save_frontier()
+            return url
 
     def has_next_url(self):
         """
@@ -55,38 +303,166 @@ class Frontier:
         """
         return len(self.urls_queue) != 0
 
+    def _log_operation(self, operation, url):
+        if self._log is not None:
+            self._log_write(operation, url.encode("utf-8", errors="surrogatepass"))
+
+    def _log_write(self, operation, payload):
+        self._log.write(self.LOG_RECORD_HEADER.pack(operation, len(payload)))
+        self._log.write(payload)
+        self._logged_operations += 1
+
+    def _open_log(self):
+        self._log = open(self.LOG_FILE_NAME % self.generation, "ab")
+        self._logged_operations = 0
+
+    def _remove_old_logs(self):
+        current_log = os.path.basename(self.LOG_FILE_NAME % self.generation)
+        for file_name in os.listdir(self.FRONTIER_DIR_NAME):
+            if file_name.startswith("frontier.") and file_name.endswith(".log") and file_name != current_log:
+                os.remove(os.path.join(self.FRONTIER_DIR_NAME, file_name))
+
     def save_frontier(self):
         """
-        saves the current state of the frontier in two files using pickle
+        saves the current state of the frontier as a new snapshot and starts a new, empty log
         """
         if not os.path.exists(self.FRONTIER_DIR_NAME):
             os.makedirs(self.FRONTIER_DIR_NAME)
 
-        url_queue_file = open(self.URL_QUEUE_FILE_NAME, "wb")
-        url_set_file = open(self.URL_SET_FILE_NAME, "wb")
-        fetched_file = open(self.FETCHED_FILE_NAME, "wb")
-        pickle.dump(self.urls_queue, url_queue_file)
-        pickle.dump(self.urls_set, url_set_file)
-        pickle.dump(self.fetched, fetched_file)
+        start = time.perf_counter()
+        state = {
+            "generation": self.generation + 1,
+            "urls_queue": self.urls_queue,
+            "urls_set": self.urls_set,
+            "fetched": self.fetched,
+            "attachments": self.attachments,
+            "in_flight": list(self.in_flight) if self.in_flight is not None else None,
+        }
+        tmp_file_name = self.SNAPSHOT_FILE_NAME + ".tmp"
+        with open(tmp_file_name, "wb") as snapshot_file:
+            pickle.dump(state, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(tmp_file_name, self.SNAPSHOT_FILE_NAME)
+        for structure in [self.urls_queue, self.urls_set] + list(self.attachments.values()):
+            if hasattr(structure, "checkpointed"):
+                structure.checkpointed()
+
+        if self._log is not None:
+            self._log.close()
+        self.generation += 1
+        self._open_log()
+        self._remove_old_logs()
+        logger.info("Saved frontier snapshot %s in %.2fs. Fetched: %s, Queue size: %s", self.generation,
+                    time.perf_counter() - start, self.fetched, len(self.urls_queue))
+
+    def _replay_log(self):
+        """
+        Applies the operations logged since the snapshot. A record cut short by a crash is dropped
+        """
+        log_file_name = self.LOG_FILE_NAME % self.generation
+        if not os.path.isfile(log_file_name):
+            return 0
+
+        replayed = 0
+        valid_length = 0
+        # Urls taken and not done, in order
+        unfinished = dict.fromkeys(self._unfinished)
+        with open(log_file_name, "rb") as log_file:
+            while True:
+                header = log_file.read(self.LOG_RECORD_HEADER.size)
+                if len(header) < self.LOG_RECORD_HEADER.size:
+                    break
+                operation, length = self.LOG_RECORD_HEADER.unpack(header)
+                payload = log_file.read(length)
+                if len(payload) < length or operation not in (self.ADD, self.POP, self.RECORD, self.REQUEUE):
+                    break
+                if operation == self.RECORD:
+                    name, record, done_url = pickle.loads(payload)
+                    self._replayed_records.setdefault(name, []).append(record)
+                    unfinished.pop(done_url, None)
+                    valid_length = log_file.tell()
+                    replayed += 1
+                    continue
+                url = payload.decode("utf-8", errors="surrogatepass")
+                if operation == self.REQUEUE:
+                    self.urls_queue.appendleft(url)
+                    self.fetched -= 1
+                    unfinished.pop(url, None)
+                elif operation == self.ADD:
+                    # Logged adds already passed the duplicate check. The seen set may even be ahead of the snapshot
+                    self.urls_queue.append(url)
+                    self.urls_set.add(url)
+                else:
+                    self.fetched += 1
+                    if self.order == "pagerank":
+                        # The scores of the queued urls are only restored later, so the pop is replayed by url
+                        self.urls_queue.remove(url)
+                    else:
+                        popped = self.urls_queue.popleft()
+                        if popped != url:
+                            logger.warning("Frontier log is out of order: expected %s, popped %s", url, popped)
+                    unfinished[url] = None
+                valid_length = log_file.tell()
+                replayed += 1
+
+        self._unfinished = list(unfinished)
+        if valid_length < os.path.getsize(log_file_name):
+            logger.warning("Dropping a partially written record at the end of %s", log_file_name)
+            with open(log_file_name, "r+b") as log_file:
+                log_file.truncate(valid_length)
+        return replayed
 
     def load_frontier(self):
         """
-        loads the previous state of the frontier into memory, if exists
+        loads the previous state of the frontier into memory, if exists, and starts logging operations
         """
-        if os.path.isfile(self.URL_QUEUE_FILE_NAME) and os.path.isfile(self.URL_SET_FILE_NAME) and\
+        if not os.path.exists(self.FRONTIER_DIR_NAME):
+            os.makedirs(self.FRONTIER_DIR_NAME)
+
+        start = time.perf_counter()
+        restored = True
+        if os.path.isfile(self.SNAPSHOT_FILE_NAME):
+            try:
+                with open(self.SNAPSHOT_FILE_NAME, "rb") as snapshot_file:
+                    state = pickle.load(snapshot_file)
+            except Exception:
+                logger.exception("Could not read the frontier snapshot %s", self.SNAPSHOT_FILE_NAME)
+                raise
+            self.urls_queue = self._restore_queue(state["urls_queue"])
+            self.urls_set = state["urls_set"]
+            self.fetched = state["fetched"]
+            self.generation = state["generation"]
+            self._restored_attachments = state.get("attachments", {})
+            self._unfinished = state.get("in_flight") or []
+        elif os.path.isfile(self.URL_QUEUE_FILE_NAME) and os.path.isfile(self.URL_SET_FILE_NAME) and\
                 os.path.isfile(self.FETCHED_FILE_NAME):
             try:
-                self.urls_queue = pickle.load(open(self.URL_QUEUE_FILE_NAME, "rb"))
-                self.urls_set = pickle.load(open(self.URL_SET_FILE_NAME, "rb"))
-                self.fetched = pickle.load(open(self.FETCHED_FILE_NAME, "rb"))
-                logger.info("Loaded previous frontier state into memory. Fetched: %s, Queue size: %s", self.fetched,
-                            len(self.urls_queue))
-            except:
-                pass
+                with open(self.URL_QUEUE_FILE_NAME, "rb") as url_queue_file, \
+                        open(self.URL_SET_FILE_NAME, "rb") as url_set_file, \
+                        open(self.FETCHED_FILE_NAME, "rb") as fetched_file:
+                    self.urls_queue = self._restore_queue(pickle.load(url_queue_file))
+                    self.urls_set = pickle.load(url_set_file)
+                    self.fetched = pickle.load(fetched_file)
+            except Exception:
+                logger.exception("Could not read the previous frontier state in %s", self.FRONTIER_DIR_NAME)
+                raise
         else:
+            # A crawl killed before its first snapshot only leaves the log of generation 0
+            restored = False
+            self.urls_queue.clear()
+            self.urls_set.clear()
+
+        replayed = self._replay_log()
+        self._open_log()
+        self._remove_old_logs()
+        if not restored and replayed == 0:
             logger.info("No previous frontier state found. Starting from the seed URL ...")
             self.add_url("http://www.ics.uci.edu/")
+            return
+        logger.info("Loaded previous frontier state into memory in %.2fs (snapshot %s, %s log records replayed). "
+                    "Fetched: %s, Queue size: %s", time.perf_counter() - start, self.generation, replayed,
+                    self.fetched, len(self.urls_queue))
 
     def __len__(self):
         return len(self.urls_queue)
-
@@ -0,0 +1,378 @@
+import heapq
+import logging
+import os
+import sqlite3
+import struct
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+
+from fingerprint import url_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Approximate memory taken by one queued url: the str object, a typical url and the container slot
+URL_COST = 160
+
+
+class SpillQueue:
+    """
+    This class is a FIFO queue of urls that keeps only a bounded number of urls in memory. The head of the queue and a
+    tail buffer stay in memory, and whenever the tail buffer fills up it is written to a new segment file. Segments are
+    read back in FIFO order once the head runs empty.
+
+    The queue pickles to its in-memory parts plus the names of its segment files. A consumed segment is only deleted
+    by checkpointed, i.e. once a newer frontier snapshot no longer refers to it.
+
+    Attributes:
+        directory: the directory holding the segment files
+        head_capacity: the number of urls kept in the in-memory head
+        segment_capacity: the number of urls per segment file, which is also the size of the tail buffer
+    """
+
+    SEGMENT_FILE_NAME = "segment-%08d.bin"
+    RECORD_HEADER = struct.Struct("<I")
+
+    def __init__(self, directory, memory_budget):
+        self.directory = directory
+        capacity = max(2, memory_budget // URL_COST)
+        self.head_capacity = capacity // 2
+        self.segment_capacity = capacity - self.head_capacity
+        self.head = deque()
+        self.tail = []
+        self.segments = deque()
+        self.next_segment = 0
+        self.retired = []
+        self.length = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, url):
+        if not self.segments and not self.tail and len(self.head) < self.head_capacity:
+            self.head.append(url)
+        else:
+            self.tail.append(url)
+            if len(self.tail) >= self.segment_capacity:
+                self._spill()
+        self.length += 1
+
+    def appendleft(self, url):
+        self.head.appendleft(url)
+        self.length += 1
+
+    def popleft(self):
+        if not self.head:
+            if self.segments:
+                self._load_segment()
+            else:
+                self.head.extend(self.tail)
+                self.tail = []
+        url = self.head.popleft()
+        self.length -= 1
+        return url
+
+    def clear(self):
+        self.retired.extend(self.segments)
+        self.head.clear()
+        self.tail = []
+        self.segments.clear()
+        self.length = 0
+
+    def _spill(self):
+        segment = self.SEGMENT_FILE_NAME % self.next_segment
+        self.next_segment += 1
+        with open(os.path.join(self.directory, segment), "wb") as segment_file:
+            for url in self.tail:
+                encoded_url = url.encode("utf-8", errors="surrogatepass")
+                segment_file.write(self.RECORD_HEADER.pack(len(encoded_url)))
+                segment_file.write(encoded_url)
+        self.segments.append(segment)
+        self.tail = []
+
+    def _load_segment(self):
+        segment = self.segments.popleft()
+        with open(os.path.join(self.directory, segment), "rb") as segment_file:
+            data = segment_file.read()
+        pos = 0
+        while pos < len(data):
+            length, = self.RECORD_HEADER.unpack_from(data, pos)
+            pos += self.RECORD_HEADER.size
+            self.head.append(data[pos:pos + length].decode("utf-8", errors="surrogatepass"))
+            pos += length
+        self.retired.append(segment)
+
+    def checkpointed(self):
+        """
+        Called once a frontier snapshot including this queue is safely written. Deletes the consumed segments and any
+        segment file the queue doesn't know about, e.g. one written after the snapshot restored by a previous run
+        """
+        self.retired = []
+        live = set(self.segments)
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith("segment-") and file_name not in live:
+                os.remove(os.path.join(self.directory, file_name))
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes taken by the urls in memory
+        """
+        return URL_COST * (len(self.head) + len(self.tail))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["retired"] = []
+        return state
+
+    def __len__(self):
+        return self.length
+
+
+class ScoredUrlQueue:
+    """
+    This class is a queue of urls that pops the url with the highest score first, urls with equal scores in FIFO order.
+    A url is scored by score(url) when it is appended, and the whole queue is scored again by rescore, e.g. after the
+    scores were recomputed. Urls put back with appendleft come before all others, the last one put back first.
+
+    It is a binary heap of (-score, sequence, url) entries, and entries maps each queued url to the sequence number of
+    its live heap entry. remove takes a url out of entries only; heap entries that aren't live any more are dropped when
+    they reach the top of the heap or on the next rescore. The score function isn't pickled, so it has to be set again
+    after the queue is restored.
+
+    Attributes:
+        score: the function giving the score of a url, None scores every url 0
+        heap: the heap entries
+        entries: url -> sequence number of its live heap entry
+    """
+
+    def __init__(self, score=None):
+        self.score = score
+        self.heap = []
+        self.entries = dict()
+        self.sequence = 0
+        self.head_sequence = 0
+
+    def _key(self, url):
+        return -self.score(url) if self.score is not None else 0.0
+
+    def append(self, url):
+        heapq.heappush(self.heap, (self._key(url), self.sequence, url))
+        self.entries[url] = self.sequence
+        self.sequence += 1
+
+    def appendleft(self, url):
+        self.head_sequence -= 1
+        heapq.heappush(self.heap, (float("-inf"), self.head_sequence, url))
+        self.entries[url] = self.head_sequence
+
+    def popleft(self):
+        entries = self.entries
+        while True:
+            _, sequence, url = heapq.heappop(self.heap)
+            if entries.get(url) == sequence:
+                del entries[url]
+                return url
+
+    def remove(self, url):
+        """
+        Takes a url out of the queue, e.g. to replay the pop of a url that was the highest scored one at the time
+        """
+        del self.entries[url]
+
+    def rescore(self):
+        """
+        Scores every queued url again. Urls put back with appendleft stay at the head
+        """
+        entries = self.entries
+        self.heap = [(key if key == float("-inf") else self._key(url), sequence, url)
+                     for key, sequence, url in self.heap if entries.get(url) == sequence]
+        heapq.heapify(self.heap)
+
+    def clear(self):
+        self.heap = []
+        self.entries = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["score"] = None
+        return state
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class HostQueue:
+    """
+    This class is a queue of urls with one FIFO queue per host, served in turns, so that a host with a huge number of
+    urls, e.g. a calendar or a wiki, can't starve the other hosts. The hosts with queued urls wait in a ring, and popleft
+    takes up to weight urls in a row from the host at the head of the ring before moving it to the back: round-robin,
+    or weighted round-robin with weights. Choosing the next host is O(1).
+
+    The urls of a host are dropped instead of queued while max_queued of them are queued, or once max_fetched of them
+    were taken, and its queued urls are dropped when it reaches max_fetched. Urls put back with appendleft go to the head
+    of the queue of their host, regardless of the caps.
+
+    Attributes:
+        queues: host -> the queued urls of the host. Only hosts with queued urls have a queue and are in the ring
+        ring: the hosts with queued urls, in the order they are served
+        weights: host -> the number of urls taken from it in a row, 1 for the hosts not listed
+        max_queued: the maximum number of queued urls per host, or None
+        max_fetched: the maximum number of urls taken per host, or None
+        fetched: host -> the number of urls taken
+        dropped: host -> the number of urls dropped by the caps
+    """
+
+    def __init__(self, weights=None, max_queued=None, max_fetched=None):
+        self.queues = dict()
+        self.ring = deque()
+        self.weights = dict(weights or {})
+        self.max_queued = max_queued
+        self.max_fetched = max_fetched
+        self.fetched = defaultdict(int)
+        self.dropped = defaultdict(int)
+        # The number of urls taken in a row from the host at the head of the ring
+        self.served = 0
+        self.length = 0
+
+    @staticmethod
+    def host(url):
+        try:
+            return urlsplit(url).hostname or ""
+        except ValueError:
+            return ""
+
+    def append(self, url):
+        host = self.host(url)
+        queue = self.queues.get(host)
+        if self.max_fetched is not None and self.fetched.get(host, 0) >= self.max_fetched or \
+                queue is not None and self.max_queued is not None and len(queue) >= self.max_queued:
+            self.dropped[host] += 1
+            return
+        if queue is None:
+            queue = self.queues[host] = deque()
+            self.ring.append(host)
+        queue.append(url)
+        self.length += 1
+
+    def appendleft(self, url):
+        host = self.host(url)
+        if self.fetched.get(host):
+            self.fetched[host] -= 1
+        queue = self.queues.get(host)
+        if queue is None:
+            queue = self.queues[host] = deque()
+            self.ring.appendleft(host)
+            self.served = 0
+        queue.appendleft(url)
+        self.length += 1
+
+    def popleft(self):
+        host = self.ring[0]
+        queue = self.queues[host]
+        url = queue.popleft()
+        self.length -= 1
+        self.fetched[host] += 1
+        self.served += 1
+        if self.max_fetched is not None and self.fetched[host] >= self.max_fetched and queue:
+            self.dropped[host] += len(queue)
+            self.length -= len(queue)
+            queue.clear()
+        if not queue:
+            self.ring.popleft()
+            del self.queues[host]
+            self.served = 0
+        elif self.served >= self.weights.get(host, 1):
+            self.ring.rotate(-1)
+            self.served = 0
+        return url
+
+    def clear(self):
+        self.queues = dict()
+        self.ring.clear()
+        self.fetched.clear()
+        self.dropped.clear()
+        self.served = 0
+        self.length = 0
+
+    def depths(self):
+        """
+        Returns host -> number of queued urls of every host with queued urls. Safe to call from another thread
+        """
+        return {host: len(queue) for host, queue in list(self.queues.items())}
+
+    def __len__(self):
+        return self.length
+
+
+class DiskUrlSet:
+    """
+    This class is a set of urls stored on disk as 64 bit fingerprints in an SQLite table, so its memory use is bounded
+    by the SQLite page cache. Additions are committed by checkpointed, together with the frontier snapshot; after a
+    crash the set rolls back to the last snapshot and the frontier log replays the rest.
+
+    Attributes:
+        path: the SQLite database file
+        cache_size: the SQLite page cache size in bytes
+    """
+
+    def __init__(self, path, cache_size):
+        self.path = path
+        self.cache_size = cache_size
+        self.length = 0
+        self._connect()
+
+    def _connect(self):
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute("PRAGMA cache_size = %d" % -max(1, self.cache_size // 1024))
+        self._connection.execute("CREATE TABLE IF NOT EXISTS seen (fingerprint INTEGER PRIMARY KEY)")
+        self._connection.commit()
+
+    @staticmethod
+    def _signed(fingerprint):
+        # SQLite integers are signed
+        return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+    @classmethod
+    def _key(cls, url):
+        return cls._signed(url_fingerprint(url))
+
+    def add(self, url):
+        cursor = self._connection.execute("INSERT OR IGNORE INTO seen VALUES (?)", (self._key(url),))
+        self.length += cursor.rowcount
+
+    def add_fingerprints(self, fingerprints):
+        """
+        Adds the urls of the given fingerprints, e.g. those of a FingerprintSet moved to disk
+        """
+        cursor = self._connection.executemany("INSERT OR IGNORE INTO seen VALUES (?)",
+                                              ((self._signed(fingerprint),) for fingerprint in fingerprints))
+        self.length += cursor.rowcount
+
+    def clear(self):
+        self._connection.execute("DELETE FROM seen")
+        self._connection.commit()
+        self.length = 0
+
+    def checkpointed(self):
+        self._connection.commit()
+
+    def memory_usage(self):
+        """
+        Returns the most memory the SQLite page cache takes
+        """
+        return self.cache_size
+
+    def __contains__(self, url):
+        return self._connection.execute("SELECT 1 FROM seen WHERE fingerprint = ?", (self._key(url),)).fetchone() \
+            is not None
+
+    def __getstate__(self):
+        # Commit before the snapshot refers to the database
+        self._connection.commit()
+        return {"path": self.path, "cache_size": self.cache_size, "length": self.length}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._connect()
+        # The database may be ahead of the snapshot if the crawl died while the snapshot was being written
+        self.length = self._connection.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,139 @@
+"""
+Link and text extraction for fetched pages. extract walks the raw bytes of a page once with a handful of compiled
+regular expressions and never builds a DOM. extract_with_soup is the original BeautifulSoup implementation and is kept
+for comparison. extract_text handles plain text pages, see content_gate.
+"""
+import html
+import re
+from collections import namedtuple
+
+PageContent = namedtuple("PageContent", ["links", "words"])
+
+# A comment, a start/end tag with its attributes, or a declaration / processing instruction
+TAG_PATTERN = re.compile(rb'<(?:!--.*?(?:-->|\Z)|(/?)([A-Za-z][^\s/>]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>|[!?][^>]*>)',
+                         re.S)
+ATTRIBUTE_PATTERN = re.compile(rb'([^\s"\'>/=]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'<>`]+)))?')
+HREF_HINT = re.compile(rb'href', re.I)
+# Absolute urls in plain text, without trailing punctuation
+TEXT_URL_PATTERN = re.compile(r'https?://[^\s<>"\'`]+[^\s<>"\'`.,;:!?)\]}]')
+
+# Elements whose content is not visible text. Everything up to the matching end tag is skipped
+RAW_TEXT_END_PATTERNS = {
+    b"script": re.compile(rb'</script\s*>', re.I),
+    b"style": re.compile(rb'</style\s*>', re.I),
+}
+
+
+def _decode(data):
+    """
+    Decodes page bytes as utf-8, falling back to cp1252 for legacy pages. Returns the text and the codec used
+    """
+    try:
+        return data.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        return data.decode("cp1252", errors="replace"), "cp1252"
+
+
+def extract(content):
+    """
+    Extracts the href values (as written in the page) and the visible text tokens of a page in a single pass over its
+    bytes. Quoted, single-quoted and unquoted href attributes are all recognized and character references in them are
+    decoded. The contents of script and style elements and comments are not counted as text.
+
+    :param content: the page body as bytes (or any bytes-like object)
+    :return: a PageContent tuple of (links, words)
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    text_chunks = []
+    raw_links = []
+    pos = 0
+    end = len(content)
+    while pos < end:
+        match = TAG_PATTERN.search(content, pos)
+        if match is None:
+            text_chunks.append(content[pos:])
+            break
+        if match.start() > pos:
+            text_chunks.append(content[pos:match.start()])
+        pos = match.end()
+
+        name = match.group(2)
+        if name is None or match.group(1):
+            continue  # comment, declaration or end tag
+        attributes = match.group(3)
+        if attributes and HREF_HINT.search(attributes):
+            for attribute in ATTRIBUTE_PATTERN.finditer(attributes):
+                if attribute.group(1).lower() == b"href":
+                    value = attribute.group(2)
+                    if value is None:
+                        value = attribute.group(3) if attribute.group(3) is not None else attribute.group(4)
+                    if value is not None:
+                        raw_links.append(value)
+                    break
+
+        raw_text_end = RAW_TEXT_END_PATTERNS.get(name.lower())
+        if raw_text_end is not None and not attributes.endswith(b"/"):
+            closing = raw_text_end.search(content, pos)
+            pos = closing.end() if closing is not None else end
+
+    text, codec = _decode(b"".join(text_chunks))
+    if "&" in text:
+        text = html.unescape(text)
+
+    links = []
+    for raw_link in raw_links:
+        link = bytes(raw_link).decode(codec, errors="replace")
+        if "&" in link:
+            link = html.unescape(link)
+        links.append(link)
+    return PageContent(links, text.split())
+
+
+def extract_with_soup(content):
+    """
+    The original extraction: builds a BeautifulSoup tree, takes its text and runs an href regex over the re-serialized
+    tree. Only double-quoted hrefs are found and the values keep their serialized (escaped) form.
+
+    :param content: the page body as bytes
+    :return: a PageContent tuple of (links, words)
+    """
+    # Imported here so that BeautifulSoup is only needed when this parser is selected
+    from bs4 import BeautifulSoup
+
+    if isinstance(content, memoryview):
+        content = content.tobytes()
+    parsed_soup = BeautifulSoup(content, 'html.parser')
+    words = parsed_soup.get_text().split()
+    links = re.findall(r'href="([^"]*)"', str(parsed_soup))
+    return PageContent(links, words)
+
+
+def extract_text(content):
+    """
+    Extracts the absolute urls and the words of a plain text page
+
+    :param content: the page body as bytes (or any bytes-like object)
+    :return: a PageContent tuple of (links, words)
+    """
+    text, _ = _decode(bytes(content))
+    return PageContent(TEXT_URL_PATTERN.findall(text), text.split())
+
+
+PARSERS = {
+    "stream": extract,
+    "soup": extract_with_soup,
+}
+
+
+def parse_page(parser, content, handler="html"):
+    """
+    Parses a page with the parser of the given name, or as plain text or not at all as decided by the content gate
+    (see content_gate.HANDLERS). This is a module level function so that it can be sent to a process pool
+    """
+    if handler == "text":
+        return extract_text(content)
+    if handler == "skip":
+        return PageContent([], [])
+    return PARSERS[parser](content)
@@ -0,0 +1,263 @@
+"""
+HTTP backend of the Fetcher interface. Requests run on an asyncio event loop in a background thread over pooled
+keep-alive HTTP/1.1 connections; fetch_url blocks the calling thread until its request is done, so several crawler
+threads can have requests in flight at once.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import ssl
+import threading
+from urllib.parse import urljoin, urlsplit
+
+from fetcher import Fetcher, not_found
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_CODES = frozenset([301, 302, 303, 307, 308])
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class HttpError(Exception):
+    """
+    Raised for a malformed HTTP response
+    """
+
+
+def host_header(parts):
+    """
+    Returns the Host header value of a split url: its host and explicit port, without any user name or password
+    """
+    host = parts.hostname
+    if ":" in host:
+        host = "[%s]" % host
+    return host if parts.port is None else "%s:%d" % (host, parts.port)
+
+
+class HttpFetcher(Fetcher):
+    """
+    This class fetches pages over HTTP. Idle connections are kept in a pool per (scheme, host, port) and reused for the
+    next request to the same host. At most max_host_connections requests are in flight per host at any time. Redirects
+    are followed up to max_redirects times, and the chain of requested urls is returned as url_data["redirects"].
+
+    With a proxy, every request is sent to the proxy in absolute form (GET http://host/path HTTP/1.1), e.g. to crawl a
+    corpus served by corpus_server.py.
+
+    Attributes:
+        max_host_connections: the maximum number of concurrent requests, and pooled connections, per host
+        timeout: the number of seconds a request, including connecting, may take
+        max_redirects: the maximum number of redirects followed per url
+        proxy: (host, port) of the HTTP proxy, or None
+        max_content_size: responses with a larger body are cut off
+    """
+
+    def __init__(self, max_host_connections=2, timeout=10, max_redirects=5, proxy=None, user_agent="IR-Crawler",
+                 max_content_size=10 << 20):
+        self.max_host_connections = max_host_connections
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.proxy = proxy
+        self.user_agent = user_agent
+        self.max_content_size = max_content_size
+        # Only used from the event loop thread
+        self.pools = {}
+        self.host_limits = {}
+        self._ssl_context = None
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="http-fetcher", daemon=True)
+        self._thread.start()
+
+    def get_file_name(self, url):
+        # Any url may exist on the web
+        return url
+
+    def fetch_url(self, url, include_content=True):
+        """
+        Fetches a url, following redirects. A url that can't be fetched, e.g. because of a timeout, gets a 404 response
+        """
+        return asyncio.run_coroutine_threadsafe(self.fetch(url, include_content), self.loop).result()
+
+    def fetch_many(self, urls, headers_only=()):
+        """
+        Fetches a batch of urls concurrently, within the per host connection limit, and yields their responses as they
+        complete
+        """
+        futures = [asyncio.run_coroutine_threadsafe(self.fetch(url, url not in headers_only), self.loop) for url in urls]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def fetch(self, url, include_content=True):
+        """
+        Coroutine version of fetch_url, to be run on self.loop
+        """
+        redirects = [url]
+        current_url = url
+        while True:
+            try:
+                status, headers, body = await asyncio.wait_for(self._request(current_url), self.timeout)
+            except (OSError, EOFError, ValueError, HttpError, asyncio.TimeoutError) as e:
+                logger.warning("Could not fetch %s: %r", current_url, e)
+                return not_found(url)
+            location = headers.get("location")
+            if status not in REDIRECT_CODES or location is None:
+                break
+            if len(redirects) > self.max_redirects:
+                logger.warning("Too many redirects fetching %s", url)
+                return not_found(url)
+            current_url = urljoin(current_url, location)
+            redirects.append(current_url)
+
+        return {
+            "url": url,
+            "content": body if include_content else None,
+            "http_code": status,
+            "headers": headers,
+            "size": len(body),
+            "content_type": headers.get("content-type"),
+            "is_redirected": len(redirects) > 1,
+            "final_url": current_url if len(redirects) > 1 else None,
+            "redirects": redirects,
+        }
+
+    async def _request(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+            raise ValueError("Unsupported url %s" % url)
+        host = parts.hostname
+        port = parts.port or DEFAULT_PORTS[parts.scheme]
+        if self.proxy is not None:
+            connection_key = ("http", ) + tuple(self.proxy)
+            target = url.split("#", 1)[0]
+        else:
+            connection_key = (parts.scheme, host, port)
+            target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        request = ("GET %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nAccept-Encoding: identity\r\n"
+                   "Connection: keep-alive\r\n\r\n" % (target, host_header(parts), self.user_agent)).encode("utf-8")
+
+        limit = self.host_limits.get(host)
+        if limit is None:
+            limit = self.host_limits[host] = asyncio.Semaphore(self.max_host_connections)
+        async with limit:
+            pool = self.pools.setdefault(connection_key, [])
+            while True:
+                reused = bool(pool)
+                reader, writer = pool.pop() if reused else await self._connect(*connection_key)
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, headers, body, keep_alive = await self._read_response(reader)
+                except (OSError, EOFError) as e:
+                    writer.close()
+                    if reused:
+                        # The server closed the idle connection, try again
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+            if keep_alive and len(pool) < self.max_host_connections:
+                pool.append((reader, writer))
+            else:
+                writer.close()
+        return status, headers, body
+
+    async def _connect(self, scheme, host, port):
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return await asyncio.open_connection(host, port, ssl=self._ssl_context)
+        return await asyncio.open_connection(host, port)
+
+    async def _read_response(self, reader):
+        """
+        Reads a response. Returns (status, headers, body, whether the connection can be reused). Header names are
+        lowercase. A body larger than max_content_size is cut off without reading the rest, and the connection closed
+        """
+        status_line = await reader.readline()
+        if not status_line:
+            raise EOFError("Connection closed")
+        try:
+            version, status = status_line.decode("latin-1").split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise HttpError("Bad status line %r" % status_line)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body, complete = await self._read_chunked(reader)
+            keep_alive = keep_alive and complete
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            body = await reader.readexactly(min(length, self.max_content_size))
+            keep_alive = keep_alive and length <= self.max_content_size
+        else:
+            body = await self._read_to_end(reader)
+            keep_alive = False
+        return status, headers, body, keep_alive
+
+    async def _read_chunked(self, reader):
+        """
+        Reads a chunked body, up to max_content_size bytes. Returns (body, whether all of it was read)
+        """
+        chunks = []
+        size = 0
+        while True:
+            line = await reader.readline()
+            try:
+                length = int(line.split(b";", 1)[0], 16)
+            except ValueError:
+                raise HttpError("Bad chunk size %r" % line)
+            if length == 0:
+                # Trailers end with an empty line
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks), True
+            if size + length > self.max_content_size:
+                chunks.append(await reader.readexactly(self.max_content_size - size))
+                return b"".join(chunks), False
+            chunks.append(await reader.readexactly(length))
+            await reader.readexactly(2)
+            size += length
+
+    async def _read_to_end(self, reader):
+        """
+        Reads a body delimited by the end of the connection, up to max_content_size bytes
+        """
+        chunks = []
+        size = 0
+        while size < self.max_content_size:
+            chunk = await reader.read(self.max_content_size - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        """
+        Closes the pooled connections and stops the event loop
+        """
+        async def close_pools():
+            for pool in self.pools.values():
+                for reader, writer in pool:
+                    writer.close()
+            self.pools.clear()
+
+        asyncio.run_coroutine_threadsafe(close_pools(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -0,0 +1,249 @@
+"""
+The link graph of the crawl. Every crawled page and the links found on it are recorded in compact arrays, so that the
+graph of millions of pages fits in memory, and PageRank is computed over it, for the analysis and for the pagerank order
+of the frontier (see Frontier).
+"""
+import heapq
+import logging
+import operator
+import os
+import time
+from array import array
+
+from fingerprint import url_fingerprint
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class EdgeChunk:
+    """
+    This class is an append-only chunk of the edges of a LinkGraph in CSR form: the targets of the row of sources[i] are
+    targets[row_ends[i - 1]:row_ends[i]], by node id
+    """
+
+    def __init__(self):
+        self.sources = array("I")
+        self.row_ends = array("I")
+        self.targets = array("I")
+
+    def add_row(self, source, targets):
+        self.targets.extend(targets)
+        self.sources.append(source)
+        self.row_ends.append(len(self.targets))
+
+    def rows(self):
+        """
+        Yields (source, start, end) of every row
+        """
+        start = 0
+        for source, end in zip(self.sources, self.row_ends):
+            yield source, start, end
+            start = end
+
+    def memory_usage(self):
+        return sum(values.itemsize * len(values) for values in (self.sources, self.row_ends, self.targets))
+
+
+class LinkGraph:
+    """
+    This class records the crawl graph: a node for every crawled or linked url and an edge from every crawled page to each
+    distinct url it links to. Nodes get integer ids in the order they are first seen, and are found by the 64 bit
+    fingerprint of their url in an open addressing table of ids. The edges are stored in CSR form in append-only chunks:
+    the row of each crawled page is appended to the last chunk, and a new chunk is started once it holds CHUNK_EDGES
+    edges, so adding a page never moves the edges stored before. An edge takes 4 bytes and a node about 40: its
+    fingerprint, table slot, rank and the offset of its url in urls_file, where the urls are appended as in
+    NearDuplicateIndex.
+
+    PageRank is computed by power iteration, starting from the previous ranks, whenever the number of edges has grown by
+    rank_growth since the last computation, so that the total work stays proportional to the final number of edges. In
+    between, a crawled page pushes its share of rank to its links as they are added, a rough estimate until the next
+    computation. Each page has to be added once.
+
+    Attributes:
+        urls_file_name: the file the urls of the nodes are appended to
+        damping: the PageRank damping factor
+        rank_growth: the relative growth of the number of edges after which PageRank is computed again
+        tolerance: the L1 change of the ranks below which the power iteration stops
+        max_iterations: the maximum number of power iterations per computation
+        fingerprints: the url fingerprints of the nodes, by node id
+        ranks: the PageRank of the nodes, by node id
+        chunks: the EdgeChunks holding the edges
+        edges: the number of edges
+        ranked_edges: the number of edges at the last PageRank computation
+    """
+
+    CHUNK_EDGES = 1 << 20
+    MAX_LOAD = 0.75
+    # Below this many new edges PageRank isn't computed again
+    MIN_RANK_EDGES = 1000
+
+    def __init__(self, urls_file_name, damping=0.85, rank_growth=0.1, tolerance=1e-5, max_iterations=50):
+        self.urls_file_name = urls_file_name
+        self.damping = damping
+        self.rank_growth = rank_growth
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.fingerprints = array("Q")
+        self.url_offsets = array("Q")
+        self.ranks = array("d")
+        # Node id + 1 by slot, 0 marks an empty slot
+        self.slots = array("I", bytes(4 * 1024))
+        self.mask = len(self.slots) - 1
+        self.chunks = [EdgeChunk()]
+        self.edges = 0
+        self.ranked_edges = 0
+        self._urls_file = open(self.urls_file_name, "wb")
+
+    def _slot(self, fingerprint):
+        slots = self.slots
+        fingerprints = self.fingerprints
+        mask = self.mask
+        slot = fingerprint & mask
+        while True:
+            node = slots[slot]
+            if node == 0 or fingerprints[node - 1] == fingerprint:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        self.slots = array("I", bytes(8 * len(self.slots)))
+        self.mask = len(self.slots) - 1
+        for node_id, fingerprint in enumerate(self.fingerprints):
+            self.slots[self._slot(fingerprint)] = node_id + 1
+
+    def node_id(self, url, add=False):
+        """
+        Returns the id of the node of a url. A url without a node gets a new one if add is set, otherwise None is
+        returned
+        """
+        fingerprint = url_fingerprint(url)
+        slot = self._slot(fingerprint)
+        node = self.slots[slot]
+        if node:
+            return node - 1
+        if not add:
+            return None
+        node_id = len(self.fingerprints)
+        self.fingerprints.append(fingerprint)
+        self.slots[slot] = node_id + 1
+        self.url_offsets.append(self._urls_file.tell())
+        self._urls_file.write(url.encode("utf-8", errors="surrogatepass") + b"\n")
+        # The teleport share of a new node, until it is ranked
+        self.ranks.append((1 - self.damping) / (node_id + 1))
+        if len(self.fingerprints) > self.MAX_LOAD * len(self.slots):
+            self._grow()
+        return node_id
+
+    def add_page(self, url, links):
+        """
+        Adds a crawled page and the edges to the distinct urls it links to, other than itself
+        """
+        source = self.node_id(url, add=True)
+        targets = dict.fromkeys(self.node_id(link, add=True) for link in links)
+        targets.pop(source, None)
+        chunk = self.chunks[-1]
+        if len(chunk.targets) >= self.CHUNK_EDGES:
+            chunk = EdgeChunk()
+            self.chunks.append(chunk)
+        chunk.add_row(source, targets)
+        self.edges += len(targets)
+        if targets:
+            ranks = self.ranks
+            share = self.damping * ranks[source] / len(targets)
+            for target in targets:
+                ranks[target] += share
+
+    def update_ranks(self, force=False):
+        """
+        Computes PageRank if the graph has grown by rank_growth since the last computation, or has changed at all with
+        force. Returns True if it was computed
+        """
+        new_edges = self.edges - self.ranked_edges
+        if new_edges == 0 or not force and new_edges < max(self.MIN_RANK_EDGES, self.rank_growth * self.ranked_edges):
+            return False
+        start = METRICS.start()
+        started = time.perf_counter()
+        total = sum(self.ranks)
+        ranks = array("d", [rank / total for rank in self.ranks])
+        for iteration in range(1, self.max_iterations + 1):
+            ranks, change = self._iterate(ranks)
+            if change < self.tolerance:
+                break
+        self.ranks = ranks
+        self.ranked_edges = self.edges
+        METRICS.stop("pagerank", start)
+        logger.info("Computed the PageRank of %s urls and %s links in %s iterations (%.2fs)", len(ranks), self.edges,
+                    iteration, time.perf_counter() - started)
+        return True
+
+    def _iterate(self, ranks):
+        """
+        Runs one power iteration. Returns the new ranks and their L1 change
+        """
+        nodes = len(ranks)
+        damping = self.damping
+        new_ranks = array("d", bytes(8 * nodes))
+        # The rank of pages without links, e.g. the urls not crawled yet, is spread over all of the pages
+        linked_rank = 0.0
+        for chunk in self.chunks:
+            targets = chunk.targets
+            for source, start, end in chunk.rows():
+                if end == start:
+                    continue
+                rank = ranks[source]
+                linked_rank += rank
+                share = damping * rank / (end - start)
+                for target in targets[start:end]:
+                    new_ranks[target] += share
+        base = (1 - damping * linked_rank) / nodes
+        new_ranks = array("d", [rank + base for rank in new_ranks])
+        return new_ranks, sum(map(abs, map(operator.sub, new_ranks, ranks)))
+
+    def score(self, url):
+        """
+        Returns the current rank of a url, 0 for a url not in the graph
+        """
+        node_id = self.node_id(url)
+        return self.ranks[node_id] if node_id is not None else 0.0
+
+    def get_url(self, node_id):
+        self._urls_file.flush()
+        with open(self.urls_file_name, "rb") as urls_file:
+            urls_file.seek(self.url_offsets[node_id])
+            return urls_file.readline().rstrip(b"\n").decode("utf-8", errors="surrogatepass")
+
+    def top_pages(self, count):
+        """
+        Returns (url, rank) of the count urls with the highest rank, highest first
+        """
+        ranks = self.ranks
+        return [(self.get_url(node_id), ranks[node_id])
+                for node_id in heapq.nlargest(count, range(len(ranks)), key=ranks.__getitem__)]
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes taken by the arrays
+        """
+        arrays = [self.fingerprints, self.url_offsets, self.ranks, self.slots]
+        return sum(values.itemsize * len(values) for values in arrays) + \
+            sum(chunk.memory_usage() for chunk in self.chunks)
+
+    def __getstate__(self):
+        self._urls_file.flush()
+        state = self.__dict__.copy()
+        del state["_urls_file"]
+        state["urls_file_size"] = self._urls_file.tell()
+        return state
+
+    def __setstate__(self, state):
+        urls_file_size = state.pop("urls_file_size")
+        self.__dict__.update(state)
+        # The urls file may be ahead of the snapshot if the crawl died after it was written
+        if os.path.isfile(self.urls_file_name) and os.path.getsize(self.urls_file_name) > urls_file_size:
+            with open(self.urls_file_name, "r+b") as urls_file:
+                urls_file.truncate(urls_file_size)
+        self._urls_file = open(self.urls_file_name, "ab")
+
+    def __len__(self):
+        return len(self.fingerprints)
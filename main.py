@@ -1,27 +1,268 @@
+import argparse
 import atexit
 import logging
+import os
 
-import sys
+import distributed
 
+from content_gate import ContentGate
 from corpus import Corpus
+from corpus_segments import SegmentedCorpus
 from crawler import Crawler
+from extraction_cache import ExtractionCache
 from frontier import Frontier
+from http_fetcher import HttpFetcher
+from memory_governor import MemoryGovernor, rss
+from metrics import METRICS
+from pipeline import CrawlPipeline
+from profiler import CrawlProfiler
+from url_canonicalizer import DEFAULT_REMOVED_PARAMS, UrlCanonicalizer
+
+
+def host_weight(value):
+    """
+    Parses a HOST=WEIGHT --host-weights entry into a (host, weight) tuple
+    """
+    host, _, weight = value.rpartition("=")
+    try:
+        weight = int(weight)
+    except ValueError:
+        weight = 0
+    if not host or weight < 1:
+        raise argparse.ArgumentTypeError("%r is not HOST=WEIGHT with a positive integer WEIGHT" % value)
+    return host, weight
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="Crawls the local corpus starting from the frontier seed url")
+    parser.add_argument("corpus_dir", nargs="?", default=None,
+                        help="directory containing the corpus files. Not needed with --fetcher http")
+    parser.add_argument("--fetcher", choices=["corpus", "http"], default="corpus",
+                        help="where pages are fetched from: the local corpus or the web")
+    parser.add_argument("--http-proxy", default=None,
+                        help="HOST:PORT of an HTTP proxy for the http fetcher, e.g. a corpus_server.py")
+    parser.add_argument("--http-timeout", type=float, default=10, help="timeout of an http request in seconds")
+    parser.add_argument("--host-connections", type=int, default=2,
+                        help="maximum number of concurrent http connections per host")
+    parser.add_argument("--segments", action="store_true",
+                        help="corpus_dir holds a packed corpus created by corpus_segments.py")
+    parser.add_argument("--corpus-index", default=None,
+                        help="persisted corpus index file. Created on the first run, loaded on the next ones")
+    parser.add_argument("--parser", choices=["stream", "soup"], default="stream",
+                        help="page parser: single pass streaming extractor or the original BeautifulSoup extraction")
+    parser.add_argument("--max-parse-size", type=int, default=ContentGate.DEFAULT_MAX_PARSE_SIZE >> 20,
+                        help="maximum size of a page parsed in MB, larger pages are parsed up to it. 0 for no limit")
+    parser.add_argument("--frontier-memory", type=int, default=None,
+                        help="memory budget of the frontier in MB. The rest of the queue and the seen urls are kept on "
+                             "disk. Unlimited by default")
+    parser.add_argument("--seen-bloom-fpr", type=float, default=None,
+                        help="put a Bloom filter with this false positive rate in front of the seen url tables")
+    parser.add_argument("--frontier-order", choices=Frontier.ORDERS, default="fifo",
+                        help="order urls are crawled in: breadth-first; highest PageRank in the crawl graph so far "
+                             "first, so that the most valuable pages are reached early in a time-boxed crawl; or "
+                             "breadth-first per host with the hosts served in turns, so that no host starves the others")
+    parser.add_argument("--host-weights", nargs="*", type=host_weight, default=[], metavar="HOST=WEIGHT",
+                        help="number of urls taken in a row from a host in its turn with --frontier-order host. 1 for "
+                             "the hosts not listed")
+    parser.add_argument("--host-max-queued", type=int, default=None,
+                        help="with --frontier-order host, drop the new urls of a host that has this many urls queued")
+    parser.add_argument("--host-max-fetched", type=int, default=None,
+                        help="with --frontier-order host, stop crawling a host after this many of its urls")
+    parser.add_argument("--link-graph", action="store_true",
+                        help="record the crawl graph and report the pages with the highest PageRank in the analysis. "
+                             "Implied by --frontier-order pagerank")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="overlap fetching and parsing using pools of fetch threads and parse processes")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="number of fetch threads in pipeline mode")
+    parser.add_argument("--parse-workers", type=int, default=None,
+                        help="number of parse processes in pipeline mode. Defaults to the number of CPUs")
+    parser.add_argument("--queue-size", type=int, default=32,
+                        help="capacity of the queues between the pipeline stages")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="take this many urls from the frontier at once and fetch them as a batch, with the corpus "
+                             "files read ahead in their order on disk")
+    parser.add_argument("--read-ahead", type=int, default=Corpus.DEFAULT_READ_AHEAD,
+                        help="number of corpus files read at once when fetching a batch")
+    parser.add_argument("--max-words", type=int, default=1 << 16,
+                        help="number of distinct words kept for the most common words analysis. Less frequent words "
+                             "are dropped and the counts become approximate, with the error bound reported")
+    parser.add_argument("--exact-word-counts", action="store_true",
+                        help="count every distinct word exactly, in unbounded memory")
+    parser.add_argument("--near-duplicates", choices=["report", "skip"], default=None,
+                        help="detect near-duplicate pages and report their clusters in the analysis. skip also skips "
+                             "the link extraction and word counting of near-duplicates")
+    parser.add_argument("--extraction-cache", default=None,
+                        help="file caching the links and words extracted from each page, so that re-crawls of an "
+                             "unchanged corpus skip parsing")
+    parser.add_argument("--extraction-cache-size", type=int, default=1024,
+                        help="maximum size of the extraction cache in MB")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="crawl in this many host-sharded worker processes, see distributed.py")
+    parser.add_argument("--local-workers", type=int, default=None,
+                        help="number of the shard workers to run on this machine. Defaults to all of them")
+    parser.add_argument("--coordinator-address", default="localhost:0",
+                        help="host:port or Unix socket path the coordinator of a sharded crawl listens on")
+    parser.add_argument("--shard-dir", default="shard-%d",
+                        help="working directory of each shard worker, relative to where the worker runs")
+    parser.add_argument("--authkey", default=distributed.DEFAULT_AUTHKEY.decode(),
+                        help="shared secret of the coordinator and the workers of a sharded crawl")
+    parser.add_argument("--metrics", action="store_true",
+                        help="collect per-stage latencies and crawl counters, and log a summary periodically")
+    parser.add_argument("--metrics-interval", type=float, default=60, help="seconds between metrics summaries")
+    parser.add_argument("--metrics-file", default=None,
+                        help="also write the metrics to this file in Prometheus text format, e.g. for the node "
+                             "exporter textfile collector. Implies --metrics")
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="memory budget of the crawl in MB. Near it, structures are compacted, moved to disk or "
+                             "trimmed, and the frontier is saved early. Unlimited by default")
+    parser.add_argument("--memory-check-interval", type=int, default=1000,
+                        help="number of pages between memory checks with --memory-budget")
+    parser.add_argument("--removed-params", nargs="*", default=list(DEFAULT_REMOVED_PARAMS), metavar="PATTERN",
+                        help="regular expressions of the names of the query parameters removed from urls, e.g. "
+                             "tracking and session ids. Defaults to common ones; none with an empty list")
+    parser.add_argument("--keep-query-order", action="store_true",
+                        help="don't sort query parameters when canonicalizing urls")
+    parser.add_argument("--analysis-only", action="store_true",
+                        help="write analysis.txt from the saved state of a stopped or killed crawl, without crawling. "
+                             "With corpus_dir, the pages crawled since the last frontier snapshot are read from it "
+                             "again")
+    parser.add_argument("--profile", choices=["deterministic", "sampling"], default=None,
+                        help="profile the crawl with cProfile or a sampling profiler, see profiler.py")
+    parser.add_argument("--profile-start", type=int, default=0, help="number of pages crawled before profiling starts")
+    parser.add_argument("--profile-stop", type=int, default=None,
+                        help="number of pages crawled when profiling stops. Defaults to the end of the crawl")
+    parser.add_argument("--profile-output", default="profile",
+                        help="prefix of the profile files: PREFIX.txt and PREFIX.collapsed or PREFIX.prof")
+    parser.add_argument("--profile-top", type=int, default=30, help="number of functions in the profile summary")
+    parser.add_argument("--profile-interval", type=float, default=0.005,
+                        help="seconds between samples of the sampling profiler")
+    return parser
+
+
+def enable_metrics(args, frontier):
+    """
+    Enables the metrics if selected by the command line arguments, with the frontier queue depth as a gauge
+    """
+    if not (args.metrics or args.metrics_file):
+        return
+    METRICS.gauge("queue_depth", frontier.__len__)
+    if frontier.order == "host":
+        METRICS.gauge("host_queue_depth", frontier.host_queue_depths, label="host")
+    METRICS.enable(args.metrics_interval, args.metrics_file)
+    atexit.register(METRICS.close)
+
+
+def create_memory_governor(args, frontier, corpus, crawler):
+    """
+    Instantiates the memory governor selected by the command line arguments, with the structures of the frontier, the
+    corpus and the crawler registered, or returns None
+    """
+    if args.memory_budget is None:
+        return None
+    budget = args.memory_budget << 20
+    governor = MemoryGovernor(budget, check_interval=args.memory_check_interval, checkpoint=frontier.save_frontier)
+    # The in-memory frontier moves to disk with a quarter of the budget, as with --frontier-memory
+    governor.register("frontier", frontier.memory_usage, "spill", lambda: frontier.spill(budget // 4),
+                      lambda: frontier.spilled_usage(budget // 4))
+    if isinstance(corpus, Corpus):
+        index_file = os.path.join(Frontier.FRONTIER_DIR_NAME, "corpus_index.bin")
+        governor.register("corpus_index", lambda: corpus.index.memory_usage(), "spill",
+                          lambda: corpus.spill_index(index_file))
+    crawler.register_memory(governor)
+    crawler.page_callbacks.append(governor.page_done)
+    METRICS.gauge("rss_bytes", rss)
+    # As of the last check, as the structures can't be measured from the metrics thread
+    METRICS.gauge("memory_bytes", lambda: dict(governor.last_usage), label="structure")
+    atexit.register(governor.report)
+    return governor
+
+
+def create_corpus(args):
+    """
+    Instantiates the fetcher of pages selected by the command line arguments
+    """
+    if args.fetcher == "http":
+        proxy = None
+        if args.http_proxy is not None:
+            proxy_host, _, proxy_port = args.http_proxy.rpartition(":")
+            proxy = (proxy_host, int(proxy_port))
+        return HttpFetcher(args.host_connections, args.http_timeout, proxy=proxy)
+    if args.segments:
+        return SegmentedCorpus(args.corpus_dir, args.read_ahead)
+    return Corpus(args.corpus_dir, args.corpus_index, args.read_ahead)
+
+
+def frontier_options(args):
+    """
+    Returns the keyword arguments of Frontier selected by the command line arguments
+    """
+    return {"memory_budget": args.frontier_memory << 20 if args.frontier_memory else None,
+            "seen_bloom_fpr": args.seen_bloom_fpr, "order": args.frontier_order,
+            "host_weights": dict(args.host_weights),
+            "host_max_queued": args.host_max_queued, "host_max_fetched": args.host_max_fetched}
+
+
+def create_crawler(args, frontier, corpus):
+    """
+    Instantiates a crawler and its extraction cache, if any, as selected by the command line arguments
+    """
+    extraction_cache = None
+    if args.extraction_cache is not None:
+        # The extracted words depend on the parser and on how much of a page is parsed
+        extraction_cache = ExtractionCache(args.extraction_cache, args.extraction_cache_size << 20,
+                                           "%s/%s/%s" % (args.parser, Crawler.EXTRACTION_VERSION, args.max_parse_size))
+    canonicalizer = UrlCanonicalizer(args.removed_params, not args.keep_query_order)
+    content_gate = ContentGate(args.max_parse_size << 20 if args.max_parse_size else None)
+    return Crawler(frontier, corpus, args.parser, args.seen_bloom_fpr,
+                   None if args.exact_word_counts else args.max_words, args.near_duplicates, extraction_cache,
+                   canonicalizer, args.link_graph, content_gate)
+
 
 if __name__ == "__main__":
+    parser = create_argument_parser()
+    args = parser.parse_args()
+    if args.fetcher == "corpus" and args.corpus_dir is None and not args.analysis_only:
+        parser.error("corpus_dir is required with --fetcher corpus")
+
     # Configures basic logging
     logging.basicConfig(format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
                         level=logging.INFO)
 
+    if args.shards:
+        distributed.run_distributed(args)
+        raise SystemExit
+
     # Instantiates frontier and loads the last state if exists
-    frontier = Frontier()
+    frontier = Frontier(**frontier_options(args))
     frontier.load_frontier()
 
+    if args.analysis_only:
+        # The crawler state is restored with the frontier. No page is crawled, but the pages crawled since the last
+        # snapshot are read again from the corpus, if given, see Crawler.replay_page
+        corpus = create_corpus(args) if args.fetcher == "corpus" and args.corpus_dir is not None else None
+        create_crawler(args, frontier, corpus).output_analysis()
+        raise SystemExit
+
     # Instantiates corpus object with the given cmd arg
-    corpus = Corpus(sys.argv[1])
+    corpus = create_corpus(args)
+    atexit.register(corpus.close)
 
     # Registers a shutdown hook to save frontier state upon unexpected shutdown
     atexit.register(frontier.save_frontier)
+    enable_metrics(args, frontier)
 
     # Instantiates a crawler object and starts crawling
-    crawler = Crawler(frontier, corpus)
-    crawler.start_crawling()
+    crawler = create_crawler(args, frontier, corpus)
+    if crawler.extraction_cache is not None:
+        atexit.register(crawler.extraction_cache.close)
+    create_memory_governor(args, frontier, corpus, crawler)
+    if args.profile is not None:
+        profiler = CrawlProfiler(args.profile, args.profile_start, args.profile_stop, args.profile_output,
+                                 args.profile_top, args.profile_interval)
+        crawler.page_callbacks.append(profiler.page_done)
+        # Also writes the profile of an interrupted crawl
+        atexit.register(profiler.stop)
+    if args.pipeline:
+        CrawlPipeline(crawler, args.fetch_workers, args.parse_workers, args.queue_size).run()
+    else:
+        crawler.start_crawling(args.batch_size)
@@ -0,0 +1,185 @@
+"""
+Memory governor of long crawls. The structures of the crawler grow with the crawl and, left alone, a long crawl runs
+until it is OOM-killed, losing everything since its last frontier snapshot. MemoryGovernor samples the resident set
+size of the process every check_interval pages, attributes approximate usage to the structures registered with it and,
+once the RSS nears the budget, makes them give memory back and saves a frontier snapshot early.
+
+A structure is registered with a function returning its approximate usage in bytes and, optionally, one of ACTIONS,
+a function taking that action once, returning True if it did anything, and a function returning the approximate usage
+the action would leave, for actions that can take more memory than they free:
+
+    compact: keep the same contents in less memory
+    spill: move the contents to disk, where they are read back from when needed
+    evict: drop the least valuable entries, making the results that depend on them approximate
+"""
+import logging
+import os
+import resource
+import sys
+
+from frontier_storage import URL_COST
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# In the order they are tried: the ones that lose nothing first
+ACTIONS = ("compact", "spill", "evict")
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+MB = 1 << 20
+
+
+def rss():
+    """
+    Returns the resident set size of the process in bytes
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # Without /proc only the peak is known, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def approximate_usage(structure, item_cost=URL_COST):
+    """
+    Returns the approximate number of bytes a structure takes: its memory_usage() if it has one, otherwise item_cost per
+    item, e.g. for sets and dictionaries of urls
+    """
+    if hasattr(structure, "memory_usage"):
+        return structure.memory_usage()
+    return item_cost * len(structure)
+
+
+class MemoryGovernor:
+    """
+    This class keeps the memory of a crawl under a budget. check samples the RSS; once it reaches high_water of the
+    budget, the registered structures take their actions, the cheapest kind of action first and the largest structures
+    first, until their attributed usage has dropped by the excess over low_water of the budget. Then checkpoint is
+    called, e.g. Frontier.save_frontier, so that an OOM kill loses little.
+
+    Memory freed by the structures is mostly kept by the allocator for reuse rather than returned to the system, so the
+    RSS doesn't go down after relieving pressure. Pressure is relieved again only once the RSS has grown by another
+    high_water - low_water of the budget, i.e. once the freed memory is used up.
+
+    Attributes:
+        budget: the number of bytes the process may use
+        high_water: the fraction of the budget at which pressure is relieved
+        low_water: the fraction of the budget relieving pressure aims for
+        check_interval: the number of pages between RSS samples
+        checkpoint: the function called after relieving pressure, or None
+        structures: name -> (usage function, action, relieve function, projected usage function) of the registered
+        structures
+        last_usage: name -> approximate bytes of the registered structures, as of the last check
+        peak_rss: the largest RSS sampled
+        pressure_events: the number of times pressure was relieved
+    """
+
+    def __init__(self, budget, high_water=0.9, low_water=0.75, check_interval=1000, checkpoint=None):
+        self.budget = budget
+        self.high_water = high_water
+        self.low_water = low_water
+        self.check_interval = check_interval
+        self.checkpoint = checkpoint
+        self.structures = dict()
+        self.last_usage = dict()
+        self.peak_rss = 0
+        self.pressure_events = 0
+        self.pages = 0
+        self._relieved_rss = 0
+
+    def register(self, name, usage, action=None, relieve=None, projected_usage=None):
+        """
+        Registers a structure
+        :param usage: returns the approximate number of bytes the structure takes
+        :param action: the kind of action relieve takes, one of ACTIONS, or None if the structure is only accounted for
+        :param relieve: takes the action once. Returns True if it freed anything
+        :param projected_usage: returns the approximate number of bytes the structure would take after the action. The
+            action is skipped unless that is less than it takes now. None if the action never takes more memory
+        """
+        if action is not None and action not in ACTIONS:
+            raise ValueError("Unknown memory action %s" % action)
+        self.structures[name] = (usage, action, relieve, projected_usage)
+
+    def usage(self):
+        """
+        Returns name -> approximate bytes of the registered structures
+        """
+        return {name: usage() for name, (usage, _, _, _) in self.structures.items()}
+
+    def page_done(self, url_data=None):
+        """
+        Checks the memory every check_interval pages, see Crawler.page_callbacks
+        """
+        self.pages += 1
+        if self.pages % self.check_interval == 0:
+            self.check()
+
+    def check(self):
+        """
+        Samples the RSS and relieves memory pressure if needed. Returns True if it did
+        """
+        current = rss()
+        self.peak_rss = max(self.peak_rss, current)
+        self.last_usage = self.usage()
+        step = (self.high_water - self.low_water) * self.budget
+        if current < self.high_water * self.budget or current < self._relieved_rss + step:
+            return False
+
+        self.pressure_events += 1
+        METRICS.count("memory_pressure")
+        logger.warning("Memory pressure: RSS %.0f MB of a %.0f MB budget. Largest structures: %s", current / MB,
+                       self.budget / MB, self.describe(3))
+        self.relieve(current - self.low_water * self.budget)
+        if self.checkpoint is not None:
+            self.checkpoint()
+        self._relieved_rss = rss()
+        return True
+
+    def relieve(self, excess):
+        """
+        Has the registered structures take their actions until their usage has dropped by excess bytes. Returns the
+        number of bytes freed
+        """
+        usage = self.last_usage
+        freed = 0
+        for action in ACTIONS:
+            names = [name for name, (_, structure_action, _, _) in self.structures.items()
+                     if structure_action == action]
+            for name in sorted(names, key=lambda name: -usage.get(name, 0)):
+                if freed >= excess:
+                    return freed
+                usage_function, _, relieve, projected_usage = self.structures[name]
+                before = usage.get(name, 0)
+                if projected_usage is not None:
+                    projected = projected_usage()
+                    if projected >= before:
+                        logger.info("Memory: skipped %s %s, %.1f MB -> %.1f MB", action, name, before / MB,
+                                    projected / MB)
+                        continue
+                if not relieve():
+                    continue
+                usage[name] = usage_function()
+                freed += max(0, before - usage[name])
+                logger.info("Memory: %s %s, %.1f MB -> %.1f MB", action, name, before / MB, usage[name] / MB)
+        if freed < excess:
+            logger.warning("Memory: freed %.1f MB of the %.1f MB over the low water mark, nothing else to free",
+                           freed / MB, excess / MB)
+        return freed
+
+    def describe(self, count=None):
+        """
+        Returns the largest structures as of the last check as a "name size" list
+        """
+        largest = sorted(self.last_usage.items(), key=lambda item: -item[1])[:count]
+        return ", ".join("%s %.1f MB" % (name, size / MB) for name, size in largest)
+
+    def report(self):
+        """
+        Logs the peak RSS and the usage of the structures, e.g. at the end of the crawl
+        """
+        self.peak_rss = max(self.peak_rss, rss())
+        self.last_usage = self.usage()
+        logger.info("Memory: peak RSS %.0f MB of a %.0f MB budget, %s pressure events. Structures: %s",
+                    self.peak_rss / MB, self.budget / MB, self.pressure_events, self.describe())
@@ -0,0 +1,216 @@
+"""
+Crawler metrics: counters, gauges and latency histograms per stage. The module level METRICS is disabled by default,
+and then start() returns 0 and count() and stop() return right away, so instrumented code costs next to nothing. Once
+enabled, a background thread logs a summary line and optionally writes a Prometheus text format file at a fixed
+interval.
+
+Instrumenting a stage:
+
+    start = METRICS.start()
+    ...
+    METRICS.stop("parse", start)
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket i counts latencies below 2 ** i microseconds
+BUCKETS = 32
+
+
+class Histogram:
+    """
+    This class is a latency histogram with power of two microsecond buckets
+
+    Attributes:
+        buckets: the number of observations per bucket
+        count: the number of observations
+        total: the sum of the observations in seconds
+    """
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.buckets[min(BUCKETS - 1, int(seconds * 1e6).bit_length())] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q quantile, in seconds
+        """
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return (1 << bucket) / 1e6
+        return 0.0
+
+
+class Metrics:
+    """
+    This class collects the crawler metrics. Counters are identified by a name and an optional reason label, e.g.
+    ("rejected", "calendar"); histograms by the name of the stage they time; gauges are functions read at report time,
+    e.g. the length of the frontier.
+
+    Attributes:
+        enabled: whether anything is recorded
+        interval: the number of seconds between reports
+        prometheus_file: the file the metrics are written to in Prometheus text format at every report, or None
+    """
+
+    # Number of values of a labelled gauge in the summary line
+    TOP_LABELS = 3
+
+    def __init__(self):
+        self.enabled = False
+        self.interval = 60
+        self.prometheus_file = None
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started = time.time()
+
+    def enable(self, interval=60, prometheus_file=None):
+        """
+        Starts recording, and reporting every interval seconds
+        """
+        self.interval = interval
+        self.prometheus_file = prometheus_file
+        self._started = time.time()
+        self.enabled = True
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._report_periodically, name="metrics", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stops the periodic reports and writes a final one
+        """
+        if not self.enabled:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.report()
+        self.enabled = False
+
+    def start(self):
+        """
+        Returns the start time of a timed stage, to be passed to stop
+        """
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, stage, start):
+        """
+        Records the latency of a stage started at start
+        """
+        if self.enabled:
+            self.lap(stage, start)
+
+    def lap(self, stage, start):
+        """
+        Records the latency of a stage started at start, and returns the start time of the next one
+        """
+        if not self.enabled:
+            return 0.0
+        now = time.perf_counter()
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(now - start)
+        return now
+
+    def count(self, name, value=1, reason=None):
+        if self.enabled:
+            key = (name, reason)
+            with self._lock:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, function, label=None):
+        """
+        Registers a gauge, read by calling function at report time
+        :param label: the name of the label of a gauge with several values, e.g. one per host. function then returns a
+            dictionary of label value -> gauge value
+        """
+        self.gauges[name] = (function, label)
+
+    def _report_periodically(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.report()
+            except Exception:
+                logger.exception("Could not report the metrics")
+
+    def report(self):
+        """
+        Logs a summary line and writes the Prometheus file, if any
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {stage: (histogram.count, histogram.total, histogram.quantile(0.5), histogram.quantile(0.99),
+                                  list(histogram.buckets))
+                          for stage, histogram in self.histograms.items()}
+        gauges = {name: (function(), label) for name, (function, label) in self.gauges.items()}
+        elapsed = max(1e-9, time.time() - self._started)
+
+        parts = ["%s %s (%.1f/s)" % (name, value, value / elapsed)
+                 for (name, reason), value in sorted(counters.items()) if reason is None]
+        parts += ["%s %s" % (name, value) for name, (value, label) in sorted(gauges.items()) if label is None]
+        # The largest values of the labelled gauges
+        parts += ["%s %s" % (name, " ".join("%s=%s" % item for item in
+                                            sorted(values.items(), key=lambda item: -item[1])[:self.TOP_LABELS]))
+                  for name, (values, label) in sorted(gauges.items()) if label is not None and values]
+        parts += ["%s p50 %.0fus p99 %.0fus" % (stage, p50 * 1e6, p99 * 1e6)
+                  for stage, (count, total, p50, p99, _) in sorted(histograms.items())]
+        logger.info("Metrics: %s", ", ".join(parts))
+
+        if self.prometheus_file is not None:
+            self._write_prometheus(counters, gauges, histograms)
+
+    def _write_prometheus(self, counters, gauges, histograms):
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append("# TYPE crawler_%s_total counter" % name)
+            for (counter, reason), value in sorted(counters.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+                if counter == name:
+                    labels = '{reason="%s"}' % reason.replace('"', '\\"') if reason is not None else ""
+                    lines.append("crawler_%s_total%s %s" % (name, labels, value))
+        for name, (value, label) in sorted(gauges.items()):
+            lines.append("# TYPE crawler_%s gauge" % name)
+            if label is None:
+                lines.append("crawler_%s %s" % (name, value))
+                continue
+            for label_value, label_gauge in sorted(value.items()):
+                lines.append('crawler_%s{%s="%s"} %s' % (name, label, label_value.replace('"', '\\"'), label_gauge))
+        if histograms:
+            lines.append("# TYPE crawler_stage_seconds histogram")
+        for stage, (count, total, _, _, buckets) in sorted(histograms.items()):
+            cumulative = 0
+            # Every bound, also those of empty buckets, so that the series of a stage are the same in every report. The
+            # last bucket also holds everything slower, so only +Inf bounds it
+            for bucket in range(BUCKETS - 1):
+                cumulative += buckets[bucket]
+                lines.append('crawler_stage_seconds_bucket{stage="%s",le="%g"} %s'
+                             % (stage, (1 << bucket) / 1e6, cumulative))
+            lines.append('crawler_stage_seconds_bucket{stage="%s",le="+Inf"} %s' % (stage, count))
+            lines.append('crawler_stage_seconds_sum{stage="%s"} %s' % (stage, total))
+            lines.append('crawler_stage_seconds_count{stage="%s"} %s' % (stage, count))
+
+        tmp_file_name = self.prometheus_file + ".tmp"
+        with open(tmp_file_name, "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(tmp_file_name, self.prometheus_file)
+
+
+METRICS = Metrics()
@@ -0,0 +1,201 @@
+"""
+Near-duplicate page detection. A page is reduced to a 64 bit SimHash of the word shingles of its text, and pages whose
+signatures differ in at most max_distance bits are near-duplicates. NearDuplicateIndex finds them with locality
+sensitive hashing: the signature is split into blocks, and two signatures within max_distance bits of each other agree
+on at least all but max_distance of the blocks. Every choice of that many blocks has a table keyed by their bits.
+"""
+import hashlib
+import itertools
+import os
+import re
+from array import array
+
+# Markup, including the contents of script and style elements, is not part of the text of a page
+MARKUP_PATTERN = re.compile(rb'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>', re.DOTALL | re.IGNORECASE)
+WORD_PATTERN = re.compile(rb'[a-z0-9]+')
+
+SHINGLE_SIZE = 3
+# Pages with fewer shingles have too little text for a meaningful signature
+MIN_SHINGLES = 8
+
+
+def simhash(content):
+    """
+    Returns the 64 bit SimHash of the text of a page, or None if the page has too little text
+    :param content: the raw content of the page
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8", errors="surrogatepass")
+    words = WORD_PATTERN.findall(MARKUP_PATTERN.sub(b" ", bytes(content)).lower())
+    shingles = {b" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+
+    # Each bit of the signature is the majority vote of that bit over the shingle hashes. The hashes are laid out as
+    # strings of bits so that the votes are counted column by column
+    hashes = [format(int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "little"), "064b")
+              for shingle in shingles]
+    majority = len(hashes) / 2
+    return int("".join("1" if column.count("1") > majority else "0" for column in zip(*hashes)), 2)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def block_masks(blocks, bits=64):
+    """
+    Returns the masks of the bits of each block when a signature of the given number of bits is split into blocks of
+    as equal sizes as possible
+    """
+    bounds = [bits * block // blocks for block in range(blocks + 1)]
+    return [(1 << end) - (1 << start) for start, end in zip(bounds, bounds[1:])]
+
+
+class NearDuplicateIndex:
+    """
+    This class indexes the SimHash signatures of the distinct pages crawled so far and finds the near-duplicates of new
+    pages among them. Only pages that are not near-duplicates of an indexed page are indexed, so each indexed page
+    represents a cluster of near-duplicates.
+
+    A signature is split into BLOCKS blocks, and every choice of BLOCKS - max_distance of them has a table keyed by
+    their bits, 32 bits for the default max_distance of 3 (20 tables). Keys this wide keep the buckets small even among
+    similar pages, so a lookup compares every page of its buckets. A table hashes its keys into HEAD_BITS bit chain
+    heads, and the pages of a head are chained through an array of page ids; the pages of other keys in a chain are
+    passed over without computing their distance.
+
+    An indexed page takes 8 bytes for its signature, 4 per table for the chains and 4 for its cluster size; its url is
+    appended to urls_file and located by an 8 byte offset. The index pickles to its arrays (see Frontier.attach), and
+    urls_file is truncated back to the pickled size when the index is restored.
+
+    Attributes:
+        max_distance: the maximum number of differing signature bits of near-duplicates
+        masks: the mask of the key bits of each table
+        signatures: the signatures of the indexed pages, by page id
+        cluster_sizes: the number of pages in the cluster of each indexed page, including itself
+        examples: page id -> up to max_examples urls of its near-duplicates
+    """
+
+    BLOCKS = 6
+    HEAD_BITS = 16
+    # Multiplier of the Fibonacci hashing of the keys into the chain heads
+    KEY_HASH = 0x9E3779B97F4A7C15
+
+    def __init__(self, urls_file_name, max_distance=3, max_examples=5):
+        assert max_distance < self.BLOCKS, "near-duplicates could be missed with max_distance >= BLOCKS"
+        self.urls_file_name = urls_file_name
+        self.max_distance = max_distance
+        self.max_examples = max_examples
+        self.signatures = array("Q")
+        self.cluster_sizes = array("I")
+        self.url_offsets = array("Q")
+        self._create_tables()
+        self.examples = dict()
+        self.duplicates = 0
+        self._urls_file = open(self.urls_file_name, "wb")
+
+    def _create_tables(self):
+        """
+        Creates the tables and indexes the signatures in them
+        """
+        self.masks = [sum(masks) for masks in itertools.combinations(block_masks(self.BLOCKS),
+                                                                     self.BLOCKS - self.max_distance)]
+        # Chain links are page id + 1, 0 ends a chain
+        self.heads = [array("I", bytes(4 << self.HEAD_BITS)) for _ in self.masks]
+        self.chains = [array("I") for _ in self.masks]
+        for page_id, signature in enumerate(self.signatures):
+            self._link(page_id, signature)
+
+    def _link(self, page_id, signature):
+        for table, mask in enumerate(self.masks):
+            head = self._head(signature & mask)
+            self.chains[table].append(self.heads[table][head])
+            self.heads[table][head] = page_id + 1
+
+    def _head(self, key):
+        return (key * self.KEY_HASH & 0xFFFFFFFFFFFFFFFF) >> (64 - self.HEAD_BITS)
+
+    def find(self, signature):
+        """
+        Returns the id of an indexed page within max_distance bits of signature, or None
+        """
+        signatures = self.signatures
+        for table, mask in enumerate(self.masks):
+            key = signature & mask
+            chain = self.chains[table]
+            link = self.heads[table][self._head(key)]
+            while link:
+                page_id = link - 1
+                indexed = signatures[page_id]
+                if indexed & mask == key and hamming_distance(indexed, signature) <= self.max_distance:
+                    return page_id
+                link = chain[page_id]
+        return None
+
+    def add(self, url, signature):
+        """
+        Adds a page. Returns the id of the indexed page it is a near-duplicate of, or None if it is indexed as a new
+        cluster
+        """
+        page_id = self.find(signature)
+        if page_id is not None:
+            self.cluster_sizes[page_id] += 1
+            self.duplicates += 1
+            examples = self.examples.setdefault(page_id, [])
+            if len(examples) < self.max_examples:
+                examples.append(url)
+            return page_id
+
+        page_id = len(self.signatures)
+        self.signatures.append(signature)
+        self.cluster_sizes.append(1)
+        self.url_offsets.append(self._urls_file.tell())
+        self._urls_file.write(url.encode("utf-8", errors="surrogatepass") + b"\n")
+        self._link(page_id, signature)
+        return None
+
+    def get_url(self, page_id):
+        """
+        Returns the url of an indexed page
+        """
+        self._urls_file.flush()
+        with open(self.urls_file_name, "rb") as urls_file:
+            urls_file.seek(self.url_offsets[page_id])
+            return urls_file.readline().rstrip(b"\n").decode("utf-8", errors="surrogatepass")
+
+    def clusters(self):
+        """
+        Yields (url, size, example duplicate urls) of every cluster with near-duplicates, largest first
+        """
+        for page_id in sorted(self.examples, key=lambda page_id: -self.cluster_sizes[page_id]):
+            yield self.get_url(page_id), self.cluster_sizes[page_id], self.examples[page_id]
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes taken by the arrays, without the examples
+        """
+        arrays = [self.signatures, self.cluster_sizes, self.url_offsets] + self.heads + self.chains
+        return sum(values.itemsize * len(values) for values in arrays)
+
+    def __getstate__(self):
+        self._urls_file.flush()
+        state = self.__dict__.copy()
+        del state["_urls_file"]
+        state["urls_file_size"] = self._urls_file.tell()
+        return state
+
+    def __setstate__(self, state):
+        urls_file_size = state.pop("urls_file_size")
+        self.__dict__.update(state)
+        if "masks" not in state:
+            # Saved with the 16 bit band tables of earlier versions
+            self.__dict__.pop("max_candidates", None)
+            self._create_tables()
+        # The urls file may be ahead of the snapshot if the crawl died after it was written
+        if os.path.isfile(self.urls_file_name) and os.path.getsize(self.urls_file_name) > urls_file_size:
+            with open(self.urls_file_name, "r+b") as urls_file:
+                urls_file.truncate(urls_file_size)
+        self._urls_file = open(self.urls_file_name, "ab")
+
+    def __len__(self):
+        return len(self.signatures)
@@ -0,0 +1,143 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from html_extractor import parse_page
+from metrics import METRICS
+from near_duplicates import simhash
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlPipeline:
+    """
+    This class runs a crawl with fetching, parsing and link processing overlapped. A pool of fetch threads runs
+    Corpus.fetch_url, a pool of worker processes parses the fetched pages, and the calling thread acts as the single
+    coordinator that owns the frontier and all of the crawler state.
+
+    The coordinator takes urls from the frontier ahead of time, at most window of them in flight, and applies the
+    parsed pages strictly in the order they were taken. With the FIFO frontier this makes the sequence of frontier
+    operations, and so the analytics, identical to a sequential Crawler.start_crawling run.
+
+    Attributes:
+        crawler: the crawler whose frontier, corpus and analytics are used
+        fetch_workers: the number of fetch threads
+        parse_workers: the number of parse processes
+        queue_size: the capacity of the bounded queues between the stages
+    """
+
+    def __init__(self, crawler, fetch_workers=4, parse_workers=None, queue_size=32):
+        self.crawler = crawler
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        # Pages can be waiting in the fetch queue, being fetched, waiting for a parse slot or being parsed
+        self.window = 2 * queue_size + fetch_workers
+
+    def run(self):
+        """
+        Crawls until the frontier is empty and no page is in flight, then writes the analysis
+        """
+        frontier = self.crawler.frontier
+        fetch_queue = queue.Queue(self.queue_size)
+        done_queue = queue.Queue()
+        parse_slots = threading.BoundedSemaphore(self.queue_size)
+        METRICS.gauge("fetch_queue_depth", fetch_queue.qsize)
+        METRICS.gauge("done_queue_depth", done_queue.qsize)
+
+        with ProcessPoolExecutor(self.parse_workers) as parse_pool:
+            fetchers = [threading.Thread(target=self._fetch_worker,
+                                         args=(fetch_queue, done_queue, parse_pool, parse_slots), daemon=True)
+                        for _ in range(self.fetch_workers)]
+            for fetcher in fetchers:
+                fetcher.start()
+
+            try:
+                self._coordinate(frontier, fetch_queue, done_queue)
+            finally:
+                for _ in fetchers:
+                    fetch_queue.put(None)
+                for fetcher in fetchers:
+                    fetcher.join()
+
+        self.crawler.output_analysis()
+
+    def _coordinate(self, frontier, fetch_queue, done_queue):
+        pending = {}
+        next_seq = 0
+        next_apply = 0
+        while True:
+            while next_seq - next_apply < self.window and frontier.has_next_url():
+                url = frontier.get_next_url()
+                logger.info("Fetching URL %s ... Fetched: %s, Queue size: %s, In flight: %s", url, frontier.fetched,
+                            len(frontier), next_seq - next_apply)
+                # The extraction cache is only used from this thread
+                fetch_queue.put((next_seq, url, self.crawler.cached_extraction(url)))
+                next_seq += 1
+
+            if next_apply == next_seq:
+                break
+
+            # Reorder buffer: wait until the oldest page in flight is done
+            while next_apply not in pending:
+                seq, result, error = done_queue.get()
+                pending[seq] = (result, error)
+            result, error = pending.pop(next_apply)
+            next_apply += 1
+            if error is not None:
+                raise error
+
+            url_data, page_content, extraction = result
+            self.crawler.process_page(url_data, self.crawler.extract_next_links(url_data, page_content, extraction))
+
+    def _fetch_worker(self, fetch_queue, done_queue, parse_pool, parse_slots):
+        parser = self.crawler.parser
+        while True:
+            item = fetch_queue.get()
+            if item is None:
+                return
+            seq, url, cached = item
+            try:
+                url_data, extraction = self.crawler.fetch_page(url, cached)
+            except Exception as e:
+                done_queue.put((seq, None, e))
+                continue
+
+            if extraction is not None or url_data["content"] is None or url_data["http_code"] == 404:
+                done_queue.put((seq, (url_data, None, extraction), None))
+                continue
+            handler = self.crawler.gate_page(url_data)
+            content = url_data["content"]
+            if handler == "skip":
+                done_queue.put((seq, (url_data, parse_page(parser, content, handler), None), None))
+                continue
+            if not isinstance(content, (bytes, str)):
+                content = bytes(content)
+            if self.crawler.near_duplicates is not None and "simhash" not in url_data:
+                url_data["simhash"] = simhash(content)
+
+            # Blocks while queue_size pages are already waiting for or in the parse pool
+            parse_slots.acquire()
+            # Parsing happens in another process, so the parse latency includes the wait for a free parse worker
+            start = METRICS.start()
+            try:
+                future = parse_pool.submit(parse_page, parser, content, handler)
+            except Exception as e:
+                parse_slots.release()
+                done_queue.put((seq, None, e))
+                continue
+            future.add_done_callback(
+                lambda f, seq=seq, url_data=url_data, start=start:
+                self._parsed(f, seq, url_data, done_queue, parse_slots, start))
+
+    @staticmethod
+    def _parsed(future, seq, url_data, done_queue, parse_slots, start):
+        METRICS.stop("parse", start)
+        parse_slots.release()
+        error = future.exception()
+        if error is not None:
+            done_queue.put((seq, None, error))
+        else:
+            done_queue.put((seq, (url_data, future.result(), None), None))
@@ -0,0 +1,207 @@
+"""
+Profiling of a crawl, see main.py --profile. Profiles a window of pages, e.g. pages 10000 to 20000, so that startup and
+the end of the crawl don't dominate the results, in one of two modes:
+
+    deterministic: cProfile. Exact call counts and times of every function, with a high overhead on function calls.
+        Writes PREFIX.prof, to be loaded with pstats or viewers like snakeviz. cProfile only records caller and callee
+        pairs, not full stacks, so no flame graph is written in this mode
+    sampling: samples the stacks of all of the crawler threads every interval seconds of wall time, with a low
+        overhead. Writes PREFIX.collapsed, one "frame;frame;frame count" line per distinct stack, the input of
+        flamegraph.pl or speedscope. Samples are taken by a SIGALRM handler, as a sampling thread would only get to
+        run, and so sample, where the crawler thread releases the GIL. Parse worker processes aren't sampled
+
+Both modes write a top-N summary to PREFIX.txt, with the time attributed to the crawler stages first.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Function name -> crawler stage it is attributed to. Time in nested stages goes to the innermost one
+STAGE_FUNCTIONS = {
+    "fetch_url": "fetch_url",
+    "fetch_many": "fetch_url",
+    "extract_next_links": "extract_next_links",
+    "valid_links": "is_valid",
+    "is_valid": "is_valid",
+    "add_url": "frontier",
+    "get_next_url": "frontier",
+    "has_next_url": "frontier",
+    "output_analysis": "output_analysis",
+}
+
+
+def frame_label(code):
+    return "%s (%s:%s)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class CrawlProfiler:
+    """
+    This class profiles the crawl of a window of pages. page_done is called after every page, see
+    Crawler.page_callbacks; profiling starts after start_page pages and stops after stop_page pages, or when stop is
+    called, e.g. at the end of the crawl.
+
+    Attributes:
+        mode: "deterministic" or "sampling"
+        start_page, stop_page: the window of pages profiled. stop_page None profiles until the end of the crawl
+        output_prefix: the prefix of the output files
+        top: the number of functions in the summary
+        interval: the number of seconds between samples in sampling mode
+        pages: the number of pages processed so far
+    """
+
+    def __init__(self, mode="sampling", start_page=0, stop_page=None, output_prefix="profile", top=30,
+                 interval=0.005):
+        self.mode = mode
+        self.start_page = start_page
+        self.stop_page = stop_page
+        self.output_prefix = output_prefix
+        self.top = top
+        self.interval = interval
+        self.pages = 0
+        self.running = False
+        self.done = False
+        self.profile = None
+        self.samples = Counter()
+        self._previous_handler = None
+        self._thread_names = {}
+        self._started = None
+        self._elapsed = 0.0
+        if start_page <= 0:
+            self.start()
+
+    def page_done(self, url_data=None):
+        self.pages += 1
+        if self.pages == self.start_page and not self.done:
+            self.start()
+        elif self.pages == self.stop_page:
+            self.stop()
+
+    def start(self):
+        if self.running or self.done:
+            return
+        logger.info("Profiling (%s) from page %s", self.mode, self.pages)
+        self.running = True
+        self._started = time.perf_counter()
+        if self.mode == "deterministic":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self._previous_handler = signal.signal(signal.SIGALRM, self._sample)
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self):
+        """
+        Stops profiling, if running, and writes the results
+        """
+        if not self.running:
+            return
+        if self.mode == "deterministic":
+            self.profile.disable()
+        else:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._previous_handler)
+        self._elapsed = time.perf_counter() - self._started
+        self.running = False
+        self.done = True
+        logger.info("Profiled %.1fs until page %s", self._elapsed, self.pages)
+        self.write()
+
+    def _sample(self, signum, frame):
+        # The handler runs in the main thread: frame is its current frame, the other threads are sampled as they are
+        frames = sys._current_frames()
+        frames[threading.main_thread().ident] = frame
+        for thread_id, frame in frames.items():
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if thread_id not in self._thread_names:
+                self._thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stack.append(self._thread_names.get(thread_id, "thread"))
+            self.samples[";".join(reversed(stack))] += 1
+
+    def stage_times(self):
+        """
+        Returns the seconds attributed to each crawler stage, with the time of stages called from another stage
+        attributed to the inner one
+        """
+        stages = Counter()
+        if self.mode == "deterministic":
+            stats = pstats.Stats(self.profile)
+            for (_, _, name), (_, _, own_time, total_time, callers) in stats.stats.items():
+                stage = STAGE_FUNCTIONS.get(name)
+                if stage is None:
+                    continue
+                stages[stage] += total_time
+                # Take out the time of this stage from the stages calling it directly
+                for (_, _, caller), (_, _, _, call_total_time) in callers.items():
+                    if STAGE_FUNCTIONS.get(caller) not in (None, stage):
+                        stages[STAGE_FUNCTIONS[caller]] -= call_total_time
+            return stages
+        # Samples of the main thread only, scaled to the profiled time
+        main_thread = threading.main_thread().name + ";"
+        main_samples = sum(count for stack, count in self.samples.items() if stack.startswith(main_thread)) or 1
+        for stack, count in self.samples.items():
+            if not stack.startswith(main_thread):
+                continue
+            for label in reversed(stack.split(";")):
+                stage = STAGE_FUNCTIONS.get(label.split(" ", 1)[0])
+                if stage is not None:
+                    stages[stage] += count / main_samples * self._elapsed
+                    break
+        return stages
+
+    def summary(self):
+        """
+        Returns the top-N summary: the time per crawler stage, then the functions with the most time
+        """
+        out = io.StringIO()
+        out.write("Profiled %.1fs (%s) of pages %s to %s\n\n" % (self._elapsed, self.mode, self.start_page, self.pages))
+        out.write("Time per crawler stage:\n")
+        for stage, seconds in sorted(self.stage_times().items(), key=lambda item: -item[1]):
+            out.write("%10.3fs  %5.1f%%  %s\n" % (seconds, 100 * seconds / (self._elapsed or 1), stage))
+        out.write("\n")
+
+        if self.mode == "deterministic":
+            stats = pstats.Stats(self.profile, stream=out)
+            stats.sort_stats("tottime").print_stats(self.top)
+            return out.getvalue()
+
+        own = Counter()
+        total = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        samples = sum(self.samples.values()) or 1
+        out.write("%d samples every %sms\n" % (samples, self.interval * 1000))
+        out.write("%8s %6s %8s %6s  function\n" % ("own", "own%", "total", "total%"))
+        for label, count in own.most_common(self.top):
+            out.write("%8d %5.1f%% %8d %5.1f%%  %s\n" % (count, 100 * count / samples, total[label],
+                                                         100 * total[label] / samples, label))
+        return out.getvalue()
+
+    def write(self):
+        """
+        Writes the profile and its summary to the files named by output_prefix
+        """
+        if self.mode == "deterministic":
+            self.profile.dump_stats(self.output_prefix + ".prof")
+        else:
+            with open(self.output_prefix + ".collapsed", "w", encoding="utf-8") as collapsed_file:
+                for stack, count in sorted(self.samples.items()):
+                    collapsed_file.write("%s %d\n" % (stack, count))
+        with open(self.output_prefix + ".txt", "w", encoding="utf-8") as summary_file:
+            summary_file.write(self.summary())
+        logger.info("Wrote the profile to %s.*", self.output_prefix)
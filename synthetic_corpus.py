@@ -0,0 +1,180 @@
+"""
+Synthetic corpus generator. Writes pages in the corpus layout Corpus.fetch_url reads (one CBOR record per file, named
+by the digest of the url), so the crawler can be benchmarked without the real corpus. The crawl seed
+http://www.ics.uci.edu/ is always the first page, and every page is reachable from it.
+
+Pages have a log-normal number of words drawn from a Zipf distributed vocabulary, and link to other pages of the corpus
+and to urls that are not in it. A share of the pages are near-copies of an earlier page, and trap pages link to endless
+calendars, session ids and repeated path segments.
+
+Usage: python synthetic_corpus.py OUTPUT_DIR [--pages N] [--seed N] [--words-median N] [--words-sigma X]
+    [--fan-out N] [--duplicate-rate X] [--trap-rate X] [--missing-link-rate X] [--hosts N]
+"""
+import argparse
+import itertools
+import logging
+import math
+import os
+import random
+
+from cbor_record import encode_record
+from corpus import url_digest
+
+logger = logging.getLogger(__name__)
+
+SEED_URL = "http://www.ics.uci.edu/"
+TRAPS = ("calendar", "session", "repeated")
+
+
+class SyntheticCorpus:
+    """
+    This class generates a synthetic corpus. The same parameters and seed always generate the same corpus.
+
+    Attributes:
+        pages: the number of regular pages
+        words_median, words_sigma: the parameters of the log-normal number of words per page
+        fan_out: the mean number of outlinks per page
+        duplicate_rate: the share of pages that are near-copies of an earlier page
+        trap_rate: the share of pages linking to a trap
+        missing_link_rate: the share of outlinks pointing to urls that are not in the corpus
+        hosts: the number of subdomains the pages are spread over
+        trap_depth: the number of pages of each trap in the corpus, i.e. how deep a crawler can fall into it
+    """
+
+    def __init__(self, pages=10000, seed=0, words_median=300, words_sigma=0.8, fan_out=20, duplicate_rate=0.05,
+                 trap_rate=0.02, missing_link_rate=0.05, hosts=20, vocabulary_size=20000, trap_depth=50):
+        self.pages = pages
+        self.random = random.Random(seed)
+        self.words_median = words_median
+        self.words_sigma = words_sigma
+        self.fan_out = fan_out
+        self.duplicate_rate = duplicate_rate
+        self.trap_rate = trap_rate
+        self.missing_link_rate = missing_link_rate
+        self.hosts = ["www.ics.uci.edu"] + ["host%d.ics.uci.edu" % i for i in range(1, hosts)]
+        self.trap_depth = trap_depth
+        self.vocabulary = self._vocabulary(vocabulary_size)
+        # Zipf's law: the frequency of the word of rank r is proportional to 1 / r
+        self.cumulative_weights = list(itertools.accumulate(1 / rank for rank in range(1, vocabulary_size + 1)))
+        self.urls = [SEED_URL] + [self._page_url(page) for page in range(1, pages)]
+
+    def _vocabulary(self, size):
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        words = set()
+        while len(words) < size:
+            words.add("".join(self.random.choice(letters) for _ in range(self.random.randint(2, 10))))
+        return sorted(words, key=lambda word: (len(word), word))
+
+    def _page_url(self, page):
+        host = self.hosts[page % len(self.hosts)]
+        return "http://%s/section%d/page%d.html" % (host, page % 7, page)
+
+    def _text(self):
+        count = max(1, int(self.random.lognormvariate(math.log(self.words_median), self.words_sigma)))
+        words = self.random.choices(self.vocabulary, cum_weights=self.cumulative_weights, k=count)
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        return "<p>" + "</p>\n<p>".join(lines) + "</p>"
+
+    def _outlinks(self, page):
+        links = []
+        # The next page keeps every page reachable from the seed
+        if page + 1 < self.pages:
+            links.append(self.urls[page + 1])
+        for _ in range(max(0, int(self.random.expovariate(1 / self.fan_out)) if self.fan_out else 0)):
+            if self.random.random() < self.missing_link_rate:
+                host = self.random.choice(self.hosts)
+                links.append("http://%s/missing/%d.html" % (host, self.random.randrange(10 ** 6)))
+            else:
+                links.append(self.urls[self.random.randrange(self.pages)])
+        return links
+
+    def _href(self, page_url, link):
+        # Mix of absolute, host relative and relative links, as found in real pages
+        kind = self.random.random()
+        link_host = link.split("/", 3)[2]
+        if kind < 0.5 or link_host != page_url.split("/", 3)[2]:
+            return link
+        path = "/" + link.split("/", 3)[3]
+        if kind < 0.8:
+            return path
+        return "//" + link_host + path
+
+    def _trap_urls(self, trap, host, step):
+        if trap == "calendar":
+            day = 1 + step
+            return "http://%s/calendar/%04d-%02d-%02d" % (host, 2019 + day // 365, 1 + day // 31 % 12, 1 + day % 28)
+        if trap == "session":
+            return "http://%s/login.php?sid=%032x" % (host, self.random.getrandbits(128))
+        return "http://%s/%s" % (host, "a/b/" * (step + 1) + "index.html")
+
+    def _html(self, title, text, hrefs):
+        links = "\n".join('<a href="%s">link</a>' % href for href in hrefs)
+        return ("<html><head><title>%s</title><script>var tracking = 1;</script></head>\n<body>\n%s\n%s\n</body></html>"
+                % (title, text, links)).encode("utf-8")
+
+    def pages_iter(self):
+        """
+        Yields the (url, content) of every page of the corpus once, trap pages included
+        """
+        texts = []
+        # Trap pages already yielded: a host can fall into the same trap from several pages
+        trapped = set()
+        for page, url in enumerate(self.urls):
+            if texts and self.random.random() < self.duplicate_rate:
+                # A near-copy of an earlier page: same text, different title and links
+                text = self.random.choice(texts)
+            else:
+                text = self._text()
+                if len(texts) < 1000:
+                    texts.append(text)
+            hrefs = [self._href(url, link) for link in self._outlinks(page)]
+
+            if self.random.random() < self.trap_rate:
+                trap = self.random.choice(TRAPS)
+                host = url.split("/", 3)[2]
+                trap_urls = [self._trap_urls(trap, host, step) for step in range(self.trap_depth)]
+                hrefs.append(trap_urls[0])
+                for step, trap_url in enumerate(trap_urls):
+                    if trap_url in trapped:
+                        continue
+                    trapped.add(trap_url)
+                    # Each trap page links one step further into the trap
+                    next_hrefs = trap_urls[step + 1:step + 2]
+                    yield trap_url, self._html("Trap %s" % step, "<p>%s %s</p>" % (trap, step), next_hrefs)
+            yield url, self._html("Page %s" % page, text, hrefs)
+
+    def write(self, corpus_dir):
+        """
+        Writes the corpus files to corpus_dir. Returns the number of pages written
+        """
+        os.makedirs(corpus_dir, exist_ok=True)
+        written = 0
+        for url, content in self.pages_iter():
+            with open(os.path.join(corpus_dir, url_digest(url)), "wb") as corpus_file:
+                corpus_file.write(encode_record(url, content))
+            written += 1
+        return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Generates a synthetic corpus")
+    parser.add_argument("corpus_dir", help="output directory")
+    parser.add_argument("--pages", type=int, default=10000, help="number of regular pages")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--words-median", type=int, default=300, help="median number of words per page")
+    parser.add_argument("--words-sigma", type=float, default=0.8,
+                        help="spread of the log-normal number of words per page")
+    parser.add_argument("--fan-out", type=int, default=20, help="mean number of outlinks per page")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="share of near-duplicate pages")
+    parser.add_argument("--trap-rate", type=float, default=0.02, help="share of pages linking to a trap")
+    parser.add_argument("--missing-link-rate", type=float, default=0.05,
+                        help="share of outlinks to urls that are not in the corpus")
+    parser.add_argument("--hosts", type=int, default=20, help="number of subdomains")
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus(args.pages, args.seed, args.words_median, args.words_sigma, args.fan_out,
+                             args.duplicate_rate, args.trap_rate, args.missing_link_rate, args.hosts)
+    written = corpus.write(args.corpus_dir)
+    logger.info("Wrote %s pages to %s", written, args.corpus_dir)
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+from cbor_record import CborError, decode, decode_record, encode, encode_record, read_record
+
+CONTENT = b"<html><body>" + b"word " * 100 + b"</body></html>"
+
+
+class DecodeRecordTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = encode_record("http://www.ics.uci.edu/a", CONTENT, http_code=301, content_type="text/plain",
+                             is_redirected=True, final_url="http://www.ics.uci.edu/b")
+        record = decode_record(data)
+        self.assertIsInstance(record["raw_content"], memoryview)
+        self.assertEqual(bytes(record["raw_content"]), CONTENT)
+        self.assertEqual(record["http_code"], 301)
+        self.assertEqual(record["content_type"], "text/plain")
+        self.assertTrue(record["is_redirected"])
+        self.assertEqual(record["final_url"], b"http://www.ics.uci.edu/b")
+
+    def test_defaults(self):
+        record = decode_record(encode_record("http://www.ics.uci.edu/a", b"", content_type=None))
+        self.assertEqual(bytes(record["raw_content"]), b"")
+        self.assertEqual(record["http_code"], 200)
+        self.assertIsNone(record["content_type"])
+        self.assertFalse(record["is_redirected"])
+        self.assertIsNone(record["final_url"])
+
+    def test_header_only(self):
+        data = encode_record("http://www.ics.uci.edu/a", CONTENT, http_code=404)
+        record = decode_record(data, include_content=False)
+        self.assertIsNone(record["raw_content"])
+        self.assertEqual(record["http_code"], 404)
+        self.assertEqual(record["content_type"], "text/html")
+
+    def test_memoryview_input(self):
+        data = bytearray(b"padding" + encode_record("http://www.ics.uci.edu/a", CONTENT))
+        record = decode_record(memoryview(data)[len(b"padding"):])
+        self.assertEqual(bytes(record["raw_content"]), CONTENT)
+        # The body is not copied
+        end = data.index(CONTENT) + len(CONTENT)
+        data[end - 1:end] = b"!"
+        self.assertEqual(bytes(record["raw_content"])[-1:], b"!")
+
+    def test_memoryview_body_is_encoded(self):
+        data = encode_record("http://www.ics.uci.edu/a", memoryview(CONTENT))
+        self.assertEqual(bytes(decode_record(data)["raw_content"]), CONTENT)
+
+    def test_indefinite_lengths(self):
+        # A map and a body in chunks of indefinite length, which encode doesn't write
+        data = b"\xbf" + encode(b"raw_content") + b"\xbf" + encode(b"value") + b"\x5f" + encode(CONTENT[:10]) + \
+            encode(CONTENT[10:]) + b"\xff\xff" + encode(b"http_code") + encode({b"value": 500}) + b"\xff"
+        record = decode_record(data)
+        self.assertEqual(bytes(record["raw_content"]), CONTENT)
+        self.assertEqual(record["http_code"], 500)
+        self.assertEqual(decode(data)[1], len(data))
+
+    def test_truncated(self):
+        data = encode_record("http://www.ics.uci.edu/a", CONTENT, final_url="http://www.ics.uci.edu/b")
+        for length in range(len(data)):
+            with self.assertRaises(CborError):
+                decode_record(data[:length])
+                self.fail("decoded a record cut at %s bytes" % length)
+
+    def test_malformed(self):
+        for data in (encode([1, 2]), b"\xa1\x1c", b"\xa1" + encode(b"http_code") + b"\x7f\x61\xff\xff",
+                     b"\xbf" + encode(b"raw_content") + b"\xbf"):
+            with self.assertRaises(CborError):
+                decode_record(data)
+
+
+class ReadRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "record")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_record(self):
+        with open(self.file_name, "wb") as f:
+            f.write(encode_record("http://www.ics.uci.edu/a", CONTENT))
+        record = read_record(self.file_name)
+        self.assertEqual(bytes(record["raw_content"]), CONTENT)
+        stat = os.stat(self.file_name)
+        self.assertEqual(record["file_stat"], (stat.st_size, stat.st_mtime_ns))
+        del record
+        self.assertIsNone(read_record(self.file_name, include_content=False)["raw_content"])
+
+    def test_empty_file(self):
+        open(self.file_name, "wb").close()
+        with self.assertRaises(CborError):
+            read_record(self.file_name)
+
+
+if __name__ == "__main__":
+    unittest.main()
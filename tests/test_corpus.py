@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+from cbor_record import encode_record
+from corpus import Corpus, url_digest
+from corpus_index import CorpusIndex
+from crawler import Crawler
+from extraction_cache import ExtractionCache
+
+URL = "http://www.ics.uci.edu/a"
+
+
+class ExtractionCacheStalenessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        self.corpus_dir = os.path.join(self.directory.name, "corpus")
+        os.mkdir(self.corpus_dir)
+        self.index_file = os.path.join(self.directory.name, "corpus.idx")
+        self.cache = ExtractionCache(os.path.join(self.directory.name, "extractions.db"))
+
+    def tearDown(self):
+        self.cache.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def write_page(self, link, mtime_ns):
+        path = os.path.join(self.corpus_dir, url_digest(URL))
+        with open(path, "wb") as f:
+            f.write(encode_record(URL, '<html><body><a href="{}">word</a></body></html>'.format(link).encode()))
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def crawl_page(self):
+        corpus = Corpus(self.corpus_dir, self.index_file)
+        crawler = Crawler(None, corpus, extraction_cache=self.cache)
+        try:
+            url_data, extraction = crawler.fetch_page(URL)
+            if extraction is None:
+                extraction = crawler.extract(url_data)
+            return extraction
+        finally:
+            crawler.discovered_file.close()
+            corpus.close()
+
+    def test_file_rewritten_in_place_is_a_stale_miss(self):
+        self.write_page("http://www.ics.uci.edu/old", 10 ** 18)
+        self.assertEqual(self.crawl_page().links, ["http://www.ics.uci.edu/old"])
+        self.assertEqual(self.crawl_page().links, ["http://www.ics.uci.edu/old"])
+        self.assertEqual((self.cache.hits, self.cache.stale), (1, 0))
+
+        # Same size and file count, so the persisted index still looks current
+        self.write_page("http://www.ics.uci.edu/new", 2 * 10 ** 18)
+        self.assertEqual(self.crawl_page().links, ["http://www.ics.uci.edu/new"])
+        self.assertEqual((self.cache.hits, self.cache.stale), (1, 1))
+
+        # The out of date index is discarded, and the next run indexes the new version
+        self.assertFalse(os.path.exists(self.index_file))
+        self.assertEqual(self.crawl_page().links, ["http://www.ics.uci.edu/new"])
+        self.assertEqual((self.cache.hits, self.cache.stale), (2, 1))
+
+
+class CorpusIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.corpus_dir = os.path.join(self.directory.name, "corpus")
+        os.mkdir(self.corpus_dir)
+        self.index_file = os.path.join(self.directory.name, "corpus.idx")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add_file(self, url):
+        with open(os.path.join(self.corpus_dir, url_digest(url)), "wb") as f:
+            f.write(encode_record(url, b"<html></html>"))
+
+    def test_persisted_index_is_loaded_until_the_directory_changes(self):
+        self.add_file("http://www.ics.uci.edu/a")
+        index = CorpusIndex.open(self.corpus_dir, self.index_file)
+        self.assertIsNotNone(index.entries)
+        index = CorpusIndex.open(self.corpus_dir, self.index_file)
+        self.assertIsNone(index.entries)
+        self.assertIn(url_digest("http://www.ics.uci.edu/a"), index)
+        index._mapped.close()
+
+        self.add_file("http://www.ics.uci.edu/b")
+        # The directory modification time may not have moved on a file system with a coarse timestamp resolution
+        modified = CorpusIndex.corpus_state(self.corpus_dir)[0] + 10 ** 9
+        os.utime(self.corpus_dir, ns=(modified, modified))
+        index = CorpusIndex.open(self.corpus_dir, self.index_file)
+        self.assertIsNotNone(index.entries)
+        self.assertEqual(len(index), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
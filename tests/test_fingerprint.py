@@ -0,0 +1,92 @@
+import pickle
+import unittest
+
+from fingerprint import BloomFilter, FingerprintSet, url_fingerprint
+
+URLS = ["http://www.ics.uci.edu/page%d" % i for i in range(5000)]
+
+
+class FingerprintSetTest(unittest.TestCase):
+
+    def check_membership(self, urls_set):
+        for url in URLS[:2500]:
+            self.assertTrue(urls_set.add(url))
+        self.assertEqual(len(urls_set), 2500)
+        self.assertLessEqual(len(urls_set), FingerprintSet.MAX_LOAD * len(urls_set.table))
+        # No false negatives, also after the table grew
+        self.assertTrue(all(url in urls_set for url in URLS[:2500]))
+        self.assertFalse(any(urls_set.add(url) for url in URLS[:2500]))
+        self.assertEqual(len(urls_set), 2500)
+        # Fingerprints are 64 bits, so unseen urls practically never collide
+        self.assertFalse(any(url in urls_set for url in URLS[2500:]))
+
+    def test_membership(self):
+        self.check_membership(FingerprintSet(capacity=16))
+
+    def test_membership_with_bloom_filter(self):
+        urls_set = FingerprintSet(capacity=16, bloom_fpr=0.01, expected_items=2500)
+        self.check_membership(urls_set)
+        self.assertTrue(all(urls_set.bloom.contains_fingerprint(url_fingerprint(url)) for url in URLS[:2500]))
+
+    def test_growth(self):
+        urls_set = FingerprintSet(capacity=6)
+        self.assertEqual(len(urls_set.table), 8)
+        for i, url in enumerate(URLS[:7]):
+            urls_set.add(url)
+            self.assertEqual(len(urls_set.table), 8 if i < 6 else 16)
+        self.assertEqual(urls_set.mask, len(urls_set.table) - 1)
+
+    def test_zero_fingerprint(self):
+        urls_set = FingerprintSet()
+        self.assertTrue(urls_set.add_fingerprint(0))
+        self.assertTrue(urls_set.contains_fingerprint(0))
+        self.assertFalse(urls_set.add_fingerprint(0))
+        self.assertEqual(len(urls_set), 1)
+
+    def test_compact(self):
+        urls_set = FingerprintSet(capacity=1 << 14, bloom_fpr=0.01)
+        for url in URLS[:100]:
+            urls_set.add(url)
+        fingerprints = sorted(urls_set.fingerprints())
+        usage = urls_set.memory_usage()
+
+        self.assertTrue(urls_set.compact())
+        self.assertIsNone(urls_set.bloom)
+        self.assertEqual(len(urls_set.table), 256)
+        self.assertLess(urls_set.memory_usage(), usage)
+        self.assertEqual(sorted(urls_set.fingerprints()), fingerprints)
+        self.assertEqual(len(urls_set), 100)
+        self.assertTrue(all(url in urls_set for url in URLS[:100]))
+        self.assertFalse(any(url in urls_set for url in URLS[100:]))
+        self.assertFalse(urls_set.compact())
+
+        # Keeps growing from the compacted size
+        for url in URLS[100:]:
+            urls_set.add(url)
+        self.assertTrue(all(url in urls_set for url in URLS))
+
+    def test_clear_and_pickle(self):
+        urls_set = FingerprintSet(bloom_fpr=0.01, expected_items=1000)
+        for url in URLS[:1000]:
+            urls_set.add(url)
+        restored = pickle.loads(pickle.dumps(urls_set))
+        self.assertEqual(len(restored), 1000)
+        self.assertTrue(all(url in restored for url in URLS[:1000]))
+        urls_set.clear()
+        self.assertEqual(len(urls_set), 0)
+        self.assertFalse(any(url in urls_set for url in URLS[:1000]))
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(2000, 0.01)
+        for url in URLS[:2000]:
+            bloom.add_fingerprint(url_fingerprint(url))
+        self.assertTrue(all(bloom.contains_fingerprint(url_fingerprint(url)) for url in URLS[:2000]))
+        false_positives = sum(bloom.contains_fingerprint(url_fingerprint(url)) for url in URLS[2000:])
+        self.assertLess(false_positives, 0.03 * len(URLS[2000:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import pickle
+import tempfile
+import unittest
+from collections import deque
+
+from frontier import Frontier
+
+SEED = "http://www.ics.uci.edu/"
+
+
+class FrontierLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        self.frontiers = []
+
+    def tearDown(self):
+        for frontier in self.frontiers:
+            if frontier._log is not None:
+                frontier._log.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def load(self):
+        frontier = Frontier()
+        self.frontiers.append(frontier)
+        frontier.load_frontier()
+        return frontier
+
+    def test_torn_final_record_is_dropped(self):
+        frontier = self.load()
+        frontier.add_url("http://www.ics.uci.edu/a")
+        self.assertEqual(frontier.get_next_url(), SEED)
+        log_file_name = Frontier.LOG_FILE_NAME % frontier.generation
+        valid_length = os.path.getsize(log_file_name)
+        # A crash in the middle of writing an add
+        with open(log_file_name, "ab") as log_file:
+            log_file.write(Frontier.LOG_RECORD_HEADER.pack(Frontier.ADD, 40) + b"http://www.ics")
+
+        frontier = self.load()
+        self.assertEqual(list(frontier.urls_queue), ["http://www.ics.uci.edu/a"])
+        self.assertEqual(frontier.fetched, 1)
+        self.assertTrue(frontier.is_duplicate(SEED))
+        self.assertFalse(frontier.is_duplicate("http://www.ics"))
+        self.assertEqual(os.path.getsize(log_file_name), valid_length)
+
+    def test_replay_after_snapshot(self):
+        frontier = self.load()
+        pages = frontier.attach("pages", list)
+        frontier.add_url("http://www.ics.uci.edu/a")
+        pages.append(frontier.get_next_url())
+        frontier.log_record("pages", SEED, SEED)
+        frontier.save_frontier()
+        frontier.add_url("http://www.ics.uci.edu/b")
+        pages.append(frontier.get_next_url())
+        frontier.add_url("http://www.ics.uci.edu/c")
+        # Flushes the log, as the crawler does at the end of each page
+        frontier.log_record("pages", "http://www.ics.uci.edu/a", "http://www.ics.uci.edu/a")
+
+        frontier = self.load()
+        self.assertEqual(frontier.generation, 1)
+        self.assertEqual(list(frontier.urls_queue), ["http://www.ics.uci.edu/b", "http://www.ics.uci.edu/c"])
+        self.assertEqual(frontier.fetched, 2)
+        self.assertTrue(frontier.is_duplicate("http://www.ics.uci.edu/a"))
+        # The attachment as of the snapshot, and the records logged since
+        self.assertEqual(frontier.attach("pages", list), [SEED])
+        self.assertEqual(frontier.replayed_records("pages"), ["http://www.ics.uci.edu/a"])
+
+    def test_url_taken_and_not_done_is_put_back(self):
+        frontier = self.load()
+        frontier.track_in_flight()
+        frontier.add_url("http://www.ics.uci.edu/a")
+        frontier.get_next_url()
+        frontier.log_record("pages", SEED, SEED)
+        frontier.get_next_url()
+
+        frontier = self.load()
+        frontier.track_in_flight()
+        self.assertEqual(list(frontier.urls_queue), ["http://www.ics.uci.edu/a"])
+        self.assertEqual(frontier.fetched, 1)
+
+    def test_legacy_state_is_loaded(self):
+        os.makedirs(Frontier.FRONTIER_DIR_NAME)
+        for file_name, value in ((Frontier.URL_QUEUE_FILE_NAME, deque(["http://www.ics.uci.edu/a"])),
+                                 (Frontier.URL_SET_FILE_NAME, {SEED, "http://www.ics.uci.edu/a"}),
+                                 (Frontier.FETCHED_FILE_NAME, 1)):
+            with open(file_name, "wb") as f:
+                pickle.dump(value, f)
+
+        frontier = self.load()
+        self.assertEqual(list(frontier.urls_queue), ["http://www.ics.uci.edu/a"])
+        self.assertEqual(frontier.fetched, 1)
+        self.assertTrue(frontier.is_duplicate(SEED))
+        frontier.add_url("http://www.ics.uci.edu/b")
+        frontier.save_frontier()
+
+        frontier = self.load()
+        self.assertEqual(frontier.generation, 1)
+        self.assertEqual(list(frontier.urls_queue), ["http://www.ics.uci.edu/a", "http://www.ics.uci.edu/b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from frontier_storage import HostQueue
+
+
+def urls(host, count):
+    return ["http://%s/%d" % (host, i) for i in range(count)]
+
+
+def pop_all(queue):
+    popped = []
+    while len(queue):
+        popped.append(queue.popleft())
+    return popped
+
+
+class HostQueueTest(unittest.TestCase):
+
+    def test_round_robin(self):
+        queue = HostQueue()
+        for url in urls("a", 3) + urls("b", 1) + urls("c", 2):
+            queue.append(url)
+        self.assertEqual([HostQueue.host(url) for url in pop_all(queue)], ["a", "b", "c", "a", "c", "a"])
+        self.assertEqual(queue.depths(), {})
+
+    def test_weighted_fairness(self):
+        queue = HostQueue(weights={"a": 3, "b": 2})
+        for url in urls("a", 100) + urls("b", 100) + urls("c", 100):
+            queue.append(url)
+        popped = [queue.popleft() for _ in range(60)]
+        self.assertEqual([HostQueue.host(url) for url in popped[:12]],
+                         ["a", "a", "a", "b", "b", "c", "a", "a", "a", "b", "b", "c"])
+        self.assertEqual([sum(HostQueue.host(url) == host for url in popped) for host in "abc"], [30, 20, 10])
+        # Each host in the order its urls were added
+        self.assertEqual([url for url in popped if HostQueue.host(url) == "a"], urls("a", 30))
+        self.assertEqual(len(queue), 240)
+
+    def test_max_queued(self):
+        queue = HostQueue(max_queued=2)
+        for url in urls("a", 5) + urls("b", 1):
+            queue.append(url)
+        self.assertEqual(queue.depths(), {"a": 2, "b": 1})
+        self.assertEqual(queue.dropped["a"], 3)
+        self.assertEqual(pop_all(queue), ["http://a/0", "http://b/0", "http://a/1"])
+        # Room again once taken
+        queue.append("http://a/5")
+        self.assertEqual(len(queue), 1)
+
+    def test_capped_hosts_are_skipped(self):
+        queue = HostQueue(max_fetched=2)
+        for url in urls("a", 5) + urls("b", 3) + urls("c", 1):
+            queue.append(url)
+        self.assertEqual(pop_all(queue), ["http://a/0", "http://b/0", "http://c/0", "http://a/1", "http://b/1"])
+        self.assertEqual(dict(queue.dropped), {"a": 3, "b": 1})
+        self.assertEqual(len(queue), 0)
+        # Capped hosts stay out of the ring
+        queue.append("http://a/9")
+        queue.append("http://c/9")
+        self.assertEqual(pop_all(queue), ["http://c/9"])
+        self.assertEqual(queue.dropped["a"], 4)
+
+    def test_appendleft_ignores_caps(self):
+        queue = HostQueue(max_fetched=1)
+        queue.append("http://a/0")
+        queue.append("http://b/0")
+        url = queue.popleft()
+        # A url taken but not done, put back after a restart
+        queue.appendleft(url)
+        self.assertEqual(queue.fetched["a"], 0)
+        self.assertEqual(pop_all(queue), ["http://a/0", "http://b/0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import socketserver
+import threading
+import unittest
+
+from http_fetcher import HttpFetcher
+
+BODY = b"x" * 1000
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            request_line = self.rfile.readline()
+            if not request_line:
+                return
+            headers = []
+            while True:
+                line = self.rfile.readline()
+                if line in (b"\r\n", b""):
+                    break
+                headers.append(line.decode("latin-1").strip())
+            self.server.requests.append((request_line.split()[1].decode(), headers))
+            if request_line.split()[1] == b"/chunked":
+                response = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                response += b"".join(b"%x\r\n%s\r\n" % (len(BODY[i:i + 100]), BODY[i:i + 100])
+                                     for i in range(0, len(BODY), 100)) + b"0\r\n\r\n"
+            else:
+                response = b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(BODY), BODY)
+            self.wfile.write(response)
+
+
+class HttpFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_bodies_are_cut_off_at_max_content_size(self):
+        fetcher = HttpFetcher(max_content_size=250)
+        try:
+            for path in ("/length", "/chunked", "/length"):
+                url_data = fetcher.fetch_url(self.base + path)
+                self.assertEqual(url_data["http_code"], 200)
+                self.assertEqual(url_data["content"], BODY[:250])
+        finally:
+            fetcher.close()
+        self.assertEqual([path for path, _ in self.server.requests], ["/length", "/chunked", "/length"])
+
+    def test_whole_bodies_are_read(self):
+        fetcher = HttpFetcher()
+        try:
+            self.assertEqual(fetcher.fetch_url(self.base + "/chunked")["content"], BODY)
+            self.assertEqual(fetcher.fetch_url(self.base + "/length")["content"], BODY)
+        finally:
+            fetcher.close()
+
+    def test_host_header_leaves_out_user_info(self):
+        fetcher = HttpFetcher()
+        try:
+            fetcher.fetch_url(self.base.replace("//", "//user:secret@") + "/length")
+        finally:
+            fetcher.close()
+        headers = self.server.requests[0][1]
+        self.assertIn("Host: 127.0.0.1:%d" % self.server.server_address[1], headers)
+        self.assertFalse(any("secret" in header for header in headers))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from unittest import mock
+
+from memory_governor import MB, MemoryGovernor
+
+
+class FakeStructure:
+
+    def __init__(self, calls, name, usage, usage_after, projected=None):
+        self.calls = calls
+        self.name = name
+        self.current = usage
+        self.usage_after = usage_after
+        self.projected = projected
+
+    def usage(self):
+        return self.current
+
+    def relieve(self):
+        self.calls.append(self.name)
+        freed = self.current != self.usage_after
+        self.current = self.usage_after
+        return freed
+
+    def projected_usage(self):
+        return self.projected
+
+
+class MemoryGovernorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.checkpoints = 0
+        self.governor = MemoryGovernor(1000 * MB, check_interval=10, checkpoint=self.checkpoint)
+        structures = [
+            ("cache", 400 * MB, 100 * MB, "evict", None),
+            # The largest spill, but spilling it would take more memory than it frees
+            ("index", 500 * MB, 0, "spill", 600 * MB),
+            ("queue", 300 * MB, 10 * MB, "spill", 10 * MB),
+            ("seen", 200 * MB, 150 * MB, "compact", None),
+        ]
+        self.structures = {}
+        for name, usage, usage_after, action, projected in structures:
+            structure = self.structures[name] = FakeStructure(self.calls, name, usage, usage_after, projected)
+            self.governor.register(name, structure.usage, action, structure.relieve,
+                                   structure.projected_usage if projected is not None else None)
+        self.governor.register("links", lambda: 50 * MB)
+        self.governor.last_usage = self.governor.usage()
+
+    def checkpoint(self):
+        self.checkpoints += 1
+
+    def test_actions_in_order(self):
+        freed = self.governor.relieve(1000 * MB)
+        self.assertEqual(self.calls, ["seen", "queue", "cache"])
+        self.assertEqual(freed, 50 * MB + 290 * MB + 300 * MB)
+        self.assertEqual(self.structures["index"].current, 500 * MB)
+        self.assertEqual(self.governor.last_usage["queue"], 10 * MB)
+
+    def test_stops_once_enough_is_freed(self):
+        self.assertEqual(self.governor.relieve(40 * MB), 50 * MB)
+        self.assertEqual(self.calls, ["seen"])
+        self.governor.relieve(100 * MB)
+        # Compacting again frees nothing
+        self.assertEqual(self.calls, ["seen", "seen", "queue"])
+
+    def test_projected_usage_not_lower_is_skipped(self):
+        self.structures["index"].projected = 500 * MB
+        self.governor.relieve(1000 * MB)
+        self.assertNotIn("index", self.calls)
+        self.structures["index"].projected = 499 * MB
+        self.governor.relieve(1000 * MB)
+        self.assertIn("index", self.calls)
+
+    def test_check(self):
+        with mock.patch("memory_governor.rss", return_value=800 * MB):
+            for _ in range(10):
+                self.governor.page_done()
+        self.assertEqual((self.calls, self.checkpoints, self.governor.pressure_events), ([], 0, 0))
+
+        with mock.patch("memory_governor.rss", return_value=950 * MB):
+            self.assertTrue(self.governor.check())
+            # 950 - 750 MB over the low water mark: compacting and spilling the queue are enough
+            self.assertEqual(self.calls, ["seen", "queue"])
+            self.assertEqual(self.checkpoints, 1)
+            # Not again until the RSS grows by another 150 MB
+            self.assertFalse(self.governor.check())
+        self.assertEqual(self.governor.peak_rss, 950 * MB)
+
+
+if __name__ == "__main__":
+    unittest.main()
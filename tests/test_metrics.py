@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from metrics import BUCKETS, Histogram, Metrics
+
+
+class PrometheusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.metrics = Metrics()
+        self.metrics.prometheus_file = os.path.join(self.directory.name, "metrics.prom")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def buckets(self, stage):
+        with open(self.metrics.prometheus_file) as prometheus_file:
+            lines = [line for line in prometheus_file.read().splitlines()
+                     if line.startswith('crawler_stage_seconds_bucket{stage="%s"' % stage)]
+        return [(line.split('le="')[1].split('"')[0], int(line.rsplit(" ", 1)[1])) for line in lines]
+
+    def test_histogram_buckets(self):
+        histogram = self.metrics.histograms["parse"] = Histogram()
+        for seconds in (0.0000025, 0.003, 0.003, 5000):
+            histogram.observe(seconds)
+        self.metrics.histograms["read"] = Histogram()
+        self.metrics.report()
+
+        buckets = self.buckets("parse")
+        # Every bound, empty buckets included
+        self.assertEqual(len(buckets), BUCKETS)
+        self.assertEqual([bound for bound, _ in buckets[:4]], ["1e-06", "2e-06", "4e-06", "8e-06"])
+        self.assertEqual(buckets[-1][0], "+Inf")
+        counts = [count for _, count in buckets]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual((counts[1], counts[2], counts[11], counts[12], counts[-2], counts[-1]), (0, 1, 1, 3, 3, 4))
+        self.assertEqual([bound for bound, _ in self.buckets("read")], [bound for bound, _ in buckets])
+        self.assertFalse(any(count for _, count in self.buckets("read")))
+
+
+if __name__ == "__main__":
+    unittest.main()
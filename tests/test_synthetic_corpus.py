@@ -0,0 +1,23 @@
+import os
+import tempfile
+import unittest
+
+from synthetic_corpus import SyntheticCorpus
+
+
+class SyntheticCorpusTest(unittest.TestCase):
+
+    def test_write_counts_distinct_files(self):
+        # Enough trap pages for hosts to fall into the same trap several times
+        corpus = SyntheticCorpus(pages=200, words_median=20, trap_rate=0.3, hosts=3, trap_depth=40)
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            written = corpus.write(corpus_dir)
+            self.assertEqual(written, len(os.listdir(corpus_dir)))
+        urls = [url for url, _ in SyntheticCorpus(pages=200, words_median=20, trap_rate=0.3, hosts=3,
+                                                  trap_depth=40).pages_iter()]
+        self.assertEqual(len(urls), len(set(urls)))
+        self.assertEqual(len(urls), written)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+
+from crawler import Crawler
+from url_canonicalizer import UrlCanonicalizer, corpus_key, remove_dot_segments
+
+
+class CanonicalizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.canonicalizer = UrlCanonicalizer()
+
+    def test_scheme_host_port_fragment(self):
+        self.assertEqual(self.canonicalizer.canonicalize("HTTP://WWW.ics.uci.edu:80/a#top"), "http://www.ics.uci.edu/a")
+        self.assertEqual(self.canonicalizer.canonicalize("https://www.ics.uci.edu.:443/"), "https://www.ics.uci.edu/")
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu:8080/"),
+                         "http://www.ics.uci.edu:8080/")
+
+    def test_path(self):
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu"), "http://www.ics.uci.edu/")
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu/a/./b/../c"),
+                         "http://www.ics.uci.edu/a/c")
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu/a/b/.."), "http://www.ics.uci.edu/a/")
+
+    def test_percent_escapes(self):
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu/%7Ekay/"),
+                         "http://www.ics.uci.edu/~kay/")
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu/a%2fb"),
+                         "http://www.ics.uci.edu/a%2Fb")
+
+    def test_query(self):
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu/p?y=2&x=1&x=0"),
+                         "http://www.ics.uci.edu/p?x=1&x=0&y=2")
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu/p?utm_source=a&q=1&PHPSESSID=3"),
+                         "http://www.ics.uci.edu/p?q=1")
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu/p;jsessionid=ABC?q=1"),
+                         "http://www.ics.uci.edu/p?q=1")
+
+    def test_options(self):
+        canonicalizer = UrlCanonicalizer(removed_params=(), sort_query=False)
+        self.assertEqual(canonicalizer.canonicalize("http://www.ics.uci.edu/p?y=2&utm_source=a"),
+                         "http://www.ics.uci.edu/p?y=2&utm_source=a")
+
+    def test_unparsable_url_is_unchanged(self):
+        self.assertEqual(self.canonicalizer.canonicalize("http://www.ics.uci.edu:port/"),
+                         "http://www.ics.uci.edu:port/")
+
+    def test_idempotent(self):
+        url = self.canonicalizer.canonicalize("HTTP://WWW.ics.uci.edu:80/a/../%7Eb?z=1&a=2#f")
+        self.assertEqual(self.canonicalizer.canonicalize(url), url)
+
+    def test_remove_dot_segments(self):
+        self.assertEqual(remove_dot_segments("/a/b/../../../c"), "/c")
+        self.assertEqual(remove_dot_segments("/a/."), "/a/")
+
+
+class CorpusKeyTest(unittest.TestCase):
+
+    def test_scheme_and_trailing_slash_are_ignored(self):
+        self.assertEqual(corpus_key("http://www.ics.uci.edu/a/"), "www.ics.uci.edu/a")
+        self.assertEqual(corpus_key("https://www.ics.uci.edu/a"), "www.ics.uci.edu/a")
+
+    def test_query_kept_fragment_dropped(self):
+        self.assertEqual(corpus_key("http://www.ics.uci.edu/a?x=1#top"), "www.ics.uci.edu/a?x=1")
+
+    def test_spelling_is_kept(self):
+        # The corpus is keyed by the spelling the page was crawled with, not by its canonical form
+        self.assertEqual(corpus_key("http://www.ics.uci.edu:80/%7Ekay/?b=1&a=2"), "www.ics.uci.edu:80/%7Ekay?b=1&a=2")
+
+
+class StubCorpus:
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+
+    def get_file_name(self, url):
+        return corpus_key(url) if corpus_key(url) in self.keys else None
+
+
+class CorpusSpellingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_page_stored_under_a_non_canonical_spelling(self):
+        spelling = "http://www.ics.uci.edu/wiki/doku.php?id=start&do=edit"
+        url = UrlCanonicalizer().canonicalize(spelling)
+        crawler = Crawler(None, StubCorpus([corpus_key(spelling)]))
+        try:
+            self.assertTrue(crawler.in_corpus(url, spelling))
+            self.assertEqual(crawler.corpus_url(url), spelling)
+            self.assertFalse(crawler.in_corpus("http://www.ics.uci.edu/missing", "http://www.ics.uci.edu/missing"))
+        finally:
+            crawler.discovered_file.close()
+
+    def test_page_stored_under_the_canonical_url(self):
+        url = "http://www.ics.uci.edu/a"
+        crawler = Crawler(None, StubCorpus([corpus_key(url)]))
+        try:
+            self.assertTrue(crawler.in_corpus(url, "http://WWW.ics.uci.edu/a"))
+            self.assertEqual(crawler.corpus_url(url), url)
+        finally:
+            crawler.discovered_file.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
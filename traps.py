@@ -0,0 +1,141 @@
+"""
+Crawler trap detection with a fixed memory budget. Every check is O(1): urls are reduced to a (host, path template)
+key and counted in a count-min sketch, and the query parameters last seen for a path are kept in a bounded LRU.
+"""
+import hashlib
+import re
+from array import array
+from collections import OrderedDict
+
+NUMBER = re.compile(r'^\d+$')
+NUMERIC_SEGMENT = re.compile(r'(?<=/)\d+(?=/|$)')
+# A year followed by a month, and optionally a day: 2019-10, 201910, 2019/10/31, 2019_10_31
+DATE_PATTERN = re.compile(r'(?:19|20)\d{2}[-/_]?(?:0[1-9]|1[0-2])(?:[-/_]?(?:0[1-9]|[12]\d|3[01]))?(?!\d)')
+CALENDAR_PARAMS = frozenset(["date", "day", "month", "year", "week", "time", "cal", "ical"])
+
+
+class CountMinSketch:
+    """
+    This class counts keys approximately in depth * width counters. A count is never underestimated, and with
+    conservative updates it is overestimated by at most total / width with high probability
+    """
+
+    def __init__(self, width=1 << 16, depth=4):
+        self.width = width
+        self.depth = depth
+        self.counters = [array("I", bytes(4 * width)) for _ in range(depth)]
+
+    def _indexes(self, key):
+        digest = int.from_bytes(hashlib.blake2b(key.encode("utf-8", errors="surrogatepass"), digest_size=8).digest(),
+                                "little")
+        h1 = digest & 0xffffffff
+        h2 = (digest >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key):
+        """
+        Counts one occurrence of key and returns its new estimated count
+        """
+        indexes = self._indexes(key)
+        estimate = min(row[index] for row, index in zip(self.counters, indexes)) + 1
+        for row, index in zip(self.counters, indexes):
+            if row[index] < estimate:
+                row[index] = estimate
+        return estimate
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.counters, self._indexes(key)))
+
+    def memory_usage(self):
+        return 4 * self.width * self.depth
+
+
+class TrapDetector:
+    """
+    This class detects crawler traps among the urls that passed the other url checks. Urls are expected to be unique
+    (the crawler's duplicate check runs first), so counting urls per path template counts distinct pages. check
+    returns the reason a url is a trap, or None:
+
+        query_growth: the same path was discovered with a growing set of query parameters (each set a proper superset
+            of the previous one) max_query_growth times in a row, e.g. ?a=1 -> ?a=1&b=2 -> ?a=1&b=2&c=3
+        calendar: more than max_calendar_pages urls with a date in them share a template, e.g. a calendar walked
+            one day at a time
+        pagination: more than max_numbered_pages urls share a template once their numbers are masked, e.g.
+            /news?page=1, /news?page=2, ...
+
+    Attributes:
+        template_counts: a count-min sketch of the number of urls per (host, path template)
+        query_history: an LRU of (host, path) -> (last query parameters, growth count), at most max_paths entries
+    """
+
+    def __init__(self, max_query_growth=3, max_calendar_pages=30, max_numbered_pages=100, max_paths=100000,
+                 sketch_width=1 << 16, sketch_depth=4):
+        self.max_query_growth = max_query_growth
+        self.max_calendar_pages = max_calendar_pages
+        self.max_numbered_pages = max_numbered_pages
+        self.max_paths = max_paths
+        self.template_counts = CountMinSketch(sketch_width, sketch_depth)
+        self.query_history = OrderedDict()
+
+    @staticmethod
+    def template(parsed):
+        """
+        Returns the path template of a parsed url: dates are masked with {date}, numeric path segments and query values
+        with {n}, and the query parameters are sorted by name. /news/2019-10-31/3?page=2 becomes
+        /news/{date}/{n}?page={n}, while /p263.html is left alone
+        """
+        path = NUMERIC_SEGMENT.sub("{n}", DATE_PATTERN.sub("{date}", parsed.path))
+        if not parsed.query_params:
+            return path
+        query = "&".join(sorted(key + "=" + NUMBER.sub("{n}", DATE_PATTERN.sub("{date}", values[0]))
+                                for key, values in parsed.query_params.items()))
+        return path + "?" + query
+
+    def _is_query_growth(self, parsed):
+        key = (parsed.hostname, parsed.path)
+        query = frozenset((name, tuple(values)) for name, values in parsed.query_params.items())
+        previous = self.query_history.get(key)
+        growth = 0
+        if previous is not None:
+            self.query_history.move_to_end(key)
+            previous_query, previous_growth = previous
+            if previous_query < query:
+                growth = previous_growth + 1
+        self.query_history[key] = (query, growth)
+        if len(self.query_history) > self.max_paths:
+            self.query_history.popitem(last=False)
+        return growth >= self.max_query_growth
+
+    def check(self, parsed):
+        """
+        Checks a parsed url (see url_filter.ParsedUrl). Returns the trap reason, or None
+        """
+        if self._is_query_growth(parsed):
+            return "query_growth"
+
+        template = self.template(parsed)
+        if DATE_PATTERN.search(parsed.url) or not CALENDAR_PARAMS.isdisjoint(parsed.query_params):
+            if self.template_counts.add("c %s %s" % (parsed.hostname, template)) > self.max_calendar_pages:
+                return "calendar"
+        elif "{n}" in template:
+            if self.template_counts.add("n %s %s" % (parsed.hostname, template)) > self.max_numbered_pages:
+                return "pagination"
+        return None
+
+    def shrink(self, min_paths=1000):
+        """
+        Halves the number of paths kept in the query history, down to min_paths, dropping the least recently seen ones,
+        e.g. to free memory. Returns True if paths were dropped
+        """
+        if len(self.query_history) <= min_paths:
+            return False
+        self.max_paths = max(min_paths, len(self.query_history) // 2)
+        while len(self.query_history) > self.max_paths:
+            self.query_history.popitem(last=False)
+        return True
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes used, counting 200 bytes per path in the query history
+        """
+        return self.template_counts.memory_usage() + 200 * len(self.query_history)
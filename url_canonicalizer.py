@@ -0,0 +1,119 @@
+"""
+Url canonicalization. Different spellings of the same url, e.g. http://WWW.ics.uci.edu:80/a/./b/../c?y=2&x=1#top and
+http://www.ics.uci.edu/a/c?x=1&y=2, are turned into a single canonical form, so that the crawler validates, dedupes and
+fetches each page once. corpus_key is the key the corpus stores a url under, which ignores the scheme and a trailing
+slash as well.
+"""
+import re
+from urllib.parse import urlparse, urlsplit, urlunsplit
+
+# Query parameters that only track the visitor or the session, removed by default. Matched case-insensitively against
+# the whole parameter name
+DEFAULT_REMOVED_PARAMS = (
+    r"utm_\w+", "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_gl", "ref_src",
+    "sid", "sessionid", "session_id", "phpsessid", "jsessionid", "aspsessionid\\w*", "cfid", "cftoken",
+)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# ;jsessionid=... and the like in the path
+PATH_SESSION_PATTERN = re.compile(r";(?:jsessionid|phpsessid|sid|sessionid)=[^/?#]*", re.IGNORECASE)
+PERCENT_ESCAPE_PATTERN = re.compile(r"%[0-9A-Fa-f]{2}")
+UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+
+
+def _normalize_escape(match):
+    # Escaped unreserved characters are decoded, the other escapes get uppercase hex digits
+    char = chr(int(match.group()[1:], 16))
+    return char if char in UNRESERVED else match.group().upper()
+
+
+def remove_dot_segments(path):
+    """
+    Resolves the . and .. segments of a path, as in RFC 3986 section 5.2.4
+    """
+    if "." not in path:
+        return path
+    segments = path.split("/")
+    output = []
+    for segment in segments:
+        if segment == "..":
+            if len(output) > 1:
+                output.pop()
+        elif segment != ".":
+            output.append(segment)
+    if segments[-1] in (".", ".."):
+        # /a/b/.. is the directory /a/
+        output.append("")
+    return "/".join(output)
+
+
+def corpus_key(url):
+    """
+    Returns the key the corpus stores a url under: its host, path without a trailing slash or ;parameters and query
+    """
+    parsed = urlparse(url)
+    path = parsed.path[:-1] if parsed.path[-1:] == "/" else parsed.path
+    return parsed.netloc + path + (("?" + parsed.query) if parsed.query else "")
+
+
+class UrlCanonicalizer:
+    """
+    This class turns urls into their canonical form: lowercase scheme and host, no default port, no dot segments, an
+    empty path as /, uppercase percent escapes and unescaped unreserved characters, query parameters sorted by name
+    without the tracking and session parameters, and no fragment. Urls that can't be parsed are returned unchanged.
+
+    Attributes:
+        removed_params: the patterns of the names of the query parameters removed
+        sort_query: whether query parameters are sorted by name. The order of the values of a repeated parameter is
+        kept
+    """
+
+    def __init__(self, removed_params=DEFAULT_REMOVED_PARAMS, sort_query=True):
+        self.removed_params = tuple(removed_params)
+        self.removed_params_pattern = re.compile("|".join("(?:%s)" % param for param in self.removed_params),
+                                                 re.IGNORECASE) if self.removed_params else None
+        self.sort_query = sort_query
+
+    def canonicalize(self, url):
+        try:
+            parsed = urlsplit(url.strip())
+            port = parsed.port
+        except ValueError:
+            return url
+        scheme = parsed.scheme.lower()
+        netloc = parsed.netloc
+        if parsed.hostname is not None:
+            host = parsed.hostname.rstrip(".")
+            if ":" in host:
+                host = "[%s]" % host
+            if port is not None and port != DEFAULT_PORTS.get(scheme):
+                host = "%s:%s" % (host, port)
+            userinfo = netloc.rpartition("@")[0] if "@" in netloc else ""
+            netloc = userinfo + "@" + host if userinfo else host
+
+        path = parsed.path
+        if ";" in path:
+            path = PATH_SESSION_PATTERN.sub("", path)
+        if "%" in path:
+            path = PERCENT_ESCAPE_PATTERN.sub(_normalize_escape, path)
+        path = remove_dot_segments(path)
+        if not path and netloc:
+            path = "/"
+
+        query = parsed.query
+        if query:
+            query = self.canonicalize_query(query)
+        return urlunsplit((scheme, netloc, path, query, ""))
+
+    def canonicalize_query(self, query):
+        params = [param for param in query.split("&") if param]
+        if self.removed_params_pattern is not None:
+            params = [param for param in params
+                      if not self.removed_params_pattern.fullmatch(param.partition("=")[0])]
+        if "%" in query:
+            params = [PERCENT_ESCAPE_PATTERN.sub(_normalize_escape, param) for param in params]
+        if self.sort_query:
+            params.sort(key=lambda param: param.partition("=")[0])
+        return "&".join(params)
+
@@ -0,0 +1,150 @@
+"""
+Url validation rules. UrlFilter parses a url once and runs an ordered list of precompiled rules against the parsed
+form. check returns None for a valid url, or a Rejection naming the rule that rejected it.
+"""
+import re
+from collections import namedtuple
+from urllib.parse import urlparse, parse_qs
+
+ParsedUrl = namedtuple("ParsedUrl", ["url", "scheme", "hostname", "path", "query", "query_params"])
+Rejection = namedtuple("Rejection", ["rule", "detail"])
+
+DEFAULT_EXTENSIONS = (
+    "css", "js", "bmp", "gif", "jpe?g", "ico", "png", "tiff?", "mid", "mp2", "mp3", "mp4", "wav", "avi", "mov", "mpeg",
+    "ram", "m4v", "mkv", "ogg", "ogv", "pdf", "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+    "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso", "epub", "dll", "cnf", "tgz", "sha1",
+    "thmx", "mso", "arff", "rtf", "jar", "csv", "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz",
+)
+
+NUMERIC_PATH_PATTERN = re.compile(r'/\d+/\d+/')
+# Dates (2020-12-31, 2020/12/31, 12/31/2020), session ids and other long hex-like tokens
+CALENDAR_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}|\d{4}/\d{2}/\d{2}|\d{2}/\d{2}/\d{4}|\d{4}/d{2}|\d{3}/\d{8}|[A-Za-z0-9]{32}')
+
+DEFAULT_RULES = ("scheme", "length", "query", "repetition", "numeric_path", "calendar", "host", "extension")
+
+
+class UrlFilter:
+    """
+    This class validates urls against an ordered list of rules. Every rule is a function taking a ParsedUrl and
+    returning None if the url passes, or a detail (anything but None, e.g. True) if it is rejected. The built-in rules
+    are compiled once from the configuration given to the constructor:
+
+        scheme: the scheme is not one of schemes
+        length: the url is longer than max_length characters
+        query: a query parameter repeats, has a value longer than max_query_value_length or there are more than
+            max_query_params parameters. The detail is (parameter, values) when a parameter is at fault
+        repetition: a path segment appears more than once
+        numeric_path: two consecutive numeric path segments, e.g. /2019/10/
+        calendar: a date, timestamp or session id
+        host: the host doesn't end with one of host_suffixes
+        extension: the path ends with one of extensions (regular expressions matched against the lowercase path)
+
+    Rules with state, like the crawler's duplicate detection, can be put anywhere in the order with add_rule.
+    """
+
+    def __init__(self, rules=DEFAULT_RULES, schemes=("http", "https"), host_suffixes=(".ics.uci.edu",), max_length=300,
+                 max_query_params=20, max_query_value_length=20, extensions=DEFAULT_EXTENSIONS):
+        self.schemes = frozenset(schemes)
+        self.host_suffixes = tuple(host_suffixes)
+        self.max_length = max_length
+        self.max_query_params = max_query_params
+        self.max_query_value_length = max_query_value_length
+        self.extension_pattern = re.compile(r".*\.(" + "|".join(extensions) + r")$")
+
+        built_in_rules = {
+            "scheme": self._check_scheme,
+            "length": self._check_length,
+            "query": self._check_query,
+            "repetition": self._check_repetition,
+            "numeric_path": self._check_numeric_path,
+            "calendar": self._check_calendar,
+            "host": self._check_host,
+            "extension": self._check_extension,
+        }
+        self.rules = [(name, built_in_rules[name]) for name in rules]
+
+    def add_rule(self, name, rule, before=None):
+        """
+        Adds a rule. It runs right before the rule named before, or last if before is None
+        """
+        if before is None:
+            self.rules.append((name, rule))
+            return
+        names = [rule_name for rule_name, _ in self.rules]
+        self.rules.insert(names.index(before), (name, rule))
+
+    @staticmethod
+    def parse(url):
+        """
+        Parses a url into the form the rules work on. Returns None for a url that can't be parsed
+        """
+        try:
+            parsed = urlparse(url)
+            hostname = parsed.hostname
+        except ValueError:
+            return None
+        return ParsedUrl(url, parsed.scheme, hostname, parsed.path, parsed.query,
+                         parse_qs(parsed.query) if parsed.query else {})
+
+    def check(self, url):
+        """
+        Runs the rules against a url in order. Returns None if it passes all of them, otherwise the Rejection of the
+        first rule that rejected it
+        """
+        parsed = self.parse(url)
+        if parsed is None:
+            return Rejection("malformed", None)
+        for name, rule in self.rules:
+            detail = rule(parsed)
+            if detail is not None:
+                return Rejection(name, detail)
+        return None
+
+    def check_many(self, urls):
+        """
+        Checks all of the urls, e.g. the outlinks of a page, in order. Returns the list of their check results
+        """
+        check = self.check
+        return [check(url) for url in urls]
+
+    def _check_scheme(self, parsed):
+        return None if parsed.scheme in self.schemes else True
+
+    def _check_length(self, parsed):
+        return True if len(parsed.url) > self.max_length else None
+
+    def _check_query(self, parsed):
+        query_params = parsed.query_params
+        if not query_params:
+            return None
+        for key, value in query_params.items():
+            if len(value) > 1: # multiple occurences for the same query param
+                return key, value
+            if len(value[0]) > self.max_query_value_length: # long query param value char count
+                return key, value
+        if len(query_params) > self.max_query_params: # has a very large number of parameters
+            return True
+        return None
+
+    def _check_repetition(self, parsed):
+        seen = set()
+        for segment in parsed.url.split('/'):
+            if segment:
+                if segment in seen:
+                    return segment
+                seen.add(segment)
+        return None
+
+    def _check_numeric_path(self, parsed):
+        return True if NUMERIC_PATH_PATTERN.search(parsed.url) else None
+
+    def _check_calendar(self, parsed):
+        return True if CALENDAR_PATTERN.search(parsed.url) else None
+
+    def _check_host(self, parsed):
+        if parsed.hostname is None or not parsed.hostname.endswith(self.host_suffixes):
+            return True
+        return None
+
+    def _check_extension(self, parsed):
+        return True if self.extension_pattern.match(parsed.path.lower()) else None
@@ -0,0 +1,154 @@
+"""
+Word statistics with bounded memory. WordStats counts the words of whole pages at a time and keeps only the heaviest
+words, using the Space-Saving algorithm: a word that isn't counted any more may have occurred at most error_bound
+times, and every count is an overestimate by at most the error recorded for its word.
+"""
+import heapq
+import sys
+from collections import Counter
+
+
+def count_words(words, stop_words):
+    """
+    Counts the words of a page, leaving out stop words and words that aren't purely alphabetic. Returns a Counter whose
+    words are in the order of their first occurrence. Each distinct word is checked once, instead of once per token
+    """
+    counts = Counter(words)
+    for word in [word for word in counts if word in stop_words or not word.isalpha()]:
+        del counts[word]
+    return counts
+
+
+class WordStats:
+    """
+    This class keeps the approximate frequencies of the most common words of all pages counted so far in at most
+    max_words entries. When it holds more than max_words words, only the heaviest max_words - max_words // 4 are kept
+    and error_bound is raised to the largest count dropped.
+
+    Two WordStats, e.g. the partial counts of two crawl workers, can be combined with merge. Words missing from one
+    side are counted with that side's error_bound, so the merged counts keep the same guarantees.
+
+    Attributes:
+        stop_words: words that are never counted
+        max_words: the maximum number of words kept between pages. None counts every word exactly
+        counts: word -> estimated count, an upper bound of the true count
+        errors: word -> the amount by which its count may be overestimated. Words with an exact count are left out
+        error_bound: the upper bound of the true count of any word that is not in counts
+        total: the number of words counted
+    """
+
+    def __init__(self, stop_words=frozenset(), max_words=1 << 16):
+        self.stop_words = stop_words
+        self.max_words = max_words
+        self.counts = dict()
+        self.errors = dict()
+        self.error_bound = 0
+        self.total = 0
+
+    @property
+    def exact(self):
+        return self.max_words is None
+
+    def add_page(self, words):
+        """
+        Counts the words of one page
+        :param words: the words of the page, in order. Stop words and words that aren't alphabetic are left out
+        """
+        self.add_counts(count_words(words, self.stop_words))
+
+    def add_counts(self, page_counts):
+        """
+        Adds exact counts, e.g. the result of count_words for a page
+        """
+        counts = self.counts
+        errors = self.errors
+        error_bound = self.error_bound
+        for word, count in page_counts.items():
+            previous = counts.get(word)
+            if previous is not None:
+                counts[word] = previous + count
+            else:
+                # The word may have been dropped before with a count of up to error_bound
+                counts[word] = error_bound + count
+                if error_bound:
+                    errors[word] = error_bound
+            self.total += count
+        self._prune()
+
+    def merge(self, other):
+        """
+        Adds the counts of another WordStats to this one
+        """
+        counts = self.counts
+        errors = self.errors
+        for word, count in other.counts.items():
+            previous = counts.get(word)
+            error = other.errors.get(word, 0)
+            if previous is None:
+                previous = self.error_bound
+                error += self.error_bound
+            else:
+                error += errors.get(word, 0)
+            counts[word] = previous + count
+            if error:
+                errors[word] = error
+        # Words this side counts but the other side doesn't may have occurred up to other.error_bound times there
+        if other.error_bound:
+            for word in counts:
+                if word not in other.counts:
+                    counts[word] += other.error_bound
+                    errors[word] = errors.get(word, 0) + other.error_bound
+        self.error_bound += other.error_bound
+        self.total += other.total
+        self._prune()
+
+    def _prune(self):
+        if self.max_words is None or len(self.counts) <= self.max_words:
+            return
+        keep = max(1, self.max_words - self.max_words // 4)
+        kept_words = {word for word, _ in heapq.nlargest(keep, self.counts.items(), key=lambda item: item[1])}
+        largest_dropped = max(count for word, count in self.counts.items() if word not in kept_words)
+        self.error_bound = max(self.error_bound, largest_dropped)
+        # Keep the order of first occurrence for ties
+        self.counts = {word: count for word, count in self.counts.items() if word in kept_words}
+        self.errors = {word: error for word, error in self.errors.items() if word in kept_words}
+
+    def shrink(self, min_words=1 << 12):
+        """
+        Halves the number of words kept, down to min_words, e.g. to free memory. Exact counting becomes approximate.
+        Returns True if words were dropped
+        """
+        if len(self.counts) <= min_words:
+            return False
+        self.max_words = max(min_words, len(self.counts) // 2)
+        self._prune()
+        return True
+
+    def most_common(self, n=50):
+        """
+        Returns the n words with the largest counts as (word, count, error) tuples, largest first. Ties are in order of
+        first occurrence
+        """
+        errors = self.errors
+        return [(word, count, errors.get(word, 0))
+                for word, count in heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])]
+
+    def is_guaranteed(self, word, n=50):
+        """
+        Returns True if word is certainly among the n most common words: its lowest possible count is larger than the
+        largest possible count of any word outside the current top n
+        """
+        if word not in self.counts:
+            return False
+        top = self.most_common(n + 1)
+        threshold = max(top[n][1] if len(top) > n else 0, self.error_bound)
+        return self.counts[word] - self.errors.get(word, 0) > threshold
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes taken by the counted words and the tables
+        """
+        return sys.getsizeof(self.counts) + sys.getsizeof(self.errors) + sum(map(sys.getsizeof, self.counts))
+
+    def __len__(self):
+        return len(self.counts)